@@ -0,0 +1,66 @@
+"""
+pysipp overhead benchmarks (run with ``tox -e bench``)
+"""
+import os
+import shutil
+
+import pytest
+
+from pysipp import utils
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCENS = os.path.join(HERE, os.pardir, "tests", "scens")
+
+# synthetic scenario tree: dirs per group and number of groups
+GROUP_SIZE = 20
+GROUPS = 10
+
+
+def pytest_configure(config):
+    utils.log_to_stderr(level="ERROR")
+
+
+@pytest.fixture(scope="session")
+def fakesipp():
+    """Path to the bundled fake sipp binary"""
+    return os.path.join(HERE, "fakesipp")
+
+
+@pytest.fixture
+def fakeenv(monkeypatch):
+    """Set the fake sipp's behaviour (see ``fakesipp``)"""
+
+    def setenv(exitcode=0, duration=0, stderr=""):
+        monkeypatch.setenv("FAKESIPP_EXITCODE", str(exitcode))
+        monkeypatch.setenv("FAKESIPP_DURATION", str(duration))
+        monkeypatch.setenv("FAKESIPP_STDERR", stderr)
+
+    setenv()
+    return setenv
+
+
+@pytest.fixture(scope="session")
+def groups():
+    """Number of groups in the ``scentree``"""
+    return GROUPS
+
+
+@pytest.fixture(scope="session")
+def group_size():
+    """Number of scenario dirs per group in the ``scentree``"""
+    return GROUP_SIZE
+
+
+@pytest.fixture(scope="session")
+def scentree(tmp_path_factory, groups, group_size):
+    """A tree of ``groups * group_size`` scenario dirs, every fifth with a
+    pysipp_conf.py
+    """
+    root = tmp_path_factory.mktemp("scentree")
+    for i in range(groups * group_size):
+        src = "default_with_confpy" if i % 5 == 0 else "default"
+        shutil.copytree(
+            os.path.join(SCENS, src),
+            str(root / "group{}".format(i // group_size) / "scen{}".format(i)),
+        )
+    return str(root)
@@ -0,0 +1,53 @@
+"""
+Command rendering, scenario preparation and socket allocation
+"""
+import pysipp
+from pysipp import agent
+from pysipp import ports
+
+
+def test_render(benchmark, tmp_path):
+    ua = agent.client(
+        destaddr=("127.0.0.1", 5060),
+        srcaddr=("127.0.0.1", 5070),
+        mediaaddr=("127.0.0.1", 6000),
+        call_load=(100, 1000, 10000),
+        logdir=str(tmp_path),
+        key_vals={"user": "bench", "domain": "example.com"},
+        global_vars={"count": 1},
+    )
+    ua.enable_logging(debug=True)
+    assert benchmark(ua.render)
+
+
+def test_prepare(benchmark):
+    scen = pysipp.scenario(
+        defaults={"rate": 1000, "limit": 1000, "call_count": 100000},
+        shards={"uac": 50},
+    )
+    agents = benchmark(scen.prepare)
+    assert len(agents) == 51
+
+
+def test_scenario_allocation(benchmark):
+    """Scenario creation including (leased) port allocation"""
+
+    def build():
+        scen = pysipp.scenario()
+        ports.release(scen)
+        return scen
+
+    benchmark(build)
+
+
+def test_sharded_pool_allocation(benchmark):
+    def build():
+        scen = pysipp.scenario(
+            defaults={"rate": 100, "limit": 100, "call_count": 1000},
+            shards={"uac": 20},
+            local_addrs="127.0.0.0/29",
+        )
+        ports.release(scen)
+        return scen
+
+    benchmark(build)
@@ -0,0 +1,68 @@
+"""
+Agent launching and teardown with a fake sipp
+"""
+import pytest
+
+import pysipp
+from pysipp import agent
+from pysipp import launch
+
+# agents launched per round
+AGENTS = 100
+
+
+@pytest.fixture
+def cmds(fakesipp, tmp_path):
+    uas = agent.server(bin_path=fakesipp, srcaddr=("127.0.0.1", 5060))
+    uas.enable_logging(logdir=str(tmp_path))
+    cmds = []
+    for port in range(AGENTS):
+        ua = uas.copy()
+        ua.local_port = 5060 + port
+        cmds.append(ua.render())
+    return cmds
+
+
+def test_launch(benchmark, cmds, fakeenv):
+    def run():
+        runner = launch.PopenRunner()
+        procs = runner(cmds, block=True, rate=10000)
+        assert not any(proc.returncode for proc in procs.values())
+
+    benchmark.pedantic(run, rounds=5)
+
+
+def test_teardown(benchmark, cmds, fakeenv):
+    """Stopping running agents after a timeout"""
+    fakeenv(duration=30)
+
+    def setup():
+        runner = launch.PopenRunner()
+        runner(cmds, block=False, rate=10000)
+        return (runner,), {}
+
+    def stop(runner):
+        with pytest.raises(launch.TimeoutError):
+            runner.get(timeout=0)
+
+    benchmark.pedantic(stop, setup=setup, rounds=5)
+
+
+def test_scenario_run(benchmark, fakesipp, fakeenv):
+    """A full scenario run including reporting of a failed agent"""
+    fakeenv(exitcode=1, stderr="fake failure")
+    scen = pysipp.scenario(
+        defaults={
+            "bin_path": fakesipp,
+            "rate": 100,
+            "limit": 100,
+            "call_count": 1000,
+        },
+        shards={"uac": 20},
+    )
+
+    def run():
+        with pytest.raises(pysipp.SIPpFailure):
+            scen()
+
+    benchmark.pedantic(run, rounds=5)
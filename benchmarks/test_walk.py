@@ -0,0 +1,42 @@
+"""
+Scenario tree collection
+"""
+import pytest
+
+import pysipp
+from pysipp import load
+
+
+@pytest.fixture
+def walk(groups, group_size):
+    def walk(root, **kwargs):
+        count = 0
+        for path, scen in pysipp.walk(root, **kwargs):
+            count += 1
+        assert count == groups * group_size
+
+    return walk
+
+
+def test_walk_cold(benchmark, walk, scentree):
+    def setup():
+        load._xml_meta.clear()
+
+    benchmark.pedantic(walk, args=(scentree,), setup=setup, rounds=5)
+
+
+def test_walk_warm(benchmark, walk, scentree):
+    walk(scentree)
+    benchmark.pedantic(walk, args=(scentree,), rounds=5)
+
+
+def test_walk_indexed(benchmark, walk, scentree, tmp_path):
+    index = str(tmp_path / "index.json")
+    walk(scentree, index=index)
+    benchmark.pedantic(
+        walk, args=(scentree,), kwargs={"index": index}, rounds=5
+    )
+
+
+def test_walk_threaded(benchmark, walk, scentree):
+    benchmark.pedantic(walk, args=(scentree,), kwargs={"workers": 8}, rounds=5)
@@ -17,38 +17,82 @@
 """
 pysipp - a python wrapper for launching SIPp
 """
+import subprocess
 import sys
+import time
 from os.path import dirname
 
 from . import agent
 from . import launch
+from . import load
+from . import netns
 from . import netplug
 from . import plugin
+from . import ports
+from . import profiler
 from . import report
+from . import results
+from . import utils
 from .agent import client
 from .agent import server
 from .load import iter_scen_dirs
+from .profiler import profile
+
+log = utils.get_logger()
 
 
 class SIPpFailure(RuntimeError):
-    """SIPp commands failed"""
+    """SIPp commands failed. The run's `pysipp.results.RunResult` is
+    available as `result`.
+    """
+
+    result = None
 
 
 __package__ = "pysipp"
 __author__ = "Tyler Goodlet (tgoodlet@gmail.com)"
 
-__all__ = ["walk", "client", "server", "plugin"]
+__all__ = ["walk", "client", "server", "plugin", "profile"]
+
+# opt-in profiling of the whole process (see `pysipp.profiler`)
+profiler.start_from_env()
 
 
-def walk(rootpath, delay_conf_scen=False, autolocalsocks=True, **scenkwargs):
+def walk(
+    rootpath,
+    delay_conf_scen=False,
+    autolocalsocks=True,
+    index=None,
+    workers=None,
+    ordered=True,
+    cache=None,
+    **scenkwargs,
+):
     """SIPp scenario generator.
 
     Build and return scenario objects for each scenario directory.
     Most hook calls are described here.
+
+    If `index` is provided (see `pysipp.load.iter_scen_dirs`) the scenario
+    tree listing is cached on disk and only changed directories are rescanned.
+
+    If `workers` is set, directory discovery, xml metadata extraction,
+    pysipp_conf.py loading and scenario configuration are performed in a
+    pool of that many threads and scenarios are delivered as they become
+    ready (in collection order if `ordered` is set).
+
+    If a `pysipp.results.ResultCache` is provided as `cache`, scenarios
+    which already passed with the same inputs are skipped.
     """
-    with plugin.register([netplug] if autolocalsocks else []):
-        hooks = plugin.mng.hook
-        for path, xmls, confpy in iter_scen_dirs(rootpath):
+    # hooks for this walk are isolated from other threads and from the
+    # caller's context between iterations
+    hookctx = plugin.context([netplug] if autolocalsocks else [])
+    hooks = hookctx.hook
+
+    def iter_collected(pool):
+        for path, xmls, confpy in iter_scen_dirs(
+            rootpath, index=index, pool=pool
+        ):
             # sanity checks
             for xml in xmls:
                 assert dirname(xml) == path
@@ -56,43 +100,71 @@ def walk(rootpath, delay_conf_scen=False, autolocalsocks=True, **scenkwargs):
                 assert dirname(confpy.__file__) == path
 
             # predicate hook based filtering
-            res = hooks.pysipp_load_scendir(
-                path=path, xmls=xmls, confpy=confpy
-            )
+            with plugin.activate(hookctx):
+                res = hooks.pysipp_load_scendir(
+                    path=path, xmls=xmls, confpy=confpy
+                )
             if res and not all(res):
                 continue
 
-            agents = []
-            for xml in xmls:
-                if "uac" in xml.lower():
-                    ua = agent.client(scen_file=xml)
-                    agents.append(ua)
-                elif "uas" in xml.lower():
-                    ua = agent.server(scen_file=xml)
-                    agents.insert(0, ua)  # servers are always launched first
-                else:
-                    raise ValueError(
-                        "xml script must contain one of 'uac' or 'uas':\n"
-                        f"{xml}"
-                    )
-
-            if delay_conf_scen:
-                # default scen impl
-                scen = agent.Scenario(agents, confpy=confpy)
-
+            yield path, xmls, confpy
+
+    def configure(item):
+        with profiler.span("configure", path=item[0]):
+            return _configure(item)
+
+    def _configure(item):
+        path, xmls, confpy = load.preload(item, confpy=not delay_conf_scen)
+        agents = []
+        for xml in xmls:
+            if "uac" in xml.lower():
+                ua = agent.client(scen_file=xml)
+                agents.append(ua)
+            elif "uas" in xml.lower():
+                ua = agent.server(scen_file=xml)
+                agents.insert(0, ua)  # servers are always launched first
             else:
+                raise ValueError(
+                    f"xml script must contain one of 'uac' or 'uas':\n{xml}"
+                )
+
+        if delay_conf_scen:
+            # default scen impl
+            scen = agent.Scenario(agents, confpy=confpy)
+
+        else:
+            with plugin.activate(hookctx):
                 scen = hooks.pysipp_conf_scen_protocol(
                     agents=agents,
                     confpy=confpy,
                     scenkwargs=scenkwargs,
                 )
 
+        return path, scen
+
+    with utils.thread_pool(workers) as pool:
+        for path, scen in utils.imap(
+            configure,
+            iter_collected(pool),
+            pool=pool,
+            ordered=ordered,
+            window=2 * (workers or 1),
+        ):
+            if cache is not None and cache.passed(scen):
+                log.info("skipping '{}' which already passed".format(path))
+                continue
             yield path, scen
 
 
-def scenario(dirpath=None, proxyaddr=None, autolocalsocks=True, **scenkwargs):
-    """Return a single Scenario loaded from `dirpath` if provided else the
-    basic default call flow.
+def scenario(
+    dirpath=None,
+    proxyaddr=None,
+    autolocalsocks=True,
+    agents=None,
+    **scenkwargs,
+):
+    """Return a single Scenario loaded from `dirpath` if provided else one
+    of `agents` (by default the basic call flow's server and client).
     """
     if dirpath:
         # deliver single scenario from dir
@@ -102,12 +174,11 @@ def scenario(dirpath=None, proxyaddr=None, autolocalsocks=True, **scenkwargs):
     else:
         with plugin.register([netplug] if autolocalsocks else []):
             # deliver the default scenario bound to loopback sockets
-            uas = agent.server()
-            uac = agent.client()
+            agents = agents or [agent.server(), agent.client()]
 
             # same as above
             scen = plugin.mng.hook.pysipp_conf_scen_protocol(
-                agents=[uas, uac], confpy=None, scenkwargs=scenkwargs
+                agents=list(agents), confpy=None, scenkwargs=scenkwargs
             )
 
     if proxyaddr:
@@ -136,24 +207,23 @@ def pysipp_conf_scen_protocol(agents, confpy, scenkwargs):
         ua = agents[0]
         assert dirname(confpy.__file__) == dirname(ua.scen_file)
 
-    hooks = plugin.mng.hook
     # register pysipp_conf.py module temporarily so that each scenario only
     # hooks a single pysipp_conf.py
     with plugin.register([confpy]):
+        hooks = plugin.mng.hook
+
         # default scen impl
         scen = agent.Scenario(agents, confpy=confpy)
 
         # order the agents for launch
-        agents = (
-            list(
-                hooks.pysipp_order_agents(
-                    agents=scen.agents,
-                    clients=scen.clients,
-                    servers=scen.servers,
-                )
+        ordered = list(
+            hooks.pysipp_order_agents(
+                agents=scen.agents,
+                clients=scen.clients,
+                servers=scen.servers,
             )
-            or agents
         )
+        agents = ordered + scen.responders if ordered else agents
 
         # create scenario wrapper
         scen = hooks.pysipp_new_scen(
@@ -191,6 +261,10 @@ def pysipp_conf_scen(agents, scen):
         uas = scen.prepare_agent(list(scen.servers.values())[0])
         scen.clientdefaults.setdefault("destaddr", uas.srcaddr or servers_addr)
 
+    elif scen.responders:
+        # point all clients to the 'primary' in-process responder
+        scen.clientdefaults.setdefault("destaddr", scen.responders[0].srcaddr)
+
     elif not scen.clientdefaults.proxyaddr:
         # no servers in scenario so point proxy addr to remote socket addr
         scen.clientdefaults.proxyaddr = scen.clientdefaults.destaddr
@@ -203,8 +277,10 @@ def pysipp_conf_scen(agents, scen):
 
 
 @plugin.hookimpl
-def pysipp_new_runner():
+def pysipp_new_runner(scen):
     """Provision and assign a default cmd runner"""
+    if getattr(scen, "netns", False):
+        return netns.NetnsRunner()
     return launch.PopenRunner()
 
 
@@ -214,14 +290,30 @@ def pysipp_run_protocol(scen, runner, block, timeout, raise_exc):
     PopenRunner which runs commands locally.
     """
     # use provided runner or default provided by hook
-    runner = runner or plugin.mng.hook.pysipp_new_runner()
+    runner = runner or plugin.mng.hook.pysipp_new_runner(scen=scen)
     agents = scen.prepare()
+    # leased ports are given back after each run so take them again
+    netplug.relock(scen, agents)
 
-    def finalize(cmds2procs=None, timeout=180, raise_exc=True):
+    def finalize(cmds2procs=None, timeout=180, raise_exc=True, timedout=False):
         """Wait for all remaining agents in the scenario to finish executing
         and perform error and logfile reporting.
         """
         cmds2procs = cmds2procs or runner.get(timeout=timeout)
+        for srv in responders:
+            srv.close()
+        # all agents have been reaped so give back any leased ports
+        ports.release(scen)
+        plugin.mng.hook.pysipp_scen_finished(
+            scen=scen,
+            cmds2procs=cmds2procs,
+            timedout=timedout,
+            timestamp=time.monotonic(),
+        )
+        result = runner.result = results.RunResult.from_run(
+            scen, agents, cmds2procs, timedout=timedout
+        )
+        plugin.mng.hook.pysipp_run_result(result=result)
         agents2procs = list(zip(agents, cmds2procs.values()))
         msg = report.err_summary(agents2procs)
         if msg:
@@ -230,19 +322,81 @@ def pysipp_run_protocol(scen, runner, block, timeout, raise_exc):
             if raise_exc:
                 # raise RuntimeError on agent failure(s)
                 # (HINT: to rerun type `scen()` from the debugger)
-                raise SIPpFailure(msg)
+                err = SIPpFailure(msg)
+                err.result = result
+                raise err
 
         return cmds2procs
 
+    # free up any leased ports held by placeholder sockets
+    ports.unplug(scen)
+
+    # serve in-process responders for the duration of the run
+    responders = []
+    try:
+        for srv in scen.responders:
+            responders.append(srv(block=False))
+    except Exception:
+        for srv in responders:
+            srv.close()
+        raise
+
+    rendered = {}
+
+    def iter_cmds():
+        for ua in agents:
+            with profiler.span("render", agent=ua.name):
+                cmd = ua.render()
+            rendered[cmd] = ua
+            yield cmd
+
+    runkwargs = {}
+    retries = getattr(scen, "bind_retries", 0)
+    if retries:
+
+        def relaunch(cmd, proc):
+            """Relaunch agents which fail to bind their sockets at startup
+            on newly allocated ports.
+            """
+            nonlocal retries
+            try:
+                proc.wait(timeout=scen.bind_window)
+                proc.streams = launch.Streams(*proc.communicate())
+            except subprocess.TimeoutExpired:
+                return None  # up and running
+
+            ua = rendered[cmd]
+            if (
+                retries
+                and report.is_bind_failure(
+                    proc.returncode, proc.streams.stderr
+                )
+                and netplug.reallocate(scen, agents, ua)
+            ):
+                retries -= 1
+                log.warning(
+                    "'{}' failed to bind with exit code {}, relaunching "
+                    "on {}".format(ua.name, proc.returncode, ua.srcaddr)
+                )
+                newcmd = ua.render()
+                rendered[newcmd] = ua
+                return newcmd
+
+        runkwargs["relaunch"] = relaunch
+
     try:
         # run all agents (raises RuntimeError on timeout)
         cmds2procs = runner(
-            (ua.render() for ua in agents), block=block, timeout=timeout
+            iter_cmds(), block=block, timeout=timeout, **runkwargs
         )
     except launch.TimeoutError:  # sucessful timeout
-        cmds2procs = finalize(timeout=0, raise_exc=False)
+        cmds2procs = finalize(timeout=0, raise_exc=False, timedout=True)
         if raise_exc:
             raise
+    except Exception:
+        for srv in responders:
+            srv.close()
+        raise
     else:
         # async
         if not block:
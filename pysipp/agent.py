@@ -11,14 +11,25 @@ from os import path
 
 from shutil import which
 
+from . import background
 from . import command
+from . import inject
+from . import load
 from . import plugin
+from . import profiler
 from . import utils
 
 log = utils.get_logger()
 
 SocketAddr = namedtuple("SocketAddr", "ip port")
 
+# SIPp's default Call-ID format
+DEFAULT_CID_STR = "%u-%p@%s"
+# base CSeq offset between shards of an agent
+CSEQ_STRIDE = 2**20
+# media ports consumed per agent (rtp, rtcp and video pairs)
+MEDIA_PORT_STEP = 4
+
 
 def tuple_property(attrs):
     def getter(self):
@@ -52,13 +63,28 @@ class UserAgent(command.SippCmd):
     _debug_log_types = "calldebug message".split()
     _to_console = "screen"
 
+    # (index, count) if this agent is one shard of a logical agent
+    _shard = None
+
     @property
     def name(self):
         """Compute the name identifier for this agent based the scenario script
         or scenario name
         """
+        if self._shard:
+            return "{}.{}".format(self.logical_name, self._shard[0])
+        return self.logical_name
+
+    @property
+    def logical_name(self):
+        """Name of the agent this agent is a shard of (or its own name)"""
         return self.scen_name or path2namext(self.scen_file) or str(None)
 
+    @property
+    def shard_info(self):
+        """(index, count) pair if this agent is a shard else None"""
+        return self._shard
+
     srcaddr = tuple_property(("local_host", "local_port"))
     destaddr = tuple_property(("remote_host", "remote_port"))
     mediaaddr = tuple_property(("media_addr", "media_port"))
@@ -87,6 +113,64 @@ class UserAgent(command.SippCmd):
             **kwargs
         )
 
+    def shard(self, count):
+        """Split this agent into `count` agents which together generate the
+        same load.
+
+        The `rate`, `limit` and `call_count` are divided between shards,
+        injection files are partitioned round robin and each shard gets
+        distinct `base_cseq` and `cid_str` values. Explicitly set local and
+        media ports are offset per shard.
+        """
+        if self._shard:
+            raise ValueError("{} is already a shard".format(self.name))
+        if count < 1:
+            raise ValueError("Shard count must be positive")
+
+        loads = {}
+        for key in ("limit", "call_count"):
+            total = getattr(self, key)
+            if total is None:
+                continue
+            if total < count:
+                raise ValueError(
+                    "Can't split {} of {} over {} shards".format(
+                        key, total, count
+                    )
+                )
+            loads[key] = _split(total, count)
+
+        rate = self.rate
+        if rate is not None:
+            if isinstance(rate, int) and rate >= count:
+                loads["rate"] = _split(rate, count)
+            else:
+                loads["rate"] = [rate / count] * count
+
+        info_file = self.info_file
+        if info_file:
+            loads["info_file"] = inject.partition(info_file, count)
+        info_files = self.info_files
+        if info_files:
+            parts = [inject.partition(inf, count) for inf in info_files]
+            loads["info_files"] = [list(files) for files in zip(*parts)]
+
+        shards = []
+        for i in range(count):
+            ua = self.copy()
+            ua._shard = (i, count)
+            for key, parts in loads.items():
+                setattr(ua, key, parts[i])
+            if self.local_port:
+                ua.local_port = self.local_port + i
+            if self.media_port:
+                ua.media_port = self.media_port + i * MEDIA_PORT_STEP
+            ua.base_cseq = (self.base_cseq or 1) + i * CSEQ_STRIDE
+            ua.cid_str = "{}-{}".format(i, self.cid_str or DEFAULT_CID_STR)
+            shards.append(ua)
+
+        return shards
+
     def is_client(self):
         return "uac" in self.name.lower()
 
@@ -125,6 +209,10 @@ class UserAgent(command.SippCmd):
         if not self.scen_file:
             return False
 
+        if patt == "play_pcap_audio":
+            # cached (and possibly indexed) scan of the script
+            return load.xml_meta(self.scen_file)["plays_media"]
+
         with open(self.scen_file, "r") as sf:
             return bool(re.search(patt, sf.read()))
 
@@ -148,6 +236,11 @@ class UserAgent(command.SippCmd):
                 logattrs,
                 self.iter_logfile_items("_debug_log_types"),
             )
+        if self.trace_stat:
+            # statistics (see `pysipp.results`) are opt-in
+            logattrs = itertools.chain(
+                logattrs, [("stat_file", self.stat_file)]
+            )
         # prefix all log file paths
         for name, attr in logattrs:
             setattr(
@@ -163,6 +256,12 @@ class UserAgent(command.SippCmd):
         self.enable_tracing()
 
 
+def _split(total, count):
+    """Split integer `total` into `count` near equal parts"""
+    part, rem = divmod(total, count)
+    return [part + (i < rem) for i in range(count)]
+
+
 def path2namext(filepath):
     if not filepath:
         return None
@@ -241,8 +340,6 @@ def Scenario(agents, **kwargs):
 
     If called it will invoke the standard run hooks.
     """
-    scentype = type("Scenario", (ScenarioType,), {})
-
     _defs = OrderedDict(deepcopy(_scen_defaults_template))
     # for any passed kwargs that have keys in ``_defaults_template``, set them
     # as the new defaults for the scenario
@@ -256,9 +353,15 @@ def Scenario(agents, **kwargs):
     if user_defaults:
         _defs.update(user_defaults)
 
-    # this gives us scen.<param> attribute access to scen.defaults
-    utils.DictProxy(_defs, UserAgent.keys(), cls=scentype)
-    return scentype(agents, _defs, **kwargs)
+    return ScenarioType(agents, _defs, **kwargs)
+
+
+def Scenarios(agents, count, **kwargs):
+    """Build `count` independent scenarios from a single template built
+    from `agents` and `kwargs` (see `Scenario`).
+    """
+    template = Scenario(agents, **kwargs)
+    return [template.copy() for _ in range(count)]
 
 
 class ScenarioType(object):
@@ -276,35 +379,113 @@ class ScenarioType(object):
         serverdefaults=None,
         confpy=None,
         enable_screen_file=True,
+        bind_retries=0,
+        bind_window=0.25,
+        netns=False,
+        local_addrs=None,
+        shards=None,
     ):
         # agents iterable in launch-order
-        self._agents = agents
-        ua_attrs = UserAgent.keys()
+        agents = list(agents)
+        self._agents = [
+            ua
+            for ua in agents
+            if not isinstance(ua, background.BackgroundServer)
+        ]
+
+        # in-process servers (eg. `pysipp.responder.Responder`) standing in
+        # for server agents: never spawned but served for each run
+        self.responders = [
+            ua for ua in agents if isinstance(ua, background.BackgroundServer)
+        ]
 
         # default settings
         self._defaults = defaults
-        self.defaults = utils.DictProxy(self._defaults, ua_attrs)()
+        self.defaults = _DefaultsProxy(self._defaults)
 
         # client settings
         self._clientdefaults = OrderedDict(
             clientdefaults or deepcopy(_minimum_defaults_template)
         )
-        self.clientdefaults = utils.DictProxy(self._clientdefaults, ua_attrs)()
+        self.clientdefaults = _DefaultsProxy(self._clientdefaults)
 
         # server settings
         self._serverdefaults = OrderedDict(
             serverdefaults or deepcopy(_minimum_defaults_template)
         )
-        self.serverdefaults = utils.DictProxy(self._serverdefaults, ua_attrs)()
+        self.serverdefaults = _DefaultsProxy(self._serverdefaults)
 
         # hook module
         self.mod = confpy
         self.enable_screen_file = enable_screen_file
 
+        # relaunch agents which fail to bind their (auto-allocated) sockets
+        # within `bind_window` seconds of being spawned at most
+        # `bind_retries` times per run
+        self.bind_retries = bind_retries
+        self.bind_window = bind_window
+
+        # run agents in a private network namespace (see `pysipp.netns`)
+        self.netns = netns
+
+        # pool of local addresses (a network or sequence of addresses) to
+        # spread auto-allocated agent sockets over (see `pysipp.ports`)
+        self.local_addrs = local_addrs
+
+        # agent name -> port attributes auto-allocated by `pysipp.netplug`
+        self.autoports = {}
+
+        # split agents (by name) into this many shards run in parallel; the
+        # load and ports they're configured with are divided (see
+        # `UserAgent.shard`) but a `limit` or `call_count` left at the
+        # built-in default applies to each shard
+        self.shards = dict(shards or {})
+        if self.shards:
+            self._agents = list(self._iter_sharded(self._agents))
+
+    def _iter_sharded(self, agents):
+        for ua in agents:
+            count = self.shards.get(ua.name)
+            if not count or ua.shard_info:
+                yield ua
+                continue
+
+            # divide the load this agent would run with in this scenario
+            # and offset the ports it would bind
+            prepared = self.prepare_agent(ua)
+            template = ua.copy()
+            for key in (
+                "rate",
+                "limit",
+                "call_count",
+                "info_file",
+                "local_port",
+                "media_port",
+            ):
+                if getattr(template, key) is not None:
+                    continue
+                value = getattr(prepared, key)
+                if (
+                    key in ("limit", "call_count")
+                    and value == _scen_defaults_template[key]
+                ):
+                    # built-in defaults apply to each shard
+                    continue
+                setattr(template, key, value)
+            if not template.info_files and prepared.info_files:
+                template.info_files = prepared.info_files
+
+            for shard in template.shard(count):
+                yield shard
+
     @property
     def agents(self):
         return OrderedDict((ua.name, ua) for ua in self._agents)
 
+    def shardsof(self, name):
+        """Return all agents which are shards of the agent `name`"""
+        return [ua for ua in self._agents if ua.logical_name == name]
+
     @property
     def clients(self):
         return OrderedDict(
@@ -408,7 +589,8 @@ class ScenarioType(object):
 
         params = merge(ordered)
         log.debug("{} merged contents:\n{}".format(agent.name, params))
-        ua = UserAgent(defaults=params)
+        ua = type(agent)(defaults=params)
+        ua._shard = agent._shard
 
         ua.enable_logging(enable_screen_file=self.enable_screen_file)
 
@@ -424,8 +606,9 @@ class ScenarioType(object):
         """
         copies = []
         agents = agents or self._agents
-        for agent in agents:
-            copies.append(self.prepare_agent(agent))
+        with profiler.span("prepare"):
+            for agent in agents:
+                copies.append(self.prepare_agent(agent))
         return copies
 
     def from_settings(self, **kwargs):
@@ -446,10 +629,31 @@ class ScenarioType(object):
 
         return scenario(**scenkwargs)
 
+    def copy(self):
+        """Return an independent copy of this scenario and its agents"""
+        # responders are shared and so can't be served by concurrent copies
+        scen = type(self)(
+            [ua.copy() for ua in self._agents] + self.responders,
+            deepcopy(self._defaults),
+            clientdefaults=deepcopy(self._clientdefaults),
+            serverdefaults=deepcopy(self._serverdefaults),
+            confpy=self.mod,
+            enable_screen_file=self.enable_screen_file,
+            bind_retries=self.bind_retries,
+            bind_window=self.bind_window,
+            netns=self.netns,
+            local_addrs=self.local_addrs,
+            shards=self.shards,
+        )
+        scen.autoports = deepcopy(self.autoports)
+        return scen
+
     def from_agents(self, agents=None, autolocalsocks=True, **scenkwargs):
         """Create a new scenario from prepared agents."""
         return type(self)(
-            self.prepare(agents), self._defaults, confpy=self.mod
+            self.prepare(agents) + self.responders,
+            self._defaults,
+            confpy=self.mod,
         )
 
     def __call__(
@@ -470,3 +674,10 @@ class ScenarioType(object):
             raise_exc=raise_exc,
             **kwargs
         )
+
+
+# proxy type providing attribute access to scenario defaults dicts
+_DefaultsProxy = utils.dictproxy_type(tuple(UserAgent.keys()))
+
+# this gives us scen.<param> attribute access to scen.defaults
+utils.add_dictproxy_attrs(ScenarioType, UserAgent.keys(), "_defaults")
@@ -0,0 +1,82 @@
+"""
+Base for the in-process asyncio servers (responder, relay)
+"""
+import abc
+import asyncio
+import threading
+
+
+class BackgroundServer(abc.ABC):
+    """Base for asyncio servers which implement ``start()`` and ``stop()``
+    coroutines and may also be served from a background thread by calling
+    them, like a non-blocking agent. ``start()`` must set ``_loop`` to the
+    running loop.
+
+    Servers listen on (``host``, ``port``), available as ``srcaddr``, and
+    may be passed among the agents of a `pysipp.agent.Scenario` to be
+    served for each of its runs.
+    """
+
+    name = "server"
+    _thread = None
+    _loop = None
+
+    @abc.abstractmethod
+    async def start(self):
+        """Start serving on the running loop and set ``_loop`` to it"""
+
+    @abc.abstractmethod
+    async def stop(self):
+        """Stop serving and release all sockets"""
+
+    def __call__(self, block=False, timeout=None, **kwargs):
+        """Serve in a background thread returning this server. If `block`,
+        serve for `timeout` seconds (forever if None) and stop.
+        """
+        if self._thread and self._thread.is_alive():
+            raise RuntimeError("{} is already running".format(self.name))
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+        errors = []
+
+        def run():
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self.start())
+            except Exception as err:
+                errors.append(err)
+                return
+            finally:
+                started.set()
+            loop.run_forever()
+            loop.run_until_complete(self.stop())
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+        started.wait()
+        if errors:
+            loop.close()
+            raise errors[0]
+        if block:
+            self._thread.join(timeout)
+            self.close()
+        return self
+
+    def close(self, timeout=5):
+        """Stop serving from the background thread"""
+        if not self._thread:
+            return
+        if self._loop and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def __enter__(self):
+        if not self._thread:
+            self()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,132 @@
+"""
+The ``pysipp`` command
+"""
+import argparse
+import os
+import sys
+
+from .. import compare
+from .. import results
+
+
+def _format_value(value):
+    return "{:.4g}".format(value)
+
+
+def run_compare(args):
+    path = args.db or results.default_db_path()
+    if not os.path.isfile(path):
+        sys.stderr.write("no results database at {}\n".format(path))
+        return 2
+    sink = results.SQLiteSink(path)
+
+    builds = {}
+    for build in (args.baseline, args.candidate):
+        builds[build] = compare.load_runs(sink, build, scenario=args.scenario)
+        if not builds[build]:
+            sys.stderr.write(
+                "no runs with statistics for build {!r}\n".format(build)
+            )
+            return 2
+    baseline, candidate = builds[args.baseline], builds[args.candidate]
+
+    metrics = compare.METRICS
+    if args.metric:
+        metrics = {name: metrics[name] for name in args.metric}
+    comparisons = compare.compare(
+        baseline,
+        candidate,
+        alpha=args.alpha,
+        threshold=args.threshold,
+        metrics=metrics,
+    )
+    for name in sorted(set(baseline) ^ set(candidate)):
+        sys.stderr.write(
+            "skipping {!r}: not run by both builds\n".format(name)
+        )
+
+    rows = [("scenario", "metric", "baseline", "candidate", "change", "p", "")]
+    for cmp in comparisons:
+        rows.append(
+            (
+                cmp.scenario,
+                cmp.metric,
+                _format_value(cmp.baseline),
+                _format_value(cmp.candidate),
+                "{:+.1%}".format(cmp.change),
+                "{:.3f}".format(cmp.pvalue),
+                "REGRESSION" if cmp.regression else "",
+            )
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        sys.stdout.write(
+            "  ".join(
+                cell.ljust(width) for cell, width in zip(row, widths)
+            ).rstrip()
+            + "\n"
+        )
+
+    regressions = [cmp for cmp in comparisons if cmp.regression]
+    if regressions:
+        sys.stdout.write(
+            "{} regression(s) in {} comparison(s)\n".format(
+                len(regressions), len(comparisons)
+            )
+        )
+        return 1
+    return 0
+
+
+def main(argv=None):
+    """Run a pysipp sub-command."""
+    parser = argparse.ArgumentParser(prog="pysipp")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    cmp = commands.add_parser(
+        "compare",
+        help="compare runs of two builds recorded in a results database",
+        description="Compare the runs of a candidate build against a "
+        "baseline build per scenario and exit with status 1 on a "
+        "significant regression (see pysipp.results.SQLiteSink).",
+    )
+    cmp.add_argument("baseline", help="baseline build label")
+    cmp.add_argument("candidate", help="candidate build label")
+    cmp.add_argument(
+        "--db",
+        default=None,
+        help="results database (default: {})".format(
+            results.default_db_path()
+        ),
+    )
+    cmp.add_argument("-s", "--scenario", help="only compare this scenario")
+    cmp.add_argument(
+        "-m",
+        "--metric",
+        action="append",
+        choices=list(compare.METRICS),
+        help="metric to compare (repeatable, default: all)",
+    )
+    cmp.add_argument(
+        "--alpha",
+        type=float,
+        default=0.05,
+        help="significance level of the Mann-Whitney U test "
+        "(default: %(default)s)",
+    )
+    cmp.add_argument(
+        "--threshold",
+        type=float,
+        default=0.0,
+        help="relative change of the median to tolerate, eg. 0.05 for 5%% "
+        "(default: %(default)s)",
+    )
+    cmp.set_defaults(func=run_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
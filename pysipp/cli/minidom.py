@@ -1,6 +1,8 @@
 import functools
 from xml.dom import minidom
 from xml.dom.minidom import Node
+from xml.dom.minidom import getDOMImplementation  # noqa: F401
+from xml.dom.minidom import parse  # noqa: F401
 
 
 @functools.total_ordering
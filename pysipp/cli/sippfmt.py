@@ -1,9 +1,34 @@
 from __future__ import print_function
 
 import argparse
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tempfile
 import types
+from xml.parsers import expat
 
 from . import minidom
+from .. import utils
+
+# bump whenever the formatted output changes (invalidates caches)
+FORMAT_VERSION = 1
+# encoding of formatted scripts
+ENCODING = "ISO-8859-1"
+INDENT = "  "
+# bytes handed to the parser at a time when streaming
+CHUNK_SIZE = 1 << 16
+
+# everything before the scenario tag (see `monkeypatch_scenario_xml`)
+HEADER = (
+    '<?xml version="1.0" encoding="{}"?>\n'
+    "<!DOCTYPE scenario\n  SYSTEM 'sipp.dtd'>\n\n".format(ENCODING)
+)
 
 
 def copy_tree(doc, node):
@@ -74,6 +99,9 @@ def process_document(filepath):
     Process the document with minidom, process it for consistency, and
     emit a new document. Minidom is used since we need to preserve the
     structure of the XML document rather than its content.
+
+    This builds two full DOMs; `format_stream` produces identical output
+    in constant memory.
     """
     dom = minidom.parse(filepath)
     scenario = next(
@@ -114,16 +142,468 @@ def process_document(filepath):
     return doc
 
 
-def main():
+# kinds of open elements tracked while streaming
+DOCUMENT, SCENARIO, STEP, COPY, SKIP = range(5)
+
+
+def _escape(data):
+    # same as `minidom._write_data`
+    data = data.replace("&", "&amp;").replace("<", "&lt;")
+    return data.replace('"', "&quot;").replace(">", "&gt;")
+
+
+class _Frame(object):
+    """An open element of the input document"""
+
+    __slots__ = ("kind", "tag", "indent", "opened", "sep", "skip", "last")
+
+    def __init__(self, kind, tag=None, indent=""):
+        self.kind = kind
+        self.tag = tag
+        self.indent = indent
+        # whether the start tag has been closed with '>'
+        self.opened = False
+        # a separator (blank line) is due before the next child
+        self.sep = False
+        # the next child is dropped (see `_Formatter._child`)
+        self.skip = False
+        # node type of the last child in the input document
+        self.last = None
+
+
+class _Formatter(object):
+    """Incremental equivalent of `process_document` which writes output
+    text to `write` as the input is fed through expat.
+
+    Only the currently open elements and the data of a single CDATA
+    section are held in memory.
+    """
+
+    def __init__(self, write):
+        self.write = write
+        self.stack = [_Frame(DOCUMENT)]
+        self.found = False
+        self.in_cdata = False
+        # whether the current CDATA section has produced a node yet
+        self.cdata_node = False
+        # data of the CDATA section being collected for output
+        self.cdata = None
+
+        # configured like `xml.dom.expatbuilder` so that node boundaries
+        # (which determine skipped nodes) match those of `minidom.parse`
+        parser = self.parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.ordered_attributes = True
+        parser.specified_attributes = True
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.CharacterDataHandler = self.char_data
+        parser.CommentHandler = self.comment
+        parser.ProcessingInstructionHandler = self.pi
+        parser.StartCdataSectionHandler = self.start_cdata
+        parser.EndCdataSectionHandler = self.end_cdata
+        parser.ExternalEntityRefHandler = lambda *args: 1
+
+    def feed(self, data):
+        self.parser.Parse(data, False)
+
+    def close(self):
+        self.parser.Parse(b"", True)
+        if not self.found:
+            raise ValueError("No <scenario> element found")
+
+    def _child(self, frame, node_type):
+        """Account for a new child node of `frame` returning whether it is
+        processed.
+
+        `process_document` moves comments and processing instructions
+        out of the child list it is iterating which skips the following
+        sibling; that is reproduced here.
+        """
+        frame.last = node_type
+        if frame.skip:
+            frame.skip = False
+            return False
+        return True
+
+    def _open(self, frame):
+        """Prepare `frame` for writing a child"""
+        if not frame.opened:
+            self.write(">\n")
+            frame.opened = True
+        if frame.sep:
+            self.write("\n")
+            frame.sep = False
+
+    def start_element(self, name, attrs):
+        frame = self.stack[-1]
+        if frame.kind == DOCUMENT:
+            if name == "scenario":
+                self.found = True
+                self.write(HEADER + "<scenario")
+                child = _Frame(SCENARIO)
+            else:
+                child = _Frame(SKIP)
+        elif frame.kind == SKIP or not self._child(
+            frame, minidom.Node.ELEMENT_NODE
+        ):
+            child = _Frame(SKIP)
+        else:
+            self._open(frame)
+            pairs = list(zip(attrs[::2], attrs[1::2]))
+            if frame.kind == SCENARIO:
+                kind = STEP
+                values = dict(pairs)
+                names = sorted(values, key=minidom.AttributeSorter)
+                pairs = [(key, values[key]) for key in names]
+            else:
+                kind = COPY
+            child = _Frame(kind, name, frame.indent + INDENT)
+            self.write(
+                child.indent
+                + "<"
+                + name
+                + "".join(
+                    ' {}="{}"'.format(key, _escape(value))
+                    for key, value in pairs
+                )
+            )
+        self.stack.append(child)
+
+    def end_element(self, name):
+        frame = self.stack.pop()
+        if frame.kind in (STEP, COPY):
+            if frame.opened:
+                self.write("{}</{}>\n".format(frame.indent, frame.tag))
+            else:
+                self.write("/>\n")
+            if frame.kind == STEP:
+                self.stack[-1].sep = True
+        elif frame.kind == SCENARIO:
+            self.write("</scenario>\n" if frame.opened else "/>\n")
+
+    def comment(self, data):
+        frame = self.stack[-1]
+        if frame.kind in (DOCUMENT, SKIP) or not self._child(
+            frame, minidom.Node.COMMENT_NODE
+        ):
+            return
+        if "--" in data:
+            raise ValueError("'--' is not allowed in a comment node")
+        self._open(frame)
+        self.write("{}<!--{}-->\n".format(frame.indent + INDENT, data))
+        frame.skip = True
+
+    def pi(self, target, data):
+        frame = self.stack[-1]
+        if frame.kind in (DOCUMENT, SKIP) or not self._child(
+            frame, minidom.Node.PROCESSING_INSTRUCTION_NODE
+        ):
+            return
+        # only kept at the top level
+        if frame.kind == SCENARIO:
+            self._open(frame)
+            self.write(
+                "{}<?{} {}?>\n".format(frame.indent + INDENT, target, data)
+            )
+            frame.skip = True
+
+    def start_cdata(self):
+        self.in_cdata = True
+        self.cdata_node = False
+
+    def end_cdata(self):
+        self.in_cdata = False
+        if self.cdata is None:
+            return
+        frame = self.stack[-1]
+        data = "".join(self.cdata).strip()
+        self.cdata = None
+
+        # see `monkeypatch_sipp_cdata_xml`
+        indent = frame.indent + INDENT
+        self._open(frame)
+        self.write(indent + "<![CDATA[\n\n")
+        for line in data.splitlines():
+            self.write((indent + INDENT + line.strip()).rstrip() + "\n")
+        self.write("\n" + indent + "]]>\n")
+
+    def char_data(self, data):
+        frame = self.stack[-1]
+        if frame.kind in (DOCUMENT, SKIP):
+            return
+        if self.in_cdata:
+            if self.cdata_node:
+                # continuation of the same node
+                if self.cdata is not None:
+                    self.cdata.append(data)
+                return
+            self.cdata_node = True
+            if (
+                self._child(frame, minidom.Node.CDATA_SECTION_NODE)
+                and frame.kind == STEP
+            ):
+                self.cdata = [data]
+        elif frame.last != minidom.Node.TEXT_NODE:
+            # adjacent text is merged into a single node
+            self._child(frame, minidom.Node.TEXT_NODE)
+
+
+def format_stream(infile, outfile):
+    """Format the sipp script read from binary file `infile` writing the
+    result to binary file `outfile`.
+
+    The output is identical to that of `process_document` but the input
+    is processed incrementally.
+    """
+    out = io.TextIOWrapper(
+        outfile, encoding=ENCODING, errors="xmlcharrefreplace", newline="\n"
+    )
+    try:
+        fmt = _Formatter(out.write)
+        for chunk in iter(functools.partial(infile.read, CHUNK_SIZE), b""):
+            fmt.feed(chunk)
+        fmt.close()
+    finally:
+        out.flush()
+        out.detach()
+
+
+def new_hasher():
+    """Return a hash object for content digests which also covers
+    `FORMAT_VERSION`.
+    """
+    return hashlib.sha1("sippfmt-{}\0".format(FORMAT_VERSION).encode())
+
+
+def file_digest(path):
+    """Return the content digest of `path`"""
+    return utils.file_digest(path, new_hasher(), chunk_size=CHUNK_SIZE)
+
+
+def default_cache_path():
+    """Return the default location of the `FormatCache`"""
+    return utils.cache_path("sippfmt.json")
+
+
+class FormatCache(utils.JSONKeySet):
+    """A persistent set of the content digests (see `file_digest`) of files
+    known to be formatted.
+
+    Digests cover the formatter version so bumping `FORMAT_VERSION`
+    invalidates all entries. Only the `max_entries` most recently used
+    digests are kept.
+    """
+
+
+class _Compare(io.RawIOBase):
+    """Writable stream which compares what's written to it with binary
+    file `original` and copies it to `sink` if given. The digest of the
+    written content is accumulated in `hasher`.
+    """
+
+    def __init__(self, original, sink=None):
+        self.original = original
+        self.sink = sink
+        self.same = True
+        self.hasher = new_hasher()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        if self.same and self.original.read(len(data)) != data:
+            self.same = False
+        if self.sink:
+            self.sink.write(data)
+        self.hasher.update(data)
+        return len(data)
+
+    def matched(self):
+        """Whether everything written so far is the entire original"""
+        return self.same and not self.original.read(1)
+
+
+def _format_path(path, in_place=False):
+    # return whether `path` was unformatted and the digest of the output
+    with open(path, "rb") as infile, open(path, "rb") as original:
+        if not in_place:
+            compare = _Compare(original)
+            format_stream(infile, io.BufferedWriter(compare))
+            return not compare.matched(), compare.hasher.hexdigest()
+
+        fd, tmp = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as sink:
+                compare = _Compare(original, sink)
+                format_stream(infile, io.BufferedWriter(compare))
+            changed = not compare.matched()
+            if changed:
+                shutil.copymode(path, tmp)
+                os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return changed, compare.hasher.hexdigest()
+
+
+def format_path(path, in_place=False):
+    """Format sipp script `path` and return whether it was unformatted.
+
+    With `in_place` unformatted files are replaced by their formatted
+    version.
+    """
+    return _format_path(path, in_place=in_place)[0]
+
+
+def iter_paths(paths, recursive=False):
+    """Yield the sipp scripts in `paths` descending into directories
+    (sorted) if `recursive`.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        if not recursive:
+            raise ValueError("{} is a directory (use -r)".format(path))
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.endswith(".xml"):
+                    yield os.path.join(dirpath, name)
+
+
+def _check_path(path, in_place=False):
+    try:
+        return (path,) + _format_path(path, in_place=in_place) + (None,)
+    except (ValueError, OSError, expat.ExpatError) as err:
+        return path, None, None, str(err)
+
+
+def _is_cached(path, cache):
+    try:
+        return file_digest(path) in cache
+    except OSError:
+        # reported when formatting
+        return False
+
+
+def check_paths(paths, in_place=False, jobs=1, cache=None):
+    """Yield a (path, unformatted, error) tuple for every sipp script in
+    `paths` (in order) using a pool of `jobs` processes.
+
+    Files whose content is in `cache` (a `FormatCache`) are known to be
+    formatted and aren't processed; files found to be formatted are added.
+    """
+    paths = list(paths)
+    cached = set()
+    if cache is not None:
+        cached = {path for path in paths if _is_cached(path, cache)}
+    todo = [path for path in paths if path not in cached]
+
+    func = functools.partial(_check_path, in_place=in_place)
+    with contextlib.ExitStack() as stack:
+        if jobs == 1 or len(todo) < 2:
+            results = map(func, todo)
+        else:
+            pool = stack.enter_context(
+                concurrent.futures.ProcessPoolExecutor(jobs or None)
+            )
+            results = pool.map(func, todo, chunksize=8)
+
+        for path in paths:
+            if path in cached:
+                yield path, False, None
+                continue
+            path, changed, digest, error = next(results)
+            # the file now holds the output unless only checked
+            if cache is not None and digest and (in_place or not changed):
+                cache.add(digest)
+            yield path, changed, error
+
+
+def main(argv=None):
     """Format sipp scripts."""
     parser = argparse.ArgumentParser(description="Format sipp scripts")
-    parser.add_argument("filename")
-    args = parser.parse_args()
+    parser.add_argument("paths", nargs="+", metavar="path")
+    parser.add_argument(
+        "-r",
+        "--recursive",
+        action="store_true",
+        help="format all .xml files below directory paths",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of processes to format with (0: one per cpu)",
+    )
+    parser.add_argument(
+        "-i",
+        "--in-place",
+        action="store_true",
+        help="rewrite unformatted files instead of writing to stdout",
+    )
+    parser.add_argument(
+        "-c",
+        "--check",
+        action="store_true",
+        help="exit with status 1 if any file is unformatted",
+    )
+    parser.add_argument(
+        "--cache",
+        default=None,
+        help="file recording already formatted content "
+        "(default: {})".format(default_cache_path()),
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="process every file regardless of the cache",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        paths = list(iter_paths(args.paths, recursive=args.recursive))
+    except ValueError as err:
+        parser.error(str(err))
+
+    if not (args.in_place or args.check):
+        out = sys.stdout.buffer
+        for path in paths:
+            with open(path, "rb") as infile:
+                format_stream(infile, out)
+        out.flush()
+        return 0
 
-    doc = process_document(args.filename)
-    xml = doc.toprettyxml(indent="  ", encoding="ISO-8859-1")
-    print(xml, end="")
+    cache = None
+    if not args.no_cache:
+        cache = FormatCache(args.cache or default_cache_path())
+
+    status = 0
+    for path, changed, error in check_paths(
+        paths, in_place=args.in_place, jobs=args.jobs, cache=cache
+    ):
+        if error:
+            print("error: {}: {}".format(path, error), file=sys.stderr)
+            status = 2
+        elif changed:
+            print(
+                "{} {}".format(
+                    "reformatted" if args.in_place else "would reformat", path
+                ),
+                file=sys.stderr,
+            )
+            if args.check:
+                status = max(status, 1)
+    if cache is not None:
+        cache.save()
+    return status
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
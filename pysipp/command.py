@@ -1,10 +1,12 @@
 """
 Command string rendering
 """
+import copy
 import socket
 import string
 from collections import OrderedDict
 
+from . import resolver
 from . import utils
 
 log = utils.get_logger()
@@ -46,10 +48,9 @@ class AddrField(Field):
         if not value:
             return
 
-        try:
-            socket.inet_pton(socket.AF_INET6, value)
+        if resolver.ip_family(value) == socket.AF_INET6:
             name = "'[{}]'".format(value)
-        except socket.error:
+        else:
             name = "'{}'".format(value)
 
         return self.fmtstr.format(**{self.name: name})
@@ -158,7 +159,22 @@ def cmdstrtype(spec):
 
         @classmethod
         def keys(cls):
-            return [key for key, descr in cls.descriptoritems()]
+            # computed once per type since introspection is expensive
+            keys = cls.__dict__.get("_keys")
+            if keys is None:
+                keys = tuple(key for key, descr in cls.descriptoritems())
+                cls._keys = keys
+            return list(keys)
+
+        def copy(self):
+            """Return a copy of this command with field values copied one
+            level deep.
+            """
+            new = copy.copy(self)
+            new._values = {
+                key: copy.copy(val) for key, val in self._values.items()
+            }
+            return new
 
         def applydict(self, d):
             """Apply contents of dict `d` onto local instance variables."""
@@ -228,6 +244,15 @@ sipp_spec = [
     "-rp {rate_period} ",
     "-users {users} ",
     "-deadcall_wait {deadcall_wait} ",
+    # rate ramping (see `pysipp.rate`)
+    "-rate_increase {rate_increase} ",
+    "-rate_max {rate_max} ",
+    "-rate_interval {rate_interval} ",
+    ("-no_rate_quit {no_rate_quit}", BoolField),
+    # reconnection
+    "-max_reconnect {max_reconnect} ",
+    "-reconnect_sleep {reconnect_sleep} ",
+    "-reconnect_close {reconnect_close} ",
     # data insertion
     ("-key {key_vals} ", DictField),
     ("-set {global_vars} ", DictField),
@@ -239,6 +264,8 @@ sipp_spec = [
     "-inf {info_file} ",
     ("-inf {info_files} ", ListField),
     "-screen_file {screen_file} ",
+    "-stf {stat_file} ",
+    "-fd {stat_period} ",
     # bool flags
     ("-rtp_echo {rtp_echo}", BoolField),
     ("-timeout_error {timeout_error}", BoolField),
@@ -249,6 +276,7 @@ sipp_spec = [
     ("-trace_msg {trace_message}", BoolField),
     ("-trace_logs {trace_log}", BoolField),
     ("-trace_screen {trace_screen}", BoolField),
+    ("-trace_stat {trace_stat}", BoolField),
     ("-error_overwrite {error_overwrite}", BoolField),
     ("{remote_host}", AddrField),  # NOTE: no space
     ":{remote_port}",
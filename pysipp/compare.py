@@ -0,0 +1,229 @@
+"""
+Statistical comparison of recorded runs (see `pysipp.results`) between a
+baseline and a candidate build
+"""
+import math
+import statistics
+from collections import namedtuple
+from collections import OrderedDict
+
+from . import utils
+
+log = utils.get_logger()
+
+# column prefix of the first response time histogram in SIPp statistics
+RTT_HISTOGRAM = "ResponseTimeRepartition1_"
+PERCENTILES = (50, 95, 99)
+
+# metric -> whether higher values are better
+METRICS = OrderedDict(
+    [("cps", True), ("failure_ratio", False)]
+    + [("rtt_p{}_ms".format(p), False) for p in PERCENTILES]
+)
+
+Comparison = namedtuple(
+    "Comparison",
+    "scenario metric baseline candidate change pvalue regression",
+)
+Comparison.__doc__ = """Comparison of one metric of a scenario.
+
+``baseline`` and ``candidate`` are the median values over each set of runs,
+``change`` is the relative change of the median and ``regression`` is set
+when the change is significant and worse by more than the threshold.
+"""
+
+
+def histogram(stats, prefix=RTT_HISTOGRAM):
+    """Return the (lower, upper, count) buckets of a SIPp repartition
+    histogram in `stats` (the upper bound of the last bucket is None)
+    """
+    buckets = []
+    lower = 0
+    start = len(prefix)
+    for key, count in stats.items():
+        if not key.startswith(prefix) or not isinstance(count, int):
+            continue
+        bound = key[start:]
+        if bound.startswith("<"):
+            upper = float(bound[1:])
+            buckets.append((lower, upper, count))
+            lower = upper
+        elif bound.startswith(">="):
+            buckets.append((float(bound[2:]), None, count))
+    return buckets
+
+
+def percentile(buckets, pct):
+    """Estimate the `pct` percentile of a histogram by interpolating within
+    its buckets (values in the open last bucket are its lower bound)
+    """
+    total = sum(count for _, _, count in buckets)
+    if not total:
+        return None
+    target = total * pct / 100.0
+    seen = 0
+    for lower, upper, count in buckets:
+        if count and seen + count >= target:
+            if upper is None:
+                return lower
+            return lower + (upper - lower) * (target - seen) / count
+        seen += count
+    return buckets[-1][0]
+
+
+def run_metrics(agents):
+    """Compute the compared metrics for one run from the SIPp statistics of
+    its (logical) agents, a sequence of `pysipp.results.AgentResult` (see
+    `pysipp.results.RunResult.logical_agents`); metrics which can't be
+    computed are omitted.
+
+    Only client agents count unless there are none.
+    """
+    clients = [ua for ua in agents if ua.client] or list(agents)
+    clients = [ua.stats for ua in clients if ua.stats]
+    metrics = {}
+    if not clients:
+        return metrics
+
+    rates = [stats.get("CallRate(C)") for stats in clients]
+    if all(isinstance(rate, (int, float)) for rate in rates):
+        metrics["cps"] = float(sum(rates))
+
+    failed = sum(stats.get("FailedCall(C)") or 0 for stats in clients)
+    calls = failed + sum(
+        stats.get("SuccessfulCall(C)") or 0 for stats in clients
+    )
+    if calls:
+        metrics["failure_ratio"] = failed / float(calls)
+
+    merged = {}
+    for stats in clients:
+        for lower, upper, count in histogram(stats):
+            key = (lower, upper)
+            merged[key] = merged.get(key, 0) + count
+    buckets = sorted(
+        ((lower, upper, count) for (lower, upper), count in merged.items()),
+        key=lambda bucket: bucket[0],
+    )
+    for pct in PERCENTILES:
+        value = percentile(buckets, pct)
+        if value is not None:
+            metrics["rtt_p{}_ms".format(pct)] = value
+    return metrics
+
+
+def _exact_pvalue(u, n1, n2):
+    """Two-sided p-value of the Mann-Whitney statistic `u` from its exact
+    distribution (valid without ties)
+    """
+    # table[(i, j)][k] is the number of orderings of samples of sizes i and
+    # j giving U == k (Mann & Whitney's recurrence over sample sizes)
+    table = {(0, j): [1] for j in range(n2 + 1)}
+    for i in range(1, n1 + 1):
+        table[(i, 0)] = [1]
+        for j in range(1, n2 + 1):
+            # the largest value is either from the first sample (adding j
+            # to U) or from the second
+            a, b = table[(i - 1, j)], table[(i, j - 1)]
+            dist = [0] * (i * j + 1)
+            for k, count in enumerate(a):
+                dist[k + j] += count
+            for k, count in enumerate(b):
+                dist[k] += count
+            table[(i, j)] = dist
+    counts = table[(n1, n2)]
+    total = float(sum(counts))
+    lower = min(u, n1 * n2 - u)
+    tail = sum(counts[: int(math.floor(lower)) + 1]) / total
+    return min(1.0, 2 * tail)
+
+
+def mann_whitney_u(xs, ys):
+    """Two-sided Mann-Whitney U test of samples `xs` and `ys` returning
+    (U of `xs`, p-value).
+
+    The p-value is exact for small samples without ties, otherwise the
+    normal approximation with tie and continuity corrections is used.
+    """
+    n1, n2 = len(xs), len(ys)
+    if not n1 or not n2:
+        raise ValueError("Both samples must be non-empty")
+    pooled = sorted([(x, 0) for x in xs] + [(y, 1) for y in ys])
+    # average ranks of tied values
+    ranks = [0.0] * len(pooled)
+    ties = []
+    i = 0
+    while i < len(pooled):
+        j = i
+        while j + 1 < len(pooled) and pooled[j + 1][0] == pooled[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2.0 + 1
+        if j > i:
+            ties.append(j - i + 1)
+        i = j + 1
+
+    r1 = sum(rank for rank, (_, group) in zip(ranks, pooled) if group == 0)
+    u = r1 - n1 * (n1 + 1) / 2.0
+    if not ties and n1 + n2 <= 40:
+        return u, _exact_pvalue(u, n1, n2)
+
+    n = n1 + n2
+    mean = n1 * n2 / 2.0
+    tiecorr = sum(t**3 - t for t in ties) / float(n * (n - 1))
+    var = n1 * n2 / 12.0 * (n + 1 - tiecorr)
+    if var <= 0:
+        # all values are equal
+        return u, 1.0
+    z = (abs(u - mean) - 0.5) / math.sqrt(var)
+    return u, min(1.0, math.erfc(max(z, 0) / math.sqrt(2)))
+
+
+def compare(baseline, candidate, alpha=0.05, threshold=0.0, metrics=METRICS):
+    """Compare the per run metrics of `baseline` and `candidate` runs, each
+    a dict of scenario name -> list of metric dicts (see `run_metrics`),
+    and return a list of `Comparison` for each scenario and metric
+    present in both sets.
+
+    A regression is a change in the worse direction which is significant
+    at level `alpha` and larger than `threshold` (relative to the baseline
+    median).
+    """
+    comparisons = []
+    for scenario in sorted(set(baseline) & set(candidate)):
+        for metric, higher_is_better in metrics.items():
+            xs = [run[metric] for run in baseline[scenario] if metric in run]
+            ys = [run[metric] for run in candidate[scenario] if metric in run]
+            if not xs or not ys:
+                continue
+            base, cand = statistics.median(xs), statistics.median(ys)
+            if base:
+                change = (cand - base) / abs(base)
+            else:
+                change = 0.0 if cand == base else math.copysign(1, cand)
+            _, pvalue = mann_whitney_u(xs, ys)
+            worse = -change if higher_is_better else change
+            comparisons.append(
+                Comparison(
+                    scenario,
+                    metric,
+                    base,
+                    cand,
+                    change,
+                    pvalue,
+                    pvalue < alpha and worse > threshold,
+                )
+            )
+    return comparisons
+
+
+def load_runs(sink, build, scenario=None):
+    """Return the run metrics of `build` recorded in results database
+    `sink` as a dict of scenario name -> list of metric dicts
+    """
+    runs = OrderedDict()
+    for result in sink.run_results(build, scenario=scenario):
+        metrics = run_metrics(result.logical_agents)
+        if metrics:
+            runs.setdefault(result.scenario, []).append(metrics)
+    return runs
@@ -26,7 +26,8 @@ def pysipp_post_ua_defaults(ua):
 def pysipp_load_scendir(path, xmls, confpy):
     """Called once for every scenario directory that is scanned and loaded by
     `pysipp.load.iter_scen_dirs`. The `xmls` arg is a list of path strings and
-    `confpy` is the imported conf.py module if one exists or None.
+    `confpy` is a lazily imported (see `pysipp.utils.LazyMod`) conf.py module
+    if one exists or None.
 
     A single implementation of this hook must return `True` to include the
     scanned dir as a collected scenario and all must return `False` if the
@@ -68,10 +69,10 @@ def pysipp_conf_scen(agents, scen):
 
 
 @hookspec(firstresult=True)
-def pysipp_new_runner():
+def pysipp_new_runner(scen):
     """Create and return a runner instance to be used for invoking
-    multiple SIPp commands. The runner must be callable and support both a
-    `block` and `timeout` kwarg.
+    multiple SIPp commands for `scen`. The runner must be callable and
+    support both a `block` and `timeout` kwarg.
     """
 
 
@@ -80,3 +81,40 @@ def pysipp_run_protocol(scen, runner, block, timeout, raise_exc):
     """Perform steps to execute all SIPp commands usually by calling a
     preconfigured command launcher/runner.
     """
+
+
+# Lifecycle hooks (timestamps are `time.monotonic()` values)
+@hookspec
+def pysipp_agent_spawned(cmd, pid, timestamp):
+    """Called by the runner just after the SIPp process for `cmd` has been
+    spawned.
+    """
+
+
+@hookspec
+def pysipp_agent_exited(cmd, pid, returncode, rusage, timestamp):
+    """Called by the runner once the SIPp process for `cmd` has been reaped.
+    `rusage` is its `resource.struct_rusage` (see `os.wait4`) or None if
+    unavailable.
+    """
+
+
+@hookspec
+def pysipp_agent_signalled(cmd, pid, signum, timestamp):
+    """Called by the runner when it sends `signum` to the SIPp process for
+    `cmd`, either after another agent failed or on timeout.
+    """
+
+
+@hookspec
+def pysipp_scen_finished(scen, cmds2procs, timedout, timestamp):
+    """Called once all agents of `scen` have completed (or were stopped
+    after a timeout) just before errors are reported.
+    """
+
+
+@hookspec
+def pysipp_run_result(result):
+    """Called with the `pysipp.results.RunResult` of every scenario run
+    (eg. to persist it, see `pysipp.results.SQLiteSink`).
+    """
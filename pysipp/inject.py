@@ -0,0 +1,352 @@
+"""
+SIPp injection (``-inf``) file handling
+"""
+import contextlib
+import errno
+import hashlib
+import itertools
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+
+from . import utils
+
+log = utils.get_logger()
+
+# injection file read modes (the first token of the header line)
+MODES = ("SEQUENTIAL", "RANDOM", "USER")
+
+# field separator used by SIPp
+DELIMITER = ";"
+
+# large write buffers since files may hold millions of records
+BUFSIZE = 1 << 20
+
+# seconds between checks for readers of injection feed pipes
+POLL_INTERVAL = 0.005
+
+
+def default_outdir():
+    return os.path.join(tempfile.gettempdir(), "pysipp-inject")
+
+
+def format_record(record):
+    """Return the injection file line (without newline) for `record` which
+    is either a preformatted string or a sequence of fields.
+    """
+    if isinstance(record, str):
+        return record
+    return DELIMITER.join(map(str, record))
+
+
+def _check_header(header):
+    mode = header.split(",")[0].strip().upper()
+    if mode not in MODES:
+        raise ValueError(
+            "Injection file header must start with one of {}, not {}".format(
+                MODES, header
+            )
+        )
+
+
+def _paths(outdir, name, digest, partitions):
+    if partitions == 1:
+        return [os.path.join(outdir, "{}-{}.csv".format(name, digest))]
+    return [
+        os.path.join(
+            outdir, "{}-{}.part{}of{}.csv".format(name, digest, i, partitions)
+        )
+        for i in range(partitions)
+    ]
+
+
+def _digest(*items):
+    return hashlib.sha1(repr(items).encode()).hexdigest()[:16]
+
+
+def generate(
+    records,
+    header="SEQUENTIAL",
+    partitions=1,
+    key=None,
+    name="inf",
+    outdir=None,
+):
+    """Stream `records` (strings or field sequences) into SIPp injection
+    files and return their paths.
+
+    With `partitions` > 1 records are distributed round robin over that
+    many files (eg. one per agent shard) which each begin with `header`.
+
+    Files are named by content hash so identical populations share files.
+    If a hashable `key` which uniquely identifies the population is given,
+    files previously generated for it are returned without consuming
+    `records` at all.
+    """
+    _check_header(header)
+    if partitions < 1:
+        raise ValueError("Partition count must be positive")
+    outdir = outdir or default_outdir()
+    os.makedirs(outdir, exist_ok=True)
+
+    if key is not None:
+        digest = _digest(key, header, partitions)
+        paths = _paths(outdir, name, digest, partitions)
+        if all(map(os.path.isfile, paths)):
+            log.debug("reusing injection files {}".format(paths))
+            return paths
+
+    hasher = hashlib.sha1(repr((header, partitions)).encode())
+    tmps, files = [], []
+    try:
+        for _ in range(partitions):
+            fd, tmp = tempfile.mkstemp(dir=outdir, suffix=".tmp")
+            tmps.append(tmp)
+            files.append(os.fdopen(fd, "w", buffering=BUFSIZE))
+            files[-1].write(header + "\n")
+
+        count = 0
+        writers = itertools.cycle([f.write for f in files])
+        for record in records:
+            line = format_record(record) + "\n"
+            next(writers)(line)
+            if key is None:
+                hasher.update(line.encode())
+            count += 1
+
+        for f in files:
+            f.close()
+
+        if count < partitions:
+            raise ValueError(
+                "Can't partition {} records into {} files".format(
+                    count, partitions
+                )
+            )
+
+        if key is None:
+            digest = hasher.hexdigest()[:16]
+        paths = _paths(outdir, name, digest, partitions)
+        for tmp, path in zip(tmps, paths):
+            # atomic so concurrent generators never see partial files
+            os.replace(tmp, path)
+    except BaseException:
+        for f, tmp in itertools.zip_longest(files, tmps):
+            if f:
+                f.close()
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        raise
+
+    log.debug("generated {} records into {}".format(count, paths))
+    return paths
+
+
+def _iter_records(lines):
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.strip():
+            yield line
+
+
+def read(path):
+    """Return the (header, records) lines of injection file `path`.
+
+    The first line of an injection file is always its read mode header
+    (eg. ``SEQUENTIAL``); blank lines are dropped.
+    """
+    with open(path, "r") as inf:
+        header = inf.readline().rstrip("\n")
+        return header, list(_iter_records(inf))
+
+
+def partition(path, count, outdir=None):
+    """Split injection file `path` into `count` files which each contain
+    the original header and every `count`-th record (round robin) and
+    return their paths.
+
+    Partitions are cached until `path` is modified.
+    """
+    if stat.S_ISFIFO(os.stat(path).st_mode):
+        # reading would consume the feed meant for an agent
+        raise ValueError("Can't partition injection feed {}".format(path))
+    with open(path, "r") as inf:
+        st = os.fstat(inf.fileno())
+        header = inf.readline().rstrip("\n")
+        return generate(
+            _iter_records(inf),
+            header=header,
+            partitions=count,
+            key=(os.path.abspath(path), st.st_mtime_ns, st.st_size),
+            name=os.path.splitext(os.path.basename(path))[0],
+            outdir=outdir,
+        )
+
+
+def _write_records(files, header, records):
+    for f in files:
+        f.write(header + "\n")
+    writers = itertools.cycle([f.write for f in files])
+    for record in records:
+        next(writers)(format_record(record) + "\n")
+
+
+class Feed(object):
+    """Injection data served to agents straight from `records` without
+    first writing files to disk.
+
+    With ``kind="fifo"`` records are written to named pipes by a background
+    thread as agents read them so agents can be launched immediately.
+    Each pipe must have exactly one reader: it is read once by a single
+    agent (SIPp reads injection files once at startup) and agents sharing
+    a path would split its records between them or block forever.
+
+    With ``kind="memfd"`` records are written to anonymous in-memory files
+    (Linux only) before returning, avoiding any disk I/O.
+
+    Records are distributed round robin over `partitions` paths
+    (eg. one per agent shard).
+    """
+
+    def __init__(
+        self,
+        records,
+        header="SEQUENTIAL",
+        partitions=1,
+        kind="fifo",
+        dirpath=None,
+    ):
+        _check_header(header)
+        if partitions < 1:
+            raise ValueError("Partition count must be positive")
+        self.kind = kind
+        self.error = None
+        self._closed = False
+        self._fds = []
+        self._dir = None
+        self._writer = None
+
+        if kind == "fifo":
+            self._dir = tempfile.mkdtemp(prefix="pysipp-feed-", dir=dirpath)
+            self.paths = []
+            for i in range(partitions):
+                path = os.path.join(self._dir, "part{}.csv".format(i))
+                os.mkfifo(path, 0o600)
+                self.paths.append(path)
+            self._writer = threading.Thread(
+                target=self._feed, args=(header, records)
+            )
+            self._writer.daemon = True
+            self._writer.start()
+
+        elif kind == "memfd":
+            try:
+                with contextlib.ExitStack() as stack:
+                    files = []
+                    for i in range(partitions):
+                        fd = os.memfd_create("pysipp-feed-{}".format(i))
+                        self._fds.append(fd)
+                        files.append(
+                            stack.enter_context(
+                                os.fdopen(
+                                    fd, "w", buffering=BUFSIZE, closefd=False
+                                )
+                            )
+                        )
+                    _write_records(files, header, records)
+            except BaseException:
+                self.close()
+                raise
+            # readable by child processes while this feed is open
+            self.paths = [
+                "/proc/{}/fd/{}".format(os.getpid(), fd) for fd in self._fds
+            ]
+        else:
+            raise ValueError("Unknown feed kind {}".format(kind))
+
+    @property
+    def path(self):
+        """The path of a single partition feed"""
+        if len(self.paths) != 1:
+            raise ValueError("Feed has {} partitions".format(len(self.paths)))
+        return self.paths[0]
+
+    def _open_pipes(self):
+        """Open every pipe for writing as soon as its reader arrives (in
+        any order) returning None if the feed is closed first.
+        """
+        fds = {}
+        try:
+            while len(fds) < len(self.paths):
+                if self._closed:
+                    return None
+                for path in self.paths:
+                    if path in fds:
+                        continue
+                    try:
+                        fds[path] = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+                    except OSError as err:
+                        # no reader yet
+                        if err.errno != errno.ENXIO:
+                            raise
+                time.sleep(POLL_INTERVAL)
+        except BaseException:
+            for fd in fds.values():
+                os.close(fd)
+            raise
+
+        files = []
+        for path in self.paths:
+            os.set_blocking(fds[path], True)
+            files.append(os.fdopen(fds[path], "w", buffering=BUFSIZE))
+        return files
+
+    def _feed(self, header, records):
+        files = None
+        try:
+            files = self._open_pipes()
+            if files:
+                _write_records(files, header, records)
+        except BrokenPipeError:
+            if not self._closed:
+                log.warning("reader of injection feed exited early")
+        except Exception as err:
+            log.exception("injection feed failed")
+            self.error = err
+        finally:
+            for f in files or ():
+                try:
+                    f.close()
+                except BrokenPipeError:
+                    pass
+
+    def wait(self, timeout=None):
+        """Block until all records have been consumed (fifo feeds)"""
+        if self._writer:
+            self._writer.join(timeout=timeout)
+            return not self._writer.is_alive()
+        return True
+
+    def close(self):
+        """Stop feeding and remove all pipes or memory files"""
+        self._closed = True
+        if self._writer:
+            self._writer.join(timeout=1)
+            if self._writer.is_alive():
+                # blocked writing to a reader which isn't reading
+                log.warning("injection feed writer failed to stop")
+        if self._dir:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+        for fd in self._fds:
+            os.close(fd)
+        del self._fds[:]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
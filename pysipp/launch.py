@@ -12,12 +12,43 @@ from collections import namedtuple
 from collections import OrderedDict
 from pprint import pformat
 
+from . import plugin
+from . import profiler
 from . import utils
 
 log = utils.get_logger()
 
 Streams = namedtuple("Streams", "stdout stderr")
 
+# hooks called by runners (see `pysipp.hookspec`)
+LIFECYCLE_HOOKS = (
+    "pysipp_agent_spawned",
+    "pysipp_agent_exited",
+    "pysipp_agent_signalled",
+)
+
+
+def lifecycle_hooks():
+    """Return the callers of the lifecycle hooks which have implementations
+    in the calling context (or None).
+
+    They are resolved up front since the plugins active in a context are
+    not visible from the runner's waiter thread, and to skip calling
+    hooks without implementations.
+    """
+    hook = plugin.mng.hook
+    callers = {}
+    for name in LIFECYCLE_HOOKS:
+        caller = getattr(hook, name)
+        callers[name] = caller if caller.get_hookimpls() else None
+    return callers
+
+
+def _exitcode(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
 
 class TimeoutError(Exception):
     "SIPp process timeout exception"
@@ -29,6 +60,15 @@ class PopenRunner(object):
     collect std streams.
 
     Adheres to an interface similar to `multiprocessing.pool.AsyncResult`.
+
+    Spawned processes are given ``spawned_at`` and (once reaped)
+    ``exited_at`` monotonic timestamps and their ``rusage``.
+
+    Processes are reaped with ``os.wait4`` (to collect their resource usage)
+    and all status checks made by the runner are serialized with reaping.
+    Callers should check on running processes through the runner (eg.
+    `is_alive`) rather than through their ``Popen`` methods which would
+    reap them first.
     """
 
     def __init__(
@@ -45,8 +85,21 @@ class PopenRunner(object):
         self._waiter = None
         # store proc results
         self._procs = OrderedDict()
+        # lifecycle hook callers
+        self._hooks = {}
+        # serializes reaping with status checks and signalling
+        self._reaping = threading.RLock()
+        # `pysipp.results.RunResult` of the last scenario run
+        self.result = None
 
-    def __call__(self, cmds, block=True, rate=300, **kwargs):
+    def __call__(self, cmds, block=True, rate=300, relaunch=None, **kwargs):
+        """Launch all `cmds` in sequence.
+
+        If provided, `relaunch` is called as ``relaunch(cmd, proc)`` just
+        after each command is spawned and may return a replacement command
+        to be launched in its place (eg. after a startup failure). It must
+        attach a ``streams`` attribute to any process it collects.
+        """
         if self._waiter and self._waiter.is_alive():
             raise RuntimeError(
                 "Not all processes from a prior run have completed"
@@ -55,20 +108,31 @@ class PopenRunner(object):
             raise RuntimeError(
                 "Process results have not been cleared from previous run"
             )
-        sp = self.spm
-        os = self.osm
-        DEVNULL = open(os.devnull, "wb")
         fds2procs = OrderedDict()
+        self._hooks = lifecycle_hooks()
 
         # run agent commands in sequence
         for cmd in cmds:
-            log.debug('launching cmd:\n"{}"\n'.format(cmd))
-            proc = sp.Popen(shlex.split(cmd), stdout=DEVNULL, stderr=sp.PIPE)
-            fd = proc.stderr.fileno()
-            log.debug("registering fd '{}' for pid '{}'".format(fd, proc.pid))
-            fds2procs[fd] = self._procs[cmd] = proc
-            # register for stderr hangup events
-            self.poller.register(proc.stderr.fileno(), select.EPOLLHUP)
+            proc = self._spawn(cmd)
+            while relaunch:
+                newcmd = relaunch(cmd, proc)
+                if newcmd is None:
+                    break
+                self._exited(cmd, proc)
+                cmd, proc = newcmd, self._spawn(newcmd)
+
+            self._procs[cmd] = proc
+            if getattr(proc, "streams", None) is None:
+                fd = proc.stderr.fileno()
+                log.debug(
+                    "registering fd '{}' for pid '{}'".format(fd, proc.pid)
+                )
+                fds2procs[fd] = (cmd, proc)
+                # register for stderr hangup events
+                self.poller.register(fd, select.EPOLLHUP)
+            else:
+                # already collected during startup
+                self._exited(cmd, proc)
             # limit launch rate
             time.sleep(1.0 / rate)
 
@@ -79,9 +143,70 @@ class PopenRunner(object):
 
         return self.get(**kwargs) if block else self._procs
 
+    def spawn(self, cmd):
+        """Launch a single command returning its process"""
+        sp = self.spm
+        log.debug('launching cmd:\n"{}"\n'.format(cmd))
+        with open(self.osm.devnull, "wb") as devnull:
+            return sp.Popen(shlex.split(cmd), stdout=devnull, stderr=sp.PIPE)
+
+    def _spawn(self, cmd):
+        with profiler.span("spawn", cmd=cmd):
+            proc = self.spawn(cmd)
+        proc.spawned_at = time.monotonic()
+        proc.exited_at = proc.rusage = None
+        caller = self._hooks.get("pysipp_agent_spawned")
+        if caller:
+            caller(cmd=cmd, pid=proc.pid, timestamp=proc.spawned_at)
+        return proc
+
+    def _reap(self, proc, block=False):
+        """Reap `proc` if it has exited (waiting for it if `block` is set)
+        recording its ``returncode`` and ``rusage``. Returns the return code
+        or None if the process is still running.
+        """
+        wait4 = getattr(self.osm, "wait4", None)
+        if wait4 is None:
+            return proc.wait() if block else proc.poll()
+        try:
+            if block and proc.returncode is None:
+                # wait without reaping so status checks aren't held up
+                self.osm.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+            with self._reaping:
+                if proc.returncode is None:
+                    pid, status, rusage = wait4(proc.pid, os.WNOHANG)
+                    if pid:
+                        proc.returncode = _exitcode(status)
+                        proc.rusage = rusage
+        except ChildProcessError:
+            # already reaped through the process' own methods
+            return proc.wait() if block else proc.poll()
+        return proc.returncode
+
+    def _exited(self, cmd, proc):
+        proc.exited_at = time.monotonic()
+        caller = self._hooks.get("pysipp_agent_exited")
+        if caller:
+            caller(
+                cmd=cmd,
+                pid=proc.pid,
+                returncode=proc.returncode,
+                rusage=proc.rusage,
+                timestamp=proc.exited_at,
+            )
+
     def _wait(self, fds2procs):
         log.debug("started waiter for procs {}".format(fds2procs))
         signalled = None
+        waited = {id(proc) for cmd, proc in fds2procs.values()}
+        if any(
+            proc.returncode
+            for proc in self._procs.values()
+            if id(proc) not in waited
+        ):
+            # an agent already failed during startup
+            signalled = self.stop()
+
         left = len(fds2procs)
         collected = 0
         while collected < left:
@@ -89,10 +214,12 @@ class PopenRunner(object):
             log.debug("received hangup for pairs '{}'".format(pairs))
             for fd, status in pairs:
                 collected += 1
-                proc = fds2procs[fd]
+                cmd, proc = fds2procs[fd]
+                self._reap(proc, block=True)
                 # attach streams so they can be read more then once
                 log.debug("collecting streams for {}".format(proc))
                 proc.streams = Streams(*proc.communicate())  # timeout=2))
+                self._exited(cmd, proc)
                 if proc.returncode != 0 and not signalled:
                     # stop all other agents if there is a failure
                     signalled = self.stop()
@@ -103,30 +230,33 @@ class PopenRunner(object):
         """Block up to `timeout` seconds for all agents to complete.
         Either return (cmd, proc) pairs or raise `TimeoutError` on timeout
         """
-        if self._waiter.is_alive():
-            self._waiter.join(timeout=timeout)
-
+        with profiler.span("wait"):
             if self._waiter.is_alive():
-                # kill them mfin SIPps
-                signalled = self.stop()
-                self._waiter.join(timeout=10)
+                self._waiter.join(timeout=timeout)
 
                 if self._waiter.is_alive():
-                    # try to stop a few more times
-                    for _ in range(3):
-                        signalled = self.stop()
-                        self._waiter.join(timeout=1)
+                    # kill them mfin SIPps
+                    signalled = self.stop()
+                    self._waiter.join(timeout=10)
 
                     if self._waiter.is_alive():
-                        # some procs failed to terminate via signalling
-                        raise RuntimeError("Unable to kill all agents!?")
+                        # try to stop a few more times
+                        for _ in range(3):
+                            signalled = self.stop()
+                            self._waiter.join(timeout=1)
 
-                # all procs were killed by SIGUSR1
-                raise TimeoutError(
-                    "pids '{}' failed to complete after '{}' seconds".format(
-                        pformat([p.pid for p in signalled.values()]), timeout
+                        if self._waiter.is_alive():
+                            # some procs failed to terminate via signalling
+                            raise RuntimeError("Unable to kill all agents!?")
+
+                    # all procs were killed by SIGUSR1
+                    raise TimeoutError(
+                        "pids '{}' failed to complete after '{}' "
+                        "seconds".format(
+                            pformat([p.pid for p in signalled.values()]),
+                            timeout,
+                        )
                     )
-                )
 
         return self._procs
 
@@ -140,8 +270,20 @@ class PopenRunner(object):
 
     def _signalall(self, signum):
         signalled = OrderedDict()
-        for cmd, proc in self.iterprocs():
-            proc.send_signal(signum)
+        caller = self._hooks.get("pysipp_agent_signalled")
+        for cmd, proc in self._procs.items():
+            with self._reaping:
+                if not proc or self._reap(proc) is not None:
+                    continue
+                # the pid can't be reused before it's reaped
+                self.osm.kill(proc.pid, signum)
+            if caller:
+                caller(
+                    cmd=cmd,
+                    pid=proc.pid,
+                    signum=signum,
+                    timestamp=time.monotonic(),
+                )
             log.warning(
                 "sent signal '{}' to cmd '{}' with pid '{}'".format(
                     signum, cmd, proc.pid
@@ -157,7 +299,7 @@ class PopenRunner(object):
         return (
             (cmd, proc)
             for cmd, proc in self._procs.items()
-            if proc and proc.poll() is None
+            if proc and self._reap(proc) is None
         )
 
     def is_alive(self):
@@ -1,49 +1,235 @@
 """
 Load files from scenario directories
 """
-import glob
+import hashlib
 import os
+import re
+import time
 
+from . import profiler
 from . import utils
 
 log = utils.get_logger()
 
+CONFPY = "pysipp_conf.py"
+
+# directories modified more recently than this (in ns) are rescanned on the
+# next lookup since coarse (eg. NFS) timestamps can hide a same-tick change
+RACY_NS = 2 * 10**9
+
 
 class CollectionError(Exception):
     """Scenario dir collection error"""
 
 
-def glob_for_scripts(directory):
-    """Find scenario xml scripts and conf.py in script dir"""
-    xmls = glob.iglob(directory + "/*.xml")
-    # double check
-    xmls = [f for f in xmls if "xml" in os.path.splitext(f)[1]]
-    confpy = glob.glob(directory + "/pysipp_conf.py")
-    if len(confpy) > 1:
-        raise ValueError(
-            "can only be at most one pysipp_conf.py in scen directory!"
+def scan_dir(directory):
+    """Scan a single directory with one ``os.scandir`` pass and return a
+    tuple of the form (<xmlpaths (list)>, <confpypath (str)>,
+    <subdirnames (list)>).
+    """
+    xmls, confpy, subdirs = [], None, []
+    with profiler.span("scan_dir", "collect", path=directory):
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.name == CONFPY:
+                    confpy = entry.path
+                elif entry.name.endswith(".xml") and entry.name[0] != ".":
+                    xmls.append(entry.path)
+
+    return sorted(xmls), confpy, sorted(subdirs)
+
+
+def scan_tree(
+    rootdir,
+    dir_filter=lambda dir_name: dir_name,
+    scanner=scan_dir,
+    pool=None,
+):
+    """Walk the tree under `rootdir` top-down (in the same order as
+    ``os.walk``) yielding (<dirpath>, <xmlpaths>, <confpypath>) tuples.
+
+    If an executor `pool` is provided sub-directories are scanned
+    concurrently ahead of being yielded.
+    """
+
+    def scan(path):
+        return path, pool.submit(scanner, path) if pool else None
+
+    stack = [scan(os.path.abspath(rootdir))]
+    while stack:
+        path, fut = stack.pop()
+        xmls, confpy, subdirs = fut.result() if fut else scanner(path)
+        yield path, xmls, confpy
+
+        # filter the path dirs to traverse as we recurse the file system
+        # (only use if you know what you're doing)
+        subdirs = filter(dir_filter, subdirs)
+        stack.extend(
+            scan(os.path.join(path, name)) for name in reversed(list(subdirs))
         )
-        log.debug("discovered xmls:\n{}".format("\n".join(xmls)))
-    return xmls, confpy[0] if confpy else None
 
 
-def iter_scen_dirs(rootdir, dir_filter=lambda dir_name: dir_name):
+@utils.StampCache
+def xml_meta(xmlpath):
+    """Return a metadata dict parsed from the SIPp script at `xmlpath`.
+
+    Results are cached keyed on the file's mtime and size so repeat
+    lookups cost a single ``stat()``.
+    """
+    with profiler.span("xml_meta", "collect", path=xmlpath):
+        with open(xmlpath, "r") as sf:
+            contents = sf.read()
+
+    name = re.search(r"<scenario\s[^>]*name=\"([^\"]*)\"", contents)
+    return {
+        "name": name.group(1) if name else None,
+        "plays_media": bool(re.search("play_pcap_audio", contents)),
+    }
+
+
+# in-process xml metadata cache: xml path -> ((mtime_ns, size), metadata)
+_xml_meta = xml_meta.entries
+
+
+def preload(item, confpy=True):
+    """Warm the metadata cache for all xml scripts and load the conf module
+    of a collected scenario dir `item` (as yielded by `iter_scen_dirs`).
+    Returns `item` unchanged.
+
+    This is the I/O heavy portion of collection and is safe to call from
+    worker threads.
+    """
+    path, xmls, mod = item
+    for xml in xmls:
+        xml_meta(xml)
+    if confpy and mod:
+        mod._load()
+    return item
+
+
+def default_index_path(rootdir):
+    """Return the default on-disk index location for the tree at `rootdir`"""
+    key = hashlib.sha1(os.path.abspath(rootdir).encode()).hexdigest()
+    return utils.cache_path("index-{}.json".format(key[:16]))
+
+
+class ScenIndex(object):
+    """A persistent, incrementally validated index of scenario directories.
+
+    Each directory's listing (xml scripts, pysipp_conf.py and sub-dirs) is
+    stored with its mtime and is only rescanned when a ``stat()`` shows the
+    directory has changed. Parsed xml metadata is persisted alongside and
+    revalidated lazily by `xml_meta`.
+    """
+
+    version = 1
+
+    def __init__(self, path):
+        self.path = path
+        self._dirs = {}
+        self._metas = {}
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        data = utils.load_json(self.path, self.version)
+        self._dirs = data.get("dirs", {})
+        self._metas = data.get("xmls", {})
+        for xml, (stamp, meta) in self._metas.items():
+            _xml_meta.setdefault(xml, (tuple(stamp), meta))
+
+    def save(self):
+        """Atomically write the index to disk if it has changed"""
+        metas = {
+            xml: _xml_meta[xml]
+            for entry in self._dirs.values()
+            for xml in entry["xmls"]
+            if xml in _xml_meta
+        }
+        metas = {
+            xml: [list(stamp), meta] for xml, (stamp, meta) in metas.items()
+        }
+        if not self._dirty and metas == self._metas:
+            return
+
+        utils.save_json(
+            self.path, {"dirs": self._dirs, "xmls": metas}, self.version
+        )
+        self._metas = metas
+        self._dirty = False
+        log.debug("saved scenario index '{}'".format(self.path))
+
+    def scan_dir(self, directory):
+        """`scan_dir` which only touches the file system beyond a single
+        ``stat()`` if `directory` changed since it was last indexed.
+        """
+        mtime = os.stat(directory).st_mtime_ns
+        entry = self._dirs.get(directory)
+        if entry and entry["mtime"] == mtime:
+            return entry["xmls"], entry["confpy"], entry["dirs"]
+
+        log.debug("indexing scenario dir '{}'".format(directory))
+        xmls, confpy, subdirs = scan_dir(directory)
+        self._dirs[directory] = {
+            # don't trust timestamps that may still change within a tick
+            "mtime": None if time.time_ns() - mtime < RACY_NS else mtime,
+            "xmls": xmls,
+            "confpy": confpy,
+            "dirs": subdirs,
+        }
+        self._dirty = True
+        return xmls, confpy, subdirs
+
+    def scan(self, rootdir, dir_filter=lambda dir_name: dir_name, pool=None):
+        """Scan the tree at `rootdir` and return a list of (<dirpath>,
+        <xmlpaths>, <confpypath>) tuples, dropping stale index entries.
+        """
+        scanned = list(
+            scan_tree(rootdir, dir_filter, scanner=self.scan_dir, pool=pool)
+        )
+
+        # prune entries for dirs which no longer exist under this root
+        root = os.path.join(os.path.abspath(rootdir), "")
+        seen = set(path for path, _, _ in scanned)
+        for path in list(self._dirs):
+            if path not in seen and os.path.join(path, "").startswith(root):
+                del self._dirs[path]
+                self._dirty = True
+
+        return scanned
+
+
+def iter_scen_dirs(
+    rootdir,
+    dir_filter=lambda dir_name: dir_name,
+    index=None,
+    pool=None,
+):
     """Build a map of SIPp scripts by searching the filesystem for .xml files
 
     :param str rootdir: dir in the filesystem to start scanning for xml files
+    :param index: a `ScenIndex`, a path to an index file or ``True`` to use
+        the `default_index_path` for `rootdir`. If provided the tree listing
+        is cached on disk and reused across invocations.
+    :param pool: an optional executor used to scan directories concurrently
     :return: an iterator over all scenario dirs yielding tuples of the form
-        (<filepath (str)>, <xmlpaths (list)>, <confpypath (str)>)
+        (<filepath (str)>, <xmlpaths (list)>, <confpymod (LazyMod)>)
     """
-    mod_space = set()
-    for path, dirnames, filenames in os.walk(rootdir):
+    if index is True:
+        index = default_index_path(rootdir)
+    if isinstance(index, str):
+        index = ScenIndex(index)
 
-        # filter the path dirs to traverse as we recurse the file system
-        # (only use if you know what you're doing)
-        dirnames[:] = filter(dir_filter, dirnames)
+    if index:
+        scanned = index.scan(rootdir, dir_filter, pool=pool)
+        index.save()
+    else:
+        scanned = scan_tree(rootdir, dir_filter, pool=pool)
 
-        # scan for files
-        path = os.path.abspath(path)
-        xmls, confpy = glob_for_scripts(path)
+    mod_space = set()
+    for path, xmls, confpy in scanned:
 
         if not len(xmls):
             log.debug("No SIPp xml scripts found under '{}'".format(path))
@@ -51,9 +237,9 @@ def iter_scen_dirs(rootdir, dir_filter=lambda dir_name: dir_name):
         if not confpy:
             log.debug("No pysipp_conf.py found under '{}'".format(path))
 
-        # load module sources
+        # module sources are only loaded when first accessed
         mod = (
-            utils.load_mod(
+            utils.LazyMod(
                 confpy,
                 # use unique names (as far as scendirs go)
                 # to avoid module caching
@@ -69,3 +255,7 @@ def iter_scen_dirs(rootdir, dir_filter=lambda dir_name: dir_name):
             mod_space.add(mod)
 
         yield path, xmls, mod
+
+    if index:
+        # persist any xml metadata parsed during collection
+        index.save()
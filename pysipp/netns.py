@@ -0,0 +1,147 @@
+"""
+Network namespace isolated agent execution (Linux only)
+"""
+import functools
+import os
+import shlex
+import subprocess
+import sys
+import weakref
+
+from . import agent
+from . import launch
+from . import utils
+
+log = utils.get_logger()
+
+# well-known ports assigned to agents in launch order; every scenario gets
+# its own loopback so these never collide across scenarios
+SIP_PORT = 5060
+MEDIA_PORT = 6000
+
+# brings up loopback then sleeps until stdin is closed by the parent
+_HOLDER = """\
+import fcntl, socket, struct, sys
+SIOCGIFFLAGS, SIOCSIFFLAGS, IFF_UP = 0x8913, 0x8914, 0x1
+sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+ifr = fcntl.ioctl(sock, SIOCGIFFLAGS, struct.pack("16sh22x", b"lo", 0))
+flags = struct.unpack("16sh22x", ifr)[1] | IFF_UP
+fcntl.ioctl(sock, SIOCSIFFLAGS, struct.pack("16sh22x", b"lo", flags))
+sys.stdout.write("ready\\n")
+sys.stdout.flush()
+sys.stdin.read()
+"""
+
+
+class NamespaceError(OSError):
+    """A network namespace could not be created"""
+
+
+def _close(proc):
+    proc.stdin.close()
+    proc.wait()
+    proc.stdout.close()
+
+
+class Namespace(object):
+    """A loopback-only network namespace held open by a sleeping helper
+    process for as long as this object is alive (or until `close`).
+
+    Unless running as root the namespace is nested in a new user namespace
+    (with the caller mapped to root) so no privileges are required.
+    """
+
+    def __init__(self, userns=None, subprocmod=subprocess):
+        self.userns = os.geteuid() != 0 if userns is None else userns
+        args = ["unshare", "--net"]
+        if self.userns:
+            args += ["--user", "--map-root-user"]
+
+        try:
+            self._proc = subprocmod.Popen(
+                args + [sys.executable, "-c", _HOLDER],
+                stdin=subprocmod.PIPE,
+                stdout=subprocmod.PIPE,
+                stderr=subprocmod.PIPE,
+            )
+        except OSError as err:
+            raise NamespaceError("Unable to launch `unshare`: {}".format(err))
+
+        if self._proc.stdout.readline().strip() != b"ready":
+            _, err = self._proc.communicate()
+            raise NamespaceError(
+                "Unable to create network namespace: {}".format(
+                    err.decode(errors="replace").strip()
+                )
+            )
+        self._finalizer = weakref.finalize(self, _close, self._proc)
+        log.debug("created network namespace held by {}".format(self.pid))
+
+    @property
+    def pid(self):
+        return self._proc.pid
+
+    @property
+    def closed(self):
+        return not self._finalizer.alive
+
+    def nsenter(self):
+        """Return the command prefix which enters this namespace"""
+        args = ["nsenter", "--target", str(self.pid), "--net"]
+        if self.userns:
+            args += ["--user", "--preserve-credentials"]
+        return args
+
+    def wrap(self, cmd):
+        """Return cmd string `cmd` prefixed to run inside this namespace"""
+        return " ".join(map(shlex.quote, self.nsenter())) + " " + cmd
+
+    def close(self):
+        """Stop the holder process. The namespace persists until all
+        processes which entered it have also exited.
+        """
+        self._finalizer()
+
+
+@functools.lru_cache(maxsize=None)
+def available():
+    """Return bool indicating whether namespaces can be created here"""
+    try:
+        Namespace().close()
+        return True
+    except NamespaceError as err:
+        log.debug(err)
+        return False
+
+
+class NetnsRunner(launch.PopenRunner):
+    """Run each agent inside the same private network namespace.
+
+    A new namespace is created per runner unless `namespace` is provided.
+    """
+
+    def __init__(self, namespace=None, **kwargs):
+        super(NetnsRunner, self).__init__(**kwargs)
+        self.namespace = namespace or Namespace()
+
+    def spawn(self, cmd):
+        return super(NetnsRunner, self).spawn(self.namespace.wrap(cmd))
+
+    def close(self):
+        self.namespace.close()
+
+
+def assign_addrs(scen):
+    """Assign fixed loopback socket addresses to each agent in `scen` in
+    launch order if not previously set by the user.
+    """
+    for i, ua in enumerate(scen.agents.values()):
+        copy = scen.prepare_agent(ua)
+        if not copy.local_host:
+            ua.local_host = "127.0.0.1"
+        if not copy.local_port:
+            ua.local_port = SIP_PORT + i
+        if not copy.media_addr:
+            ua.media_addr = ua.local_host or copy.local_host
+        if not copy.media_port:
+            ua.media_port = MEDIA_PORT + i * agent.MEDIA_PORT_STEP
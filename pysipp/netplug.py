@@ -3,7 +3,10 @@ auto-networking plugin
 """
 import socket
 
+from pysipp import netns
 from pysipp import plugin
+from pysipp import ports
+from pysipp import resolver
 
 
 def getsockaddr(host, family=socket.AF_INET, port=0, sockmod=socket):
@@ -14,8 +17,9 @@ def getsockaddr(host, family=socket.AF_INET, port=0, sockmod=socket):
     ..warning:: Obviously this is not guarateed to be an unused address
         since we don't actually keep it bound, so there may be a race with
         other processes acquiring the addr before our SIPp process re-binds.
+        Prefer leasing ports using `pysipp.ports`.
     """
-    for fam, stype, proto, _, sa in socket.getaddrinfo(
+    for fam, stype, proto, _, sa in resolver.getaddrinfo(
         host,
         port,
         family,
@@ -32,25 +36,137 @@ def getsockaddr(host, family=socket.AF_INET, port=0, sockmod=socket):
     raise socket.error("getaddrinfo returned empty sequence")
 
 
+# (host attribute, port attribute, socket types) of auto-allocated ports
+_PORT_ATTRS = [
+    ("local_host", "local_port", ports.SIP_SOCKTYPES),
+    ("media_addr", "media_port", ports.MEDIA_SOCKTYPES),
+]
+
+
 @plugin.hookimpl
 def pysipp_conf_scen(agents, scen):
-    """Automatically allocate random socket addresses from the local OS for
+    """Automatically allocate (leased) socket addresses from the local OS for
     each agent in the scenario if not previously set by the user.
+
+    If the scenario has `local_addrs` each agent without a `local_host` is
+    bound to the least loaded address in that (shared) pool.
+
+    Scenarios run in their own network namespace are instead assigned
+    fixed well-known loopback addresses.
     """
-    host = scen.defaults.local_host or socket.getfqdn()
+    if getattr(scen, "netns", False):
+        netns.assign_addrs(scen)
+        return
+
+    host = scen.defaults.local_host or resolver.getfqdn()
+    local_addrs = getattr(scen, "local_addrs", None)
+    pool = ports.address_pool(local_addrs) if local_addrs else None
     for ua in scen.agents.values():
         copy = scen.prepare_agent(ua)
+        auto = scen.autoports.setdefault(ua.name, set())
 
-        ip, port = getsockaddr(ua.local_host or host)
+        if not copy.local_port:
+            if pool and not copy.local_host:
+                # spread agents over the least loaded local addresses
+                port_lease = pool.lease(scen)
+            else:
+                port_lease = ports.lease(scen, ua.local_host or host)
+            ip, port = port_lease.addr
+            ua.local_port = port
+            auto.add("local_port")
+        else:
+            ip = ports.resolve(ua.local_host or host)[1][0]
 
         if not copy.local_host:
             ua.local_host = ip
 
-        if not copy.local_port:
-            ua.local_port = port
-
         if not copy.media_addr:
             ua.media_addr = ua.local_host
 
         if not copy.media_port:
-            ua.media_port = getsockaddr(ua.media_addr or host)[1]
+            ua.media_port = ports.lease(
+                scen, ua.media_addr or host, socktypes=ports.MEDIA_SOCKTYPES
+            ).port
+            auto.add("media_port")
+
+    # in-process responders bind their (leased) port when the run starts
+    for srv in getattr(scen, "responders", ()):
+        if not srv.port:
+            srv.port = ports.lease(scen, srv.host).port
+            scen.autoports.setdefault(srv.name, set()).add("port")
+
+
+def relock(scen, agents):
+    """Lease the auto-allocated ports of the prepared `agents` again on
+    behalf of `scen` if they were released (eg. by a previous run) and
+    reallocate those which were taken in the meantime.
+    """
+    held = set(lease.port for lease in ports.leases(scen))
+    for ua in agents:
+        for hostattr, portattr, socktypes in _PORT_ATTRS:
+            port = getattr(ua, portattr)
+            if portattr not in scen.autoports.get(ua.name, ()):
+                continue
+            if port in held:
+                continue
+            try:
+                ports.lease(
+                    scen, getattr(ua, hostattr), socktypes=socktypes, port=port
+                )
+            except ports.AllocationError:
+                # moves all of the agent's auto-allocated ports
+                reallocate(scen, agents, ua)
+                break
+
+    for srv in getattr(scen, "responders", ()):
+        if "port" in scen.autoports.get(srv.name, ()) and srv.port not in held:
+            try:
+                ports.lease(scen, srv.host, port=srv.port)
+            except ports.AllocationError:
+                pass  # reported when the responder fails to bind it
+
+
+def reallocate(scen, agents, ua):
+    """Lease new local (and media) ports for the prepared agent `ua` whose
+    current ports could not be bound, and re-point any of the prepared
+    `agents` (as well as the scenario's own settings) which route to it.
+
+    Only ports auto-allocated for `ua` (see `pysipp_conf_scen`) are
+    reallocated; returns a bool indicating whether anything was changed.
+    """
+    leased = {lease.port: lease for lease in ports.leases(scen)}
+    changed = {}
+    for hostattr, portattr, socktypes in _PORT_ATTRS:
+        if portattr not in scen.autoports.get(ua.name, ()):
+            continue
+
+        old = getattr(ua, portattr)
+        new = ports.lease(scen, getattr(ua, hostattr), socktypes=socktypes)
+        if old in leased:
+            leased.pop(old).release()
+        setattr(ua, portattr, new.port)
+        changed[(getattr(ua, hostattr), old)] = new.port
+
+        # keep the scenario's agent in sync for later runs
+        orig = scen.agents.get(ua.name)
+        if orig and getattr(orig, portattr) == old:
+            setattr(orig, portattr, new.port)
+
+    # re-route dependents
+    routed = list(agents) + list(scen.agents.values())
+    routed.extend([scen.defaults, scen.clientdefaults, scen.serverdefaults])
+    for other in routed:
+        for composite, hostattr, portattr in [
+            ("destaddr", "remote_host", "remote_port"),
+            ("proxyaddr", "proxy_host", "proxy_port"),
+        ]:
+            addr = getattr(other, composite)
+            if addr and tuple(addr) in changed:
+                setattr(other, composite, (addr[0], changed[tuple(addr)]))
+
+            # settings dicts may hold the individual fields
+            addr = (getattr(other, hostattr), getattr(other, portattr))
+            if addr in changed:
+                setattr(other, portattr, changed[addr])
+
+    return bool(changed)
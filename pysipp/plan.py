@@ -0,0 +1,204 @@
+"""
+Load planning using Little's law (concurrent calls = rate * hold time)
+"""
+import math
+import os
+
+try:
+    import resource
+except ImportError:  # not on unix
+    resource = None
+
+from . import utils
+
+log = utils.get_logger()
+
+# conservative sustained calls/s of a single SIPp process (one core)
+CPS_PER_PROCESS = 500
+# fds each SIPp process needs regardless of load (logs, sockets, stdio)
+BASE_FDS = 64
+# dead calls SIPp may keep around (each one costs memory)
+MAX_DEAD_CALLS = 100000
+# SIPp's default -deadcall_wait (ms)
+DEADCALL_WAIT = 33000
+
+
+def nofile_limits():
+    """Return the (soft, hard) RLIMIT_NOFILE of this process"""
+    if resource is None:
+        return None, None
+    return resource.getrlimit(resource.RLIMIT_NOFILE)
+
+
+def raise_nofile(needed):
+    """Raise the soft fd limit (inherited by agents launched afterwards) to
+    `needed` if permitted by the hard limit and return the new soft limit.
+    """
+    soft, hard = nofile_limits()
+    if soft is None or soft == resource.RLIM_INFINITY or soft >= needed:
+        return soft
+    new = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (new, hard))
+    except (ValueError, OSError) as err:
+        log.warning("unable to raise fd limit to {}: {}".format(new, err))
+        return soft
+    log.debug("raised fd limit from {} to {}".format(soft, new))
+    return new
+
+
+class LoadPlan(object):
+    """Consistent SIPp load settings for running `cps` calls per second,
+    each held for `hold` seconds.
+
+    Concurrent calls follow from Little's law (``cps * (hold + setup)``)
+    and determine ``limit`` (plus `headroom`), the socket budget and the
+    number of shards (see `pysipp.agent.UserAgent.shard`) needed to stay
+    within both the per-process throughput and fd limits.
+    """
+
+    def __init__(
+        self,
+        cps,
+        hold,
+        duration=None,
+        setup=1.0,
+        headroom=1.2,
+        transport="u1",
+        cores=None,
+        nofile=None,
+        cps_per_process=CPS_PER_PROCESS,
+        timeout_margin=5.0,
+        closed_loop=False,
+    ):
+        self.cps = cps
+        self.hold = hold
+        self.duration = duration
+        self.transport = transport
+        self.cores = cores or os.cpu_count() or 1
+        self.closed_loop = closed_loop
+        self.warnings = []
+
+        # Little's law
+        self.concurrent = int(math.ceil(cps * (hold + setup)))
+        self.limit = int(math.ceil(self.concurrent * headroom))
+
+        # transports ending in 'n' open a socket per call
+        self.fds_per_call = 1 if transport.endswith("n") else 0
+        # the fd limit agents can be given (see `raise_nofile`)
+        self.nofile = nofile or nofile_limits()[1]
+        finite = self.nofile not in (
+            None,
+            getattr(resource, "RLIM_INFINITY", -1),
+        )
+
+        shards = int(math.ceil(cps / float(cps_per_process)))
+        if finite and self.fds_per_call:
+            usable = max(1, self.nofile - BASE_FDS)
+            shards = max(
+                shards, int(math.ceil(self.limit * self.fds_per_call / usable))
+            )
+        self.shards = max(1, shards)
+
+        # socket budget per process
+        self.fds = BASE_FDS + int(
+            math.ceil(self.limit * self.fds_per_call / self.shards)
+        )
+
+        # timers (ms)
+        self.pause_duration = int(hold * 1000)
+        self.recv_timeout = int((hold + timeout_margin) * 1000)
+        self.deadcall_wait = int(
+            max(1000, min(DEADCALL_WAIT, MAX_DEAD_CALLS * 1000.0 / cps))
+        )
+        self.call_count = int(math.ceil(cps * duration)) if duration else None
+
+        if self.shards > self.cores:
+            self.warn(
+                "{} cps needs {} SIPp processes but only {} cores are "
+                "available; the target is likely unreachable".format(
+                    cps, self.shards, self.cores
+                )
+            )
+
+    def warn(self, msg):
+        self.warnings.append(msg)
+        log.warning(msg)
+
+    def defaults(self):
+        """Scenario default settings (see `pysipp.agent.Scenario`)"""
+        defaults = {
+            "rate": utils.sipp_num(self.cps),
+            "limit": self.limit,
+            "pause_duration": self.pause_duration,
+            "recv_timeout": self.recv_timeout,
+            "deadcall_wait": self.deadcall_wait,
+        }
+        if self.call_count:
+            defaults["call_count"] = self.call_count
+        if self.closed_loop:
+            # keep a fixed population of calls instead of a rate
+            defaults["users"] = self.concurrent
+        return defaults
+
+    def scenkwargs(self, name="uac"):
+        """Keyword arguments for `pysipp.scenario` or `pysipp.walk` which
+        apply this plan to the client agent `name`
+        """
+        kwargs = {"defaults": self.defaults()}
+        if self.shards > 1:
+            kwargs["shards"] = {name: self.shards}
+        return kwargs
+
+    def apply(self, scen, name="uac"):
+        """Apply this plan's defaults to existing scenario `scen` (which
+        can't be re-sharded) and return any warnings from `check`.
+        """
+        scen.defaults.update(self.defaults())
+        return self.check(scen, name=name)
+
+    def raise_nofile(self):
+        """Raise the fd limit inherited by agents to the planned budget"""
+        soft = raise_nofile(self.fds)
+        if soft is not None and soft < self.fds:
+            self.warn(
+                "fd limit {} is below the {} sockets needed per agent".format(
+                    soft, self.fds
+                )
+            )
+        return soft
+
+    def check(self, scen, name="uac"):
+        """Warn about settings in `scen` which make the target unreachable
+        and return the warnings.
+        """
+        found = []
+        prepared = scen.prepare()
+        clients = [ua for ua in prepared if ua.logical_name == name]
+        if len(clients) < self.shards:
+            found.append(
+                "'{}' runs in {} processes but {} are needed for {} "
+                "cps".format(name, len(clients), self.shards, self.cps)
+            )
+        limit = sum(int(ua.limit or 0) for ua in clients)
+        if limit and limit < self.concurrent:
+            found.append(
+                "limit of {} caps throughput at {:.1f} cps".format(
+                    limit, limit / float(self.hold or 1)
+                )
+            )
+        rate = sum(float(ua.rate or 0) for ua in clients)
+        if rate and rate < self.cps and not self.closed_loop:
+            found.append(
+                "rate of {} cps is below the target {}".format(rate, self.cps)
+            )
+        for ua in prepared:
+            if ua.recv_timeout and int(ua.recv_timeout) <= self.hold * 1000:
+                found.append(
+                    "'{}' recv_timeout of {}ms expires before calls are "
+                    "released".format(ua.name, ua.recv_timeout)
+                )
+
+        for msg in found:
+            self.warn(msg)
+        return found
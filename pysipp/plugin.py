@@ -2,25 +2,107 @@
 `pluggy` plugin and hook management
 """
 import contextlib
+import contextvars
 
 import pluggy
 
 from . import hookspec
+from . import profiler
 
 hookimpl = pluggy.HookimplMarker("pysipp")
-mng = pluggy.PluginManager("pysipp")
-mng.add_hookspecs(hookspec)
+
+
+class PluginManager(pluggy.PluginManager):
+    """pysipp's plugin manager whose hook calls and implementations are
+    timed while profiling (see `pysipp.profiler`)
+    """
+
+    def __init__(self):
+        super(PluginManager, self).__init__("pysipp")
+        self.add_hookspecs(hookspec)
+        profiler.instrument(self)
+
+
+# the global plugin manager
+root = PluginManager()
+
+# plugin manager which is active for the current thread (or async task)
+_active = contextvars.ContextVar("pysipp_plugin_manager", default=None)
+
+
+def current():
+    """Return the plugin manager active in the calling context"""
+    return _active.get() or root
+
+
+def context(plugins, parent=None):
+    """Return a new plugin manager calling the hook implementations of
+    `parent` (by default the currently active manager) followed by those of
+    `plugins`.
+
+    Only `plugins` are registered with the new manager; the parent's hook
+    implementations are shared rather than registered again. The parent is
+    never modified so the returned manager can be used to call hooks
+    concurrently with other contexts.
+    """
+    parent = parent or current()
+    mng = PluginManager()
+    for name, caller in vars(parent.hook).items():
+        impls = caller.get_hookimpls()
+        if not impls:
+            continue
+        target = getattr(mng.hook, name, None)
+        if target is None:  # an unspecified (optional) hook
+            target = type(caller)(name, mng._hookexec)
+            setattr(mng.hook, name, target)
+        # copied in call order; the delta's are then added as usual
+        target._hookimpls.extend(impls)
+    for p in plugins:
+        if p:
+            mng.register(p)
+    return mng
 
 
 @contextlib.contextmanager
-def register(plugins):
-    """Temporarily register plugins"""
+def activate(mng):
+    """Make `mng` the active plugin manager for the calling context"""
+    token = _active.set(mng)
     try:
-        if any(plugins):
-            for p in plugins:
-                mng.register(p)
-        yield
+        yield mng
     finally:
-        if any(plugins):
-            for p in plugins:
-                mng.unregister(p)
+        _active.reset(token)
+
+
+@contextlib.contextmanager
+def register(plugins):
+    """Temporarily register plugins.
+
+    Registration is only visible to the calling thread (or async task) and
+    the contexts it copies, such that concurrently configured scenarios
+    never see each other's plugins: threads started from within this block
+    do not see `plugins` unless they `activate` the calling thread's
+    `current` manager. Register process wide plugins with ``root`` (or
+    ``mng`` outside of any context) instead.
+    """
+    plugins = [p for p in plugins if p]
+    if not plugins:
+        yield
+        return
+
+    with activate(context(plugins)):
+        yield
+
+
+class ManagerProxy(object):
+    """Proxy to the plugin manager active in the calling context
+    (see `current`).
+    """
+
+    def __getattr__(self, name):
+        return getattr(current(), name)
+
+    def __repr__(self):
+        return "<ManagerProxy for {!r}>".format(current())
+
+
+mng = ManagerProxy()
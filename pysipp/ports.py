@@ -0,0 +1,394 @@
+"""
+Leased local port allocation
+"""
+import errno
+import fcntl
+import functools
+import ipaddress
+import itertools
+import os
+import random
+import socket
+import tempfile
+import threading
+import weakref
+
+from . import resolver
+from . import utils
+
+log = utils.get_logger()
+
+# allocate below the default linux ephemeral range (32768-60999) so the
+# kernel never hands out a leased port to some other socket
+DEFAULT_RANGE = (20000, 32000)
+
+SIP_SOCKTYPES = (socket.SOCK_DGRAM, socket.SOCK_STREAM)
+MEDIA_SOCKTYPES = (socket.SOCK_DGRAM,)
+
+
+class AllocationError(socket.error):
+    """No port could be leased from the configured range"""
+
+
+def _env_range():
+    spec = os.environ.get("PYSIPP_PORT_RANGE")
+    if not spec:
+        return DEFAULT_RANGE
+    lo, hi = spec.split("-")
+    return int(lo), int(hi)
+
+
+class _PortLocks(object):
+    """Exclusive byte range locks (one byte at offset ``port``) on a single
+    lock file shared by all allocators using it.
+
+    POSIX record locks are owned by the process and are all dropped when
+    any descriptor to the file is closed, so each file is opened once per
+    process and ports locked within the process are tracked in `held`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o666)
+        self.held = set()
+        # re-entrant since leases may be released by gc finalizers
+        self._lock = threading.RLock()
+
+    def trylock(self, port):
+        with self._lock:
+            if port in self.held:
+                return False
+            try:
+                fcntl.lockf(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, port)
+            except OSError as err:
+                if err.errno in (errno.EAGAIN, errno.EACCES):
+                    return False
+                raise
+            self.held.add(port)
+            return True
+
+    def unlock(self, port):
+        with self._lock:
+            if port in self.held:
+                self.held.discard(port)
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, port)
+
+
+# lock file path -> `_PortLocks` shared by all allocators in this process
+_portlocks = {}
+_portlocks_lock = threading.Lock()
+
+
+def _get_portlocks(lockdir):
+    path = os.path.join(os.path.realpath(lockdir), "ports.lock")
+    with _portlocks_lock:
+        locks = _portlocks.get(path)
+        if locks is None:
+            locks = _portlocks[path] = _PortLocks(path)
+        return locks
+
+
+def _forget_held():
+    # record locks aren't inherited by forked children
+    for locks in _portlocks.values():
+        locks.held.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_held)
+
+
+class PortLease(object):
+    """A local port reserved for use by a single agent socket.
+
+    The reservation is held (across processes) by an exclusive lock on the
+    port's byte in the allocator's lock file and optionally by bound
+    placeholder sockets which keep other (non-pysipp) processes off the
+    port until `unplug` is called just before the agent is spawned.
+    """
+
+    def __init__(self, allocator, addr, placeholders=()):
+        self.allocator = allocator
+        self.addr = addr
+        self._placeholders = list(placeholders)
+        # unlock ports of leases which are dropped without release
+        self._finalizer = weakref.finalize(
+            self, allocator._locks.unlock, addr[1]
+        )
+
+    @property
+    def port(self):
+        return self.addr[1]
+
+    @property
+    def released(self):
+        return not self._finalizer.alive
+
+    def unplug(self):
+        """Close any placeholder sockets so the port can be bound"""
+        for sock in self._placeholders:
+            sock.close()
+        del self._placeholders[:]
+
+    def release(self):
+        """Give the port back to the allocator"""
+        self.unplug()
+        # unlocks at most once
+        self._finalizer()
+
+    def __repr__(self):
+        return "<PortLease {}:{}{}>".format(
+            self.addr[0], self.port, " (released)" if self.released else ""
+        )
+
+
+class PortAllocator(object):
+    """Lease local ports from `portrange` (an inclusive (lo, hi) pair).
+
+    Leases are coordinated with other threads and processes through byte
+    range locks on a single lock file in `lockdir` (one descriptor per
+    process); a candidate port is only handed out if it can be locked and
+    bound for every requested socket type.
+    """
+
+    def __init__(self, portrange=None, lockdir=None, placeholders=False):
+        self.portrange = portrange or _env_range()
+        self.lockdir = lockdir or os.path.join(
+            tempfile.gettempdir(), "pysipp-ports"
+        )
+        self.placeholders = placeholders
+        os.makedirs(self.lockdir, exist_ok=True)
+        self._locks = _get_portlocks(self.lockdir)
+        self._lock = threading.Lock()
+        lo, hi = self.portrange
+        # randomize the starting point to reduce cross-process contention
+        self._cursor = random.randint(lo, hi)
+
+    def _candidates(self):
+        lo, hi = self.portrange
+        size = hi - lo + 1
+        start = self._cursor - lo
+        for i in range(size):
+            yield lo + (start + i) % size
+
+    def _probe(self, sockaddr, family, socktypes):
+        """Bind a socket of each type to `sockaddr` returning them all or
+        ``None`` if the address is already in use.
+        """
+        socks = []
+        try:
+            for stype in socktypes:
+                sock = socket.socket(family, stype)
+                socks.append(sock)
+                sock.bind(sockaddr)
+        except OSError as err:
+            for sock in socks:
+                sock.close()
+            if err.errno == errno.EADDRINUSE:
+                return None
+            raise
+        return socks
+
+    def lease(
+        self, host, socktypes=SIP_SOCKTYPES, family=socket.AF_INET, port=None
+    ):
+        """Lease a free port on `host` usable for all `socktypes`; if `port`
+        is provided only that port is considered.
+        """
+        family, sockaddr = resolve(host, family)
+        wanted = port
+        with self._lock:
+            for port in [wanted] if wanted else self._candidates():
+                if not self._locks.trylock(port):
+                    continue
+
+                socks = self._probe(
+                    (sockaddr[0], port) + sockaddr[2:], family, socktypes
+                )
+                if socks is None:
+                    self._locks.unlock(port)
+                    continue
+
+                addr = socks[0].getsockname()[:2]
+                if not self.placeholders:
+                    for sock in socks:
+                        sock.close()
+                    socks = ()
+
+                self._cursor = port + 1
+                log.debug("leased port {} on '{}'".format(port, host))
+                return PortLease(self, addr, placeholders=socks)
+
+        if wanted:
+            raise AllocationError(
+                "port {} on '{}' is not free".format(wanted, host)
+            )
+        raise AllocationError(
+            "no free port on '{}' in range {}".format(host, self.portrange)
+        )
+
+
+def resolve(host, family=socket.AF_INET):
+    """Return a (family, sockaddr) pair for passively binding to `host`"""
+    for fam, _, _, _, sa in resolver.getaddrinfo(
+        host,
+        0,
+        family,
+        socket.SOCK_DGRAM,
+        0,
+        socket.AI_PASSIVE,
+    ):
+        return fam, sa
+
+    raise socket.error("getaddrinfo returned empty sequence")
+
+
+class AddressPool(object):
+    """Spread leases over a pool of local addresses, always leasing on the
+    address with the fewest outstanding leases.
+
+    `addrs` is a network (eg. ``"127.0.0.0/8"``), an address or a sequence
+    of these. Networks are expanded lazily so large ranges are cheap.
+    """
+
+    def __init__(self, addrs):
+        if isinstance(addrs, str):
+            addrs = [addrs]
+        self.addrs = tuple(addrs)
+        self._fresh = itertools.chain.from_iterable(
+            map(_iter_hosts, self.addrs)
+        )
+        # addr -> outstanding leases
+        self._load = {}
+        self._lock = threading.Lock()
+
+    def load(self, addr):
+        """Return the number of unreleased leases on `addr`"""
+        with self._lock:
+            held = self._load.get(addr, ())
+            return sum(not port_lease.released for port_lease in held)
+
+    def acquire(self):
+        """Return the least loaded address"""
+        with self._lock:
+            return self._acquire()
+
+    def _acquire(self):
+        best, least = None, None
+        for addr, held in self._load.items():
+            held[:] = [pl for pl in held if not pl.released]
+            if least is None or len(held) < least:
+                best, least = addr, len(held)
+            if not least:
+                return addr
+
+        addr = next(self._fresh, None)
+        if addr is None:
+            if best is None:
+                raise AllocationError("address pool is empty")
+            return best
+
+        self._load[addr] = []
+        return addr
+
+    def lease(self, owner, socktypes=SIP_SOCKTYPES, family=socket.AF_INET):
+        """Lease a port on behalf of `owner` (see `lease`) on the least
+        loaded address in the pool
+        """
+        with self._lock:
+            addr = self._acquire()
+            port_lease = lease(owner, addr, socktypes=socktypes, family=family)
+            self._load[addr].append(port_lease)
+        return port_lease
+
+
+def _iter_hosts(spec):
+    try:
+        network = ipaddress.ip_network(spec, strict=False)
+    except ValueError:
+        # interface alias or host name
+        yield spec
+        return
+    for addr in network.hosts():
+        yield str(addr)
+
+
+@functools.lru_cache(maxsize=None)
+def _address_pool(addrs):
+    return AddressPool(addrs)
+
+
+def address_pool(addrs):
+    """Return the pool shared by all callers for `addrs` so that load is
+    balanced across concurrent scenarios
+    """
+    if isinstance(addrs, str):
+        addrs = [addrs]
+    return _address_pool(tuple(addrs))
+
+
+_allocator = None
+_allocator_lock = threading.RLock()
+
+# leases held on behalf of owners (usually scenarios)
+_leases = weakref.WeakKeyDictionary()
+
+
+def configure(**kwargs):
+    """Replace the default allocator with one built from `kwargs` (see
+    `PortAllocator`) and return it.
+    """
+    global _allocator
+    with _allocator_lock:
+        _allocator = PortAllocator(**kwargs)
+    return _allocator
+
+
+def get_allocator():
+    """Return the default allocator"""
+    global _allocator
+    with _allocator_lock:
+        if _allocator is None:
+            _allocator = PortAllocator()
+    return _allocator
+
+
+def lease(
+    owner, host, socktypes=SIP_SOCKTYPES, family=socket.AF_INET, port=None
+):
+    """Lease a port (`port` if provided) from the default allocator on
+    behalf of `owner`. Leases are released by `release` or when `owner` is
+    garbage collected.
+    """
+    port_lease = get_allocator().lease(host, socktypes, family, port=port)
+    with _allocator_lock:
+        held = _leases.get(owner)
+        if held is None:
+            held = _leases[owner] = []
+            weakref.finalize(owner, _release_all, held)
+        held.append(port_lease)
+    return port_lease
+
+
+def leases(owner):
+    """Return all leases currently held on behalf of `owner`"""
+    with _allocator_lock:
+        return list(_leases.get(owner, ()))
+
+
+def unplug(owner):
+    """Close all placeholder sockets held on behalf of `owner`"""
+    for port_lease in leases(owner):
+        port_lease.unplug()
+
+
+def _release_all(held):
+    for port_lease in held:
+        port_lease.release()
+
+
+def release(owner):
+    """Release all leases held on behalf of `owner`"""
+    with _allocator_lock:
+        held = _leases.pop(owner, ())
+    _release_all(held)
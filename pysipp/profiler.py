@@ -0,0 +1,271 @@
+"""
+Opt-in profiling of collection, configuration and launch phases
+
+Enable with the `profile` context manager or by setting ``PYSIPP_PROFILE``
+to the path of the trace file to write at exit.
+"""
+import atexit
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import weakref
+from collections import namedtuple
+from collections import OrderedDict
+
+ENV_VAR = "PYSIPP_PROFILE"
+
+# times are in seconds relative to the start of profiling
+Event = namedtuple("Event", "name cat start wall cpu tid args")
+
+# the profiler receiving spans (shared by all threads)
+_active = None
+
+_NULL = contextlib.nullcontext()
+
+
+class Profiler(object):
+    """Records the wall and (thread) CPU time of named spans.
+
+    Spans are phases of pysipp's operation (eg. ``scan_dir``, ``prepare``,
+    ``spawn``), hook calls and each hook implementation called, including
+    those in user ``pysipp_conf.py`` modules.
+    """
+
+    def __init__(self):
+        self.events = []
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+
+    @contextlib.contextmanager
+    def span(self, name, cat="phase", args=None):
+        start = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            # list.append is atomic so no locking is needed
+            self.events.append(
+                Event(
+                    name,
+                    cat,
+                    start - self._origin,
+                    time.perf_counter() - start,
+                    time.thread_time() - cpu,
+                    threading.get_ident(),
+                    args,
+                )
+            )
+
+    def summary(self):
+        """Return a dict of span name -> dict with the call ``count`` and
+        total ``wall`` and ``cpu`` seconds ordered by decreasing wall time
+        """
+        totals = {}
+        for ev in list(self.events):
+            entry = totals.setdefault(
+                ev.name, {"count": 0, "wall": 0.0, "cpu": 0.0}
+            )
+            entry["count"] += 1
+            entry["wall"] += ev.wall
+            entry["cpu"] += ev.cpu
+        return OrderedDict(
+            sorted(totals.items(), key=lambda item: -item[1]["wall"])
+        )
+
+    def chrome_trace(self):
+        """Return the events in Chrome trace (``chrome://tracing``,
+        Perfetto) format
+        """
+        events = []
+        for ev in list(self.events):
+            args = dict(ev.args or {})
+            args["cpu_ms"] = round(ev.cpu * 1e3, 3)
+            events.append(
+                {
+                    "name": ev.name,
+                    "cat": ev.cat,
+                    "ph": "X",
+                    "ts": round(ev.start * 1e6, 3),
+                    "dur": round(ev.wall * 1e6, 3),
+                    "pid": self._pid,
+                    "tid": ev.tid,
+                    "args": args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def folded(self):
+        """Return flamegraph.pl compatible folded stack lines weighted by
+        the self wall time of each span in microseconds
+        """
+        weights = OrderedDict()
+        bytid = {}
+        for ev in self.events:
+            bytid.setdefault(ev.tid, []).append(ev)
+        for events in bytid.values():
+            # parents start first and enclose their children
+            events.sort(key=lambda ev: (ev.start, -ev.wall))
+            stack = []  # [(event, child wall time)]
+            for ev in events + [None]:
+                while stack and (
+                    ev is None
+                    or ev.start >= stack[-1][0].start + stack[-1][0].wall
+                ):
+                    done, children = stack.pop()
+                    key = ";".join([e.name for e, _ in stack] + [done.name])
+                    weights[key] = weights.get(key, 0) + max(
+                        0, done.wall - children
+                    )
+                    if stack:
+                        stack[-1][1] += done.wall
+                if ev is not None:
+                    stack.append([ev, 0.0])
+        return [
+            "{} {}".format(key, int(wall * 1e6))
+            for key, wall in weights.items()
+        ]
+
+    def dump(self, path):
+        """Write a Chrome trace JSON file or, if `path` ends in ``.folded``,
+        folded stacks for flamegraphs
+        """
+        with open(path, "w") as f:
+            if path.endswith(".folded"):
+                f.write("\n".join(self.folded()) + "\n")
+            else:
+                json.dump(self.chrome_trace(), f)
+
+
+def active():
+    """Return the active profiler or None"""
+    return _active
+
+
+def span(name, cat="phase", **args):
+    """Context manager recording a span with the active profiler (a no-op
+    when profiling is disabled)
+    """
+    prof = _active
+    if prof is None:
+        return _NULL
+    return prof.span(name, cat, args or None)
+
+
+@contextlib.contextmanager
+def profile(path=None):
+    """Profile pysipp for the duration of the context yielding the
+    `Profiler`, optionally dumping it to `path` (see `Profiler.dump`).
+    """
+    prev, prof = _active, Profiler()
+    _set_active(prof)
+    try:
+        yield prof
+    finally:
+        _set_active(prev)
+        if path:
+            prof.dump(path)
+
+
+def start_from_env(environ=os.environ):
+    """Start profiling until exit if ``PYSIPP_PROFILE`` is set"""
+    path = environ.get(ENV_VAR)
+    if not path or _active is not None:
+        return None
+    prof = Profiler()
+    _set_active(prof)
+    atexit.register(prof.dump, path)
+    return prof
+
+
+# hook call spans started by `_before_hook`, per thread
+_hookcalls = threading.local()
+
+# plugin managers whose hook calls are traced while profiling
+_managers = weakref.WeakSet()
+# manager -> undo callable of the hook call monitoring installed on it
+_monitored = weakref.WeakKeyDictionary()
+# hook implementation -> timed copy used while profiling
+_timed_impls = {}
+_lock = threading.RLock()
+
+
+def _set_active(prof):
+    """Make `prof` the active profiler, tracing the hook calls of all
+    instrumented plugin managers only while a profiler is active
+    """
+    global _active
+    with _lock:
+        _active = prof
+        if prof is not None:
+            for mng in list(_managers):
+                _monitor(mng)
+            return
+        for undo in list(_monitored.values()):
+            undo()
+        _monitored.clear()
+        _timed_impls.clear()
+
+
+def _monitor(mng):
+    if mng not in _monitored:
+        _monitored[mng] = mng.add_hookcall_monitoring(
+            _before_hook, _after_hook
+        )
+
+
+def _timed(hook_name, impl):
+    """Return a copy of hook implementation `impl` whose function records
+    a span (the registered implementation is left untouched)
+    """
+    timed = _timed_impls.get(impl)
+    if timed is not None:
+        return timed
+    func = impl.function
+    name = "{}:{}.{}".format(
+        hook_name,
+        getattr(func, "__module__", None) or impl.plugin_name,
+        getattr(func, "__qualname__", func.__name__),
+    )
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        with span(name, "hookimpl"):
+            return func(*args)
+
+    timed = type(impl)(impl.plugin, impl.plugin_name, wrapper, impl.opts)
+    return _timed_impls.setdefault(impl, timed)
+
+
+def _before_hook(hook_name, hook_impls, kwargs):
+    stack = _hookcalls.__dict__.setdefault("stack", [])
+    prof = _active
+    if prof is None:
+        stack.append(None)
+        return
+    # `hook_impls` is a copy made for this call only
+    for i, impl in enumerate(hook_impls):
+        if not (impl.hookwrapper or getattr(impl, "wrapper", False)):
+            hook_impls[i] = _timed(hook_name, impl)
+    ctx = prof.span(hook_name, "hook")
+    ctx.__enter__()
+    stack.append(ctx)
+
+
+def _after_hook(outcome, hook_name, hook_impls, kwargs):
+    ctx = _hookcalls.stack.pop()
+    if ctx is not None:
+        ctx.__exit__(None, None, None)
+
+
+def instrument(mng):
+    """Record spans for all hook calls and hook implementations called
+    through plugin manager `mng` whenever profiling is active
+    """
+    with _lock:
+        _managers.add(mng)
+        if _active is not None:
+            _monitor(mng)
+    return mng
@@ -0,0 +1,183 @@
+"""
+Open-loop call rate profiles
+"""
+import math
+from collections import namedtuple
+
+from . import agent
+from . import utils
+
+log = utils.get_logger()
+
+# a constant call rate (calls/s) held for `duration` seconds (None: forever)
+Phase = namedtuple("Phase", "rate duration")
+
+# a linear change in rate from `start` to `end` over `duration` seconds
+Segment = namedtuple("Segment", "start end duration")
+
+
+class RateProfile(object):
+    """A piecewise call rate profile built from steps, linear ramps and
+    plateaus, eg::
+
+        >>> profile = RateProfile().ramp(10, 100, 90).plateau(300)
+
+    Profiles which SIPp can run natively (a single rate, or a ramp with an
+    integral increase per `interval` optionally followed by a plateau) are
+    compiled onto an agent's ``-rate_*`` flags by `apply`. Anything else
+    is compiled by `phases` into a sequence of constant rate phases (ramps
+    are discretized per `interval` seconds) to be run by `run_phases`.
+    """
+
+    def __init__(self, interval=1):
+        self.interval = interval
+        self.segments = []
+
+    def _append(self, segment):
+        if self.segments and self.segments[-1].duration is None:
+            raise ValueError("Can't extend a profile which runs forever")
+        self.segments.append(segment)
+        return self
+
+    def step(self, rate, duration=None):
+        """Run at `rate` for `duration` seconds (forever if None)"""
+        return self._append(Segment(rate, rate, duration))
+
+    def ramp(self, start, end, duration):
+        """Change the rate linearly from `start` to `end`"""
+        if not duration:
+            raise ValueError("A ramp requires a duration")
+        return self._append(Segment(start, end, duration))
+
+    def plateau(self, duration=None):
+        """Hold the last rate for `duration` seconds (forever if None)"""
+        if not self.segments:
+            raise ValueError("A plateau must follow a step or ramp")
+        return self.step(self.segments[-1].end, duration)
+
+    @property
+    def duration(self):
+        """Total duration in seconds or None if the profile runs forever"""
+        if self.segments and self.segments[-1].duration is None:
+            return None
+        return sum(seg.duration for seg in self.segments)
+
+    def phases(self):
+        """Compile into a list of constant rate `Phase`s"""
+        phases = []
+        for seg in self.segments:
+            if seg.start == seg.end:
+                parts = [Phase(seg.start, seg.duration)]
+            else:
+                count = max(1, int(math.ceil(seg.duration / self.interval)))
+                step = (seg.end - seg.start) / count
+                parts = [
+                    Phase(
+                        utils.sipp_num(seg.start + step * i),
+                        seg.duration / count,
+                    )
+                    for i in range(count)
+                ]
+            for phase in parts:
+                # merge consecutive phases at the same rate
+                if phases and phases[-1].rate == phase.rate:
+                    last = phases.pop()
+                    duration = (
+                        None
+                        if phase.duration is None
+                        else last.duration + phase.duration
+                    )
+                    phase = Phase(phase.rate, duration)
+                phases.append(phase)
+        return phases
+
+    def calls(self):
+        """Total number of calls placed or None if the profile is endless"""
+        if self.duration is None:
+            return None
+        return int(sum(p.rate * p.duration for p in self.phases()))
+
+    def native_flags(self):
+        """Return the agent settings implementing this profile in a single
+        SIPp process or None if SIPp can't run it natively.
+        """
+        segs = self.segments
+        if not segs:
+            return None
+        ramp = segs[0]
+        if len(segs) == 1 and ramp.start == ramp.end:
+            flags = {"rate": ramp.start}
+        else:
+            plateau = segs[1] if len(segs) == 2 else None
+            if len(segs) > 2 or (
+                plateau
+                and (plateau.start != plateau.end or plateau.start != ramp.end)
+            ):
+                return None
+
+            # SIPp only increases the rate, by an integral step
+            steps = ramp.duration / self.interval
+            if steps != int(steps) or ramp.end <= ramp.start:
+                return None
+            increase = (ramp.end - ramp.start) / steps
+            if increase != int(increase):
+                return None
+
+            flags = {
+                "rate": ramp.start,
+                "rate_increase": int(increase),
+                "rate_interval": self.interval,
+                "rate_max": ramp.end,
+                # SIPp quits when the max is reached unless told not to
+                "no_rate_quit": bool(plateau),
+            }
+
+        if self.duration is not None and (len(segs) > 1 or segs[0].duration):
+            flags["call_count"] = self.calls()
+        return flags
+
+    def apply(self, ua):
+        """Compile this profile onto the flags of agent `ua` returning a
+        bool indicating whether SIPp can run it natively.
+        """
+        flags = self.native_flags()
+        if flags is None:
+            return False
+        for key, value in flags.items():
+            setattr(ua, key, value)
+        return True
+
+
+def run_phases(scen, profile, name="uac", slack=10, **kwargs):
+    """Run `profile` for the agent `name` in `scen` as a sequence of
+    constant rate phases, each in a fresh copy of the scenario.
+
+    Every phase places ``rate * duration`` calls and must complete within
+    its duration plus `slack` seconds. Returns the runner of each phase.
+    """
+    runners = []
+    for phase in profile.phases():
+        if phase.duration is None:
+            raise ValueError("Phased profiles must have a finite duration")
+        calls = int(math.ceil(phase.rate * phase.duration))
+        if not calls:
+            continue
+
+        phase_scen = scen.copy()
+        for ua in phase_scen.agents.values():
+            if ua.logical_name != name:
+                # all other agents handle exactly the phase's calls
+                ua.call_count = calls
+                continue
+
+            # divide the phase's load between shards
+            index, count = ua.shard_info or (0, 1)
+            ua.rate = utils.sipp_num(phase.rate / count)
+            ua.call_count = agent._split(calls, count)[index]
+        log.info(
+            "running {} at {} calls/s for {}s".format(
+                name, phase.rate, phase.duration
+            )
+        )
+        runners.append(phase_scen(timeout=phase.duration + slack, **kwargs))
+    return runners
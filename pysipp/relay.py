@@ -0,0 +1,395 @@
+"""
+An impairing UDP/TCP relay for emulating network latency, loss and jitter
+without root (a userspace stand-in for tc/netem)
+"""
+import asyncio
+import collections
+import contextlib
+import random
+import socket
+
+from . import background
+from . import resolver
+from . import utils
+
+log = utils.get_logger()
+
+DISTRIBUTIONS = ("uniform", "normal", "exponential")
+
+# largest datagram and stream chunk relayed at once
+BUFSIZE = 65536
+
+# relayed directions: client -> server and server -> client
+UP, DOWN = "up", "down"
+
+
+class Impairment(object):
+    """Network impairment applied to each relayed packet (or stream chunk)
+    in one direction, modelled after netem.
+
+    :param delay: mean delay in seconds
+    :param jitter: delay variation in seconds; with a ``uniform``
+        `distribution` delays are spread over ``delay +/- jitter``, with
+        ``normal`` jitter is the standard deviation and with ``exponential``
+        the mean of an exponentially distributed extra delay. A callable
+        ``distribution(rng)`` returning delays in seconds may also be given.
+    :param loss: probability of dropping a packet
+    :param duplicate: probability of sending a packet twice
+    :param reorder: probability of sending a packet without any delay
+        (ahead of delayed packets)
+    :param bandwidth: cap in bytes per second
+
+    Streams (TCP) can't lose or reorder data so only delay (kept in order)
+    and bandwidth apply to them.
+    """
+
+    def __init__(
+        self,
+        delay=0,
+        jitter=0,
+        distribution="uniform",
+        loss=0,
+        duplicate=0,
+        reorder=0,
+        bandwidth=None,
+    ):
+        if not callable(distribution) and distribution not in DISTRIBUTIONS:
+            raise ValueError(
+                "Distribution must be callable or one of {}".format(
+                    DISTRIBUTIONS
+                )
+            )
+        for name, prob in [
+            ("loss", loss),
+            ("duplicate", duplicate),
+            ("reorder", reorder),
+        ]:
+            if not 0 <= prob <= 1:
+                raise ValueError("{} must be a probability".format(name))
+        self.delay = delay
+        self.jitter = jitter
+        self.distribution = distribution
+        self.loss = loss
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.bandwidth = bandwidth
+
+    def sample_delay(self, rng):
+        """Draw a packet delay in seconds using random generator `rng`"""
+        if callable(self.distribution):
+            delay = self.distribution(rng)
+        elif not self.jitter:
+            delay = self.delay
+        elif self.distribution == "uniform":
+            delay = rng.uniform(
+                self.delay - self.jitter, self.delay + self.jitter
+            )
+        elif self.distribution == "normal":
+            delay = rng.gauss(self.delay, self.jitter)
+        else:
+            delay = self.delay + rng.expovariate(1.0 / self.jitter)
+        return max(0, delay)
+
+
+# no impairment
+NONE = Impairment()
+
+
+class Relay(background.BackgroundServer):
+    """Relay traffic received on (`host`, `port`) to `upstream` applying
+    `impairment` to packets sent upstream and `reverse` (by default the
+    same impairment) to replies.
+
+    UDP clients are each given their own upstream socket so that replies
+    are relayed back to the right client. Counters for each direction
+    (``up``, ``down``) are kept in `stats`, eg. ``stats["up.dropped"]``.
+
+    Relays are served like a `pysipp.responder.Responder`; passing a
+    `seed` makes the impairment reproducible.
+    """
+
+    def __init__(
+        self,
+        upstream,
+        impairment=NONE,
+        reverse=None,
+        host="127.0.0.1",
+        port=0,
+        transport="udp",
+        seed=None,
+        name="relay",
+    ):
+        if transport not in ("udp", "tcp"):
+            raise ValueError("Unsupported transport {}".format(transport))
+        self.upstream = tuple(upstream)
+        self.impairments = {
+            UP: impairment,
+            DOWN: impairment if reverse is None else reverse,
+        }
+        self.host = host
+        self.port = port
+        self.transport = transport
+        self.name = name
+        self.rng = random.Random(seed)
+        self.stats = collections.Counter()
+
+        self._loop = None
+        self._sock = None
+        self._server = None
+        # client address -> upstream socket (udp)
+        self._clients = {}
+        # time the link in each direction is busy until (bandwidth)
+        self._busy = {UP: 0, DOWN: 0}
+        # connection handlers (tcp)
+        self._tasks = set()
+
+    @property
+    def srcaddr(self):
+        """The (host, port) traffic to relay is accepted on"""
+        return (self.host, self.port)
+
+    def _family(self):
+        return resolver.ip_family(self.host) or socket.AF_INET
+
+    def _departure(self, direction, size, delay):
+        """Return the loop time a packet of `size` bytes delayed by `delay`
+        leaves accounting for the bandwidth cap
+        """
+        due = self._loop.time() + delay
+        bandwidth = self.impairments[direction].bandwidth
+        if bandwidth:
+            due = max(due, self._busy[direction])
+            self._busy[direction] = due + size / float(bandwidth)
+        return due
+
+    def _datagram(self, direction, data, send):
+        """Impair and relay a single datagram"""
+        imp = self.impairments[direction]
+        stats = self.stats
+        stats[direction + ".received"] += 1
+        stats[direction + ".bytes"] += len(data)
+        if imp.loss and self.rng.random() < imp.loss:
+            stats[direction + ".dropped"] += 1
+            return
+
+        copies = 1
+        if imp.duplicate and self.rng.random() < imp.duplicate:
+            stats[direction + ".duplicated"] += 1
+            copies = 2
+        for _ in range(copies):
+            if imp.reorder and self.rng.random() < imp.reorder:
+                stats[direction + ".reordered"] += 1
+                delay = 0
+            else:
+                delay = imp.sample_delay(self.rng)
+            due = self._departure(direction, len(data), delay)
+            if due <= self._loop.time():
+                self._send(direction, send, data)
+            else:
+                self._loop.call_at(due, self._send, direction, send, data)
+
+    def _send(self, direction, send, data):
+        try:
+            send(data)
+        except OSError as err:
+            self.stats[direction + ".errors"] += 1
+            log.debug("{} failed to relay: {}".format(self.name, err))
+            return
+        self.stats[direction + ".forwarded"] += 1
+
+    def _upstream_sock(self, client):
+        sock = self._clients.get(client)
+        if sock is None:
+            sock = socket.socket(self._family(), socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            sock.connect(self.upstream)
+            self._loop.add_reader(sock.fileno(), self._on_reply, sock, client)
+            self._clients[client] = sock
+        return sock
+
+    def _on_request(self):
+        try:
+            data, client = self._sock.recvfrom(BUFSIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        self._datagram(UP, data, self._upstream_sock(client).send)
+
+    def _on_reply(self, sock, client):
+        try:
+            data = sock.recv(BUFSIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as err:
+            # eg. ICMP port unreachable from upstream
+            log.debug("{} upstream error: {}".format(self.name, err))
+            return
+
+        def send(data):
+            self._sock.sendto(data, client)
+
+        self._datagram(DOWN, data, send)
+
+    async def _pump(self, direction, reader, writer):
+        """Relay a stream in `direction` keeping chunks in order"""
+        imp = self.impairments[direction]
+        queue = asyncio.Queue()
+        stats = self.stats
+
+        async def deliver():
+            while True:
+                due, data = await queue.get()
+                if data is None:
+                    break
+                wait = due - self._loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                writer.write(data)
+                await writer.drain()
+                stats[direction + ".forwarded"] += 1
+
+        delivery = asyncio.ensure_future(deliver())
+        last = 0
+        try:
+            while True:
+                data = await reader.read(BUFSIZE)
+                if not data:
+                    break
+                stats[direction + ".received"] += 1
+                stats[direction + ".bytes"] += len(data)
+                due = self._departure(
+                    direction, len(data), imp.sample_delay(self.rng)
+                )
+                # streams are delivered in order
+                last = max(due, last)
+                queue.put_nowait((last, data))
+            queue.put_nowait((None, None))
+            await delivery
+        except (ConnectionError, OSError) as err:
+            stats[direction + ".errors"] += 1
+            log.debug("{} stream error: {}".format(self.name, err))
+        finally:
+            delivery.cancel()
+            writer.close()
+
+    async def _on_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            await self._relay_stream(reader, writer)
+        finally:
+            self._tasks.discard(task)
+
+    async def _relay_stream(self, reader, writer):
+        try:
+            up_reader, up_writer = await asyncio.open_connection(
+                *self.upstream
+            )
+        except OSError as err:
+            self.stats["up.errors"] += 1
+            log.warning(
+                "{} can't reach {}: {}".format(self.name, self.upstream, err)
+            )
+            writer.close()
+            return
+        await asyncio.gather(
+            self._pump(UP, reader, up_writer),
+            self._pump(DOWN, up_reader, writer),
+        )
+
+    async def start(self):
+        """Start relaying on the running event loop"""
+        self._loop = asyncio.get_running_loop()
+        if self.transport == "udp":
+            self._sock = socket.socket(self._family(), socket.SOCK_DGRAM)
+            self._sock.setblocking(False)
+            self._sock.bind((self.host, self.port))
+            self._loop.add_reader(self._sock.fileno(), self._on_request)
+            sockname = self._sock.getsockname()
+        else:
+            self._server = await asyncio.start_server(
+                self._on_connection, self.host, self.port
+            )
+            sockname = self._server.sockets[0].getsockname()
+        self.port = sockname[1]
+        log.debug(
+            "{} relaying {} -> {}".format(
+                self.name, self.srcaddr, self.upstream
+            )
+        )
+        return self
+
+    async def stop(self):
+        """Stop relaying"""
+        if self._sock:
+            self._loop.remove_reader(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+        for sock in self._clients.values():
+            self._loop.remove_reader(sock.fileno())
+            sock.close()
+        self._clients.clear()
+        if self._server:
+            self._server.close()
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+
+def _transport(ua):
+    # SIPp's -t: u(dp), t(cp), l (tls over tcp), s(ctp), c (compressed udp)
+    kind = (ua.transport or "u1")[0]
+    if kind in "uc":
+        return "udp"
+    if kind in "tl":
+        return "tcp"
+    raise ValueError("Can't relay transport {}".format(ua.transport))
+
+
+def insert(scen, impairment=NONE, reverse=None, seed=None):
+    """Route the SIP traffic of every client in `scen` through a started
+    `Relay` (one per remote address) by pointing the clients' `proxyaddr`
+    at it, and return the relays.
+
+    The Request-URI (`destaddr`) is left as is. Media is not relayed.
+    """
+    if getattr(scen, "netns", False):
+        raise ValueError("Can't relay into a network namespace")
+    relays = {}
+    for ua in scen.clients.values():
+        prepared = scen.prepare_agent(ua)
+        target = prepared.proxyaddr or prepared.destaddr
+        if not target:
+            continue
+        key = (tuple(target), _transport(prepared))
+        relay = relays.get(key)
+        if relay is None:
+            relay = Relay(
+                target,
+                impairment,
+                reverse=reverse,
+                transport=key[1],
+                seed=seed,
+                name="relay-{}".format(prepared.name),
+            )()
+            relays[key] = relay
+        ua.proxyaddr = relay.srcaddr
+    return list(relays.values())
+
+
+@contextlib.contextmanager
+def impair(scen, impairment=NONE, reverse=None, seed=None):
+    """Run `scen` with client traffic impaired (see `insert`) for the
+    duration of the context, yielding the relays.
+    """
+    clients = list(scen.clients.values())
+    saved = [ua.proxyaddr for ua in clients]
+    relays = insert(scen, impairment, reverse=reverse, seed=seed)
+    try:
+        yield relays
+    finally:
+        for relay in relays:
+            relay.close()
+        for ua, proxyaddr in zip(clients, saved):
+            ua.proxyaddr = proxyaddr
@@ -22,26 +22,54 @@ EXITCODES = {
     255: "Command or syntax error: check stderr output",
 }
 
+# exit codes which (may) indicate a failure to bind a local socket
+BIND_EXITCODES = (-2, 254)
+
+
+def is_bind_failure(returncode, stderr=b""):
+    """Return a bool indicating whether a SIPp process which exited with
+    `returncode` and wrote `stderr` failed to bind one of its sockets.
+    """
+    if returncode in BIND_EXITCODES:
+        return True
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode(errors="replace")
+    # generic fatal errors report the bind failure on stderr
+    return returncode == 255 and "bind" in (stderr or "").lower()
+
 
 def err_summary(agents2procs):
     """Return an error message detailing SIPp cmd exit codes
     if any of the commands exitted with a non-zero status
     """
-    name2ec = OrderedDict()
-    # gather all exit codes
+    name2ecs = OrderedDict()
+    # gather all exit codes grouping shards of the same logical agent
     for ua, proc in agents2procs:
-        name2ec[ua.name] = proc.returncode
+        name = getattr(ua, "logical_name", ua.name)
+        name2ecs.setdefault(name, []).append(proc.returncode)
 
-    if any(name2ec.values()):
+    if any(any(ecs) for ecs in name2ecs.values()):
         # raise a detailed error
-        msg = "Some agents failed\n"
-        msg += "\n".join(
-            "'{}' with exit code {} -> {}".format(
+        lines = ["Some agents failed"]
+        for name, ecs in name2ecs.items():
+            rc = aggregate_exitcode(ecs)
+            line = "'{}' with exit code {} -> {}".format(
                 name, rc, EXITCODES.get(rc, "unknown exit code")
             )
-            for name, rc in name2ec.items()
-        )
-        return msg
+            if len(ecs) > 1:
+                line += " (shard exit codes {})".format(ecs)
+            lines.append(line)
+        return "\n".join(lines)
+
+
+def aggregate_exitcode(exitcodes):
+    """Return the exit code of a sharded agent: 0 if all shards succeeded
+    otherwise the first failure
+    """
+    for rc in exitcodes:
+        if rc:
+            return rc
+    return 0
 
 
 def emit_logfiles(agents2procs, level="warning", max_lines=100):
@@ -0,0 +1,139 @@
+"""
+Cached host name resolution
+"""
+import functools
+import os
+import socket
+import threading
+import time
+
+from . import utils
+
+log = utils.get_logger()
+
+# seconds to cache successful and failed lookups respectively
+DEFAULT_TTL = 300.0
+DEFAULT_NEGATIVE_TTL = 30.0
+
+
+def _env_ttl():
+    ttl = os.environ.get("PYSIPP_DNS_TTL")
+    return float(ttl) if ttl else DEFAULT_TTL
+
+
+@functools.lru_cache(maxsize=1024)
+def ip_family(host):
+    """Return the address family of `host` if it is a literal IP address
+    otherwise None.
+    """
+    if not isinstance(host, str):
+        return None
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+            return family
+        except (socket.error, ValueError):
+            continue
+    return None
+
+
+class Resolver(object):
+    """A thread safe, TTL expiring cache of name resolution results.
+
+    Failed lookups are cached for `negative_ttl` seconds so that hosts
+    without working DNS don't stall on every call. Literal IP addresses
+    are never looked up.
+    """
+
+    def __init__(
+        self,
+        ttl=None,
+        negative_ttl=DEFAULT_NEGATIVE_TTL,
+        clock=time.monotonic,
+        sockmod=socket,
+    ):
+        self.ttl = _env_ttl() if ttl is None else ttl
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        self._sockmod = sockmod
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, key, func, *args):
+        now = self._clock()
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry and entry[0] > now:
+            result, err = entry[1:]
+        else:
+            log.debug("resolving {}".format(key))
+            result = err = None
+            try:
+                result = func(*args)
+                expiry = now + self.ttl
+            except socket.gaierror as exc:
+                err = exc
+                expiry = now + self.negative_ttl
+            with self._lock:
+                self._cache[key] = (expiry, result, err)
+
+        if err:
+            raise err
+        return result
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        """Cached `socket.getaddrinfo`"""
+        sock = self._sockmod
+        if ip_family(host):
+            # literal addrs only need to be parsed
+            return sock.getaddrinfo(
+                host, port, family, type, proto, flags | sock.AI_NUMERICHOST
+            )
+        return self._lookup(
+            ("getaddrinfo", host, port, family, type, proto, flags),
+            sock.getaddrinfo,
+            host,
+            port,
+            family,
+            type,
+            proto,
+            flags,
+        )
+
+    def getfqdn(self, name=""):
+        """Cached `socket.getfqdn`"""
+        return self._lookup(("getfqdn", name), self._sockmod.getfqdn, name)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+_resolver = Resolver()
+
+
+def configure(**kwargs):
+    """Replace the default resolver with one built from `kwargs` (see
+    `Resolver`) and return it.
+    """
+    global _resolver
+    _resolver = Resolver(**kwargs)
+    return _resolver
+
+
+def get_resolver():
+    """Return the default resolver"""
+    return _resolver
+
+
+def getaddrinfo(*args, **kwargs):
+    return _resolver.getaddrinfo(*args, **kwargs)
+
+
+def getfqdn(name=""):
+    return _resolver.getfqdn(name)
+
+
+def clear():
+    """Drop all cached lookups"""
+    _resolver.clear()
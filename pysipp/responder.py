@@ -0,0 +1,307 @@
+"""
+A lightweight in-process asyncio SIP responder (UAS stand-in)
+"""
+import asyncio
+import collections
+import hashlib
+import socket
+
+from . import agent
+from . import background
+from . import resolver
+from . import utils
+
+log = utils.get_logger()
+
+# final response per request method (None: no response)
+DEFAULT_CODES = {
+    "INVITE": 200,
+    "ACK": None,
+    "BYE": 200,
+    "CANCEL": 200,
+    "REGISTER": 200,
+    "OPTIONS": 200,
+}
+# response to methods missing from the codes
+UNKNOWN_CODE = 501
+
+REASONS = {
+    100: "Trying",
+    180: "Ringing",
+    183: "Session Progress",
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    408: "Request Timeout",
+    480: "Temporarily Unavailable",
+    481: "Call/Transaction Does Not Exist",
+    486: "Busy Here",
+    487: "Request Terminated",
+    500: "Server Internal Error",
+    501: "Not Implemented",
+    503: "Service Unavailable",
+    600: "Busy Everywhere",
+    603: "Decline",
+}
+
+# compact header forms (RFC 3261 section 7.3.3)
+COMPACT = {
+    "v": "via",
+    "f": "from",
+    "t": "to",
+    "i": "call-id",
+    "l": "content-length",
+    "m": "contact",
+    "c": "content-type",
+}
+
+# responses remembered for answering retransmitted requests
+MAX_TRANSACTIONS = 10000
+
+
+def parse_message(data):
+    """Parse a SIP message returning (start line, headers, body) where
+    headers is a list of (lower case name, value) pairs.
+    """
+    head, sep, body = data.partition(b"\r\n\r\n")
+    if not sep:
+        raise ValueError("Incomplete SIP message")
+    lines = head.decode("utf-8", "replace").split("\r\n")
+    headers = []
+    for line in lines[1:]:
+        if line[:1] in (" ", "\t") and headers:
+            # folded continuation
+            name, value = headers[-1]
+            headers[-1] = (name, value + " " + line.strip())
+            continue
+        name, colon, value = line.partition(":")
+        if not colon:
+            raise ValueError("Malformed header {!r}".format(line))
+        name = name.strip().lower()
+        headers.append((COMPACT.get(name, name), value.strip()))
+    return lines[0], headers, body
+
+
+def _header(headers, name):
+    for key, value in headers:
+        if key == name:
+            return value
+    return None
+
+
+def _tag(callid):
+    # stable per dialog without keeping state
+    return hashlib.sha1(callid.encode()).hexdigest()[:10]
+
+
+def build_response(headers, code, contact=None, reason=None):
+    """Build the response with status `code` to a request with `headers`"""
+    callid = _header(headers, "call-id") or ""
+    lines = ["SIP/2.0 {} {}".format(code, reason or REASONS.get(code, ""))]
+    lines.extend("Via: " + value for key, value in headers if key == "via")
+    lines.append("From: " + (_header(headers, "from") or ""))
+    to = _header(headers, "to") or ""
+    if code > 100 and ";tag=" not in to:
+        to += ";tag=" + _tag(callid)
+    lines.append("To: " + to)
+    lines.append("Call-ID: " + callid)
+    lines.append("CSeq: " + (_header(headers, "cseq") or ""))
+    if contact:
+        lines.append("Contact: " + contact)
+    lines.append("Content-Length: 0")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, responder):
+        self.responder = responder
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        def send(msg):
+            self.transport.sendto(msg, addr)
+
+        self.responder.handle(data, send)
+
+
+class _StreamProtocol(asyncio.Protocol):
+    def __init__(self, responder):
+        self.responder = responder
+        self.transport = None
+        self.buf = b""
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def send(self, msg):
+        if not self.transport.is_closing():
+            self.transport.write(msg)
+
+    def data_received(self, data):
+        self.buf += data
+        while True:
+            # skip keep alive CRLFs
+            self.buf = self.buf.lstrip(b"\r\n")
+            end = self.buf.find(b"\r\n\r\n")
+            if end < 0:
+                return
+            try:
+                _, headers, _ = parse_message(self.buf[: end + 4])
+                length = int(_header(headers, "content-length") or 0)
+            except ValueError as err:
+                log.warning("dropping connection: {}".format(err))
+                self.transport.close()
+                return
+            size = end + 4 + length
+            if len(self.buf) < size:
+                return
+            msg, self.buf = self.buf[:size], self.buf[size:]
+            self.responder.handle(msg, self.send)
+
+
+class Responder(background.BackgroundServer):
+    """An asyncio SIP UAS answering requests with configurable response
+    codes and delays, as a cheap far end for driving client agents.
+
+    `codes` maps request methods to final response codes (see
+    `DEFAULT_CODES`, None for no response) and `delays` maps methods to
+    seconds to wait before sending the final response. INVITEs are first
+    answered immediately with each `provisional` response code.
+
+    A responder can take the place of the server agent in a scenario where
+    it's served for the duration of each run and clients are routed to its
+    `srcaddr` (a port is leased for it unless one is given)::
+
+        >>> scen = pysipp.scenario(agents=[Responder(), pysipp.client()])
+
+    Calling a responder serves it in a background thread like a
+    non-blocking agent::
+
+        >>> uas = Responder()(block=False)
+        >>> pysipp.client(destaddr=uas.srcaddr)()
+        >>> uas.close()
+
+    Use `start` and `stop` directly to serve from a running event loop.
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        transport="udp",
+        codes=None,
+        delays=None,
+        provisional=(100,),
+        name="responder",
+    ):
+        if transport not in ("udp", "tcp"):
+            raise ValueError("Unsupported transport {}".format(transport))
+        self.host = host
+        self.port = port
+        self.transport = transport
+        self.codes = dict(DEFAULT_CODES, **(codes or {}))
+        self.delays = dict(delays or {})
+        self.provisional = tuple(provisional)
+        self.name = name
+        # requests received per method and responses sent per code
+        self.received = collections.Counter()
+        self.sent = collections.Counter()
+
+        self._loop = None
+        self._server = None
+        # (call-id, cseq) -> last response sent or None if pending
+        self._transactions = collections.OrderedDict()
+
+    @property
+    def srcaddr(self):
+        """The (host, port) requests are answered on"""
+        return agent.SocketAddr(self.host, self.port)
+
+    @property
+    def contact(self):
+        host = self.host
+        if resolver.ip_family(host) == socket.AF_INET6:
+            host = "[{}]".format(host)
+        return "<sip:{}:{};transport={}>".format(
+            host, self.port, self.transport
+        )
+
+    def handle(self, data, send):
+        """Answer the SIP message `data` calling `send` with each response"""
+        try:
+            start, headers, _ = parse_message(data)
+        except ValueError as err:
+            log.debug("dropping invalid message: {}".format(err))
+            return
+        if start.startswith("SIP/"):
+            return  # a response
+        method = start.split(" ", 1)[0].upper()
+        self.received[method] += 1
+
+        code = self.codes.get(method, UNKNOWN_CODE)
+        if code is None:
+            return
+        key = (_header(headers, "call-id"), _header(headers, "cseq"))
+        if key in self._transactions:
+            # retransmission
+            last = self._transactions[key]
+            if last:
+                send(last)
+            return
+        self._transactions[key] = None
+        if len(self._transactions) > MAX_TRANSACTIONS:
+            self._transactions.popitem(last=False)
+
+        if method == "INVITE":
+            for provisional in self.provisional:
+                self._send(key, headers, provisional, send)
+        delay = self.delays.get(method)
+        if delay:
+            self._loop.call_later(
+                delay, self._send, key, headers, code, send, method
+            )
+        else:
+            self._send(key, headers, code, send, method)
+
+    def _send(self, key, headers, code, send, method=None):
+        contact = None
+        if method == "INVITE" and 200 <= code < 300:
+            contact = self.contact
+        msg = build_response(headers, code, contact=contact)
+        if key in self._transactions:
+            self._transactions[key] = msg
+        self.sent[code] += 1
+        send(msg)
+
+    async def start(self):
+        """Start serving on the running event loop"""
+        self._loop = asyncio.get_running_loop()
+        if self.transport == "udp":
+            self._server, _ = await self._loop.create_datagram_endpoint(
+                lambda: _DatagramProtocol(self),
+                local_addr=(self.host, self.port),
+            )
+            sockname = self._server.get_extra_info("sockname")
+        else:
+            self._server = await self._loop.create_server(
+                lambda: _StreamProtocol(self), self.host, self.port
+            )
+            sockname = self._server.sockets[0].getsockname()
+        # resolve an ephemeral port
+        self.port = sockname[1]
+        log.debug("{} serving on {}".format(self.name, self.srcaddr))
+        return self
+
+    async def stop(self):
+        """Stop serving"""
+        server, self._server = self._server, None
+        if server is None:
+            return
+        server.close()
+        if self.transport == "tcp":
+            await server.wait_closed()
@@ -0,0 +1,579 @@
+"""
+Structured run results, a SQLite results database for trend analysis and
+a cache of passing runs
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from collections import OrderedDict
+
+from . import plugin
+from . import report
+from . import utils
+
+log = utils.get_logger()
+
+# resource usage fields recorded per agent
+RUSAGE_FIELDS = ("ru_utime", "ru_stime", "ru_maxrss")
+
+AgentResult = namedtuple(
+    "AgentResult",
+    "name cmd returncode duration rusage stats logical_name client",
+    defaults=(None, False),
+)
+AgentResult.__doc__ = """Outcome of a single SIPp process.
+
+``duration`` is in seconds (None if the runner doesn't record spawn and
+exit times), ``rusage`` is a dict of `RUSAGE_FIELDS` (or None) and
+``stats`` the final row of the agent's statistics file (see `parse_stats`).
+``logical_name`` is the name of the agent it is a shard of (None if not
+sharded) and ``client`` whether it's a client agent.
+
+Aggregates of all shards of an agent (see `RunResult.logical_agents`) have
+no ``cmd``.
+"""
+
+
+def _stat_value(text):
+    """Convert a SIPp statistics field to a number where possible"""
+    text = text.strip()
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    # durations are formatted as HH:MM:SS[:uuuuuu]
+    parts = text.split(":")
+    if len(parts) in (3, 4) and all(part.isdigit() for part in parts):
+        secs = int(parts[0]) * 3600 + int(parts[1]) * 60 + int(parts[2])
+        if len(parts) == 4:
+            secs += int(parts[3]) / 10.0 ** len(parts[3])
+        return secs
+    return text or None
+
+
+def parse_stats(path):
+    """Parse the last (cumulative) row of the SIPp statistics file
+    (``-trace_stat``) at `path` into an ordered dict of column -> value.
+    Durations are converted to seconds.
+    """
+    with open(path, "r", errors="replace") as f:
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    if len(lines) < 2:
+        return OrderedDict()
+    header = lines[0].rstrip(";").split(";")
+    row = lines[-1].rstrip(";").split(";")
+    return OrderedDict(
+        (key, _stat_value(value)) for key, value in zip(header, row)
+    )
+
+
+def _rusage(rusage):
+    if rusage is None:
+        return None
+    return {name: getattr(rusage, name) for name in RUSAGE_FIELDS}
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def aggregate_stats(stats):
+    """Combine the SIPp statistics of the shards of an agent: counters and
+    rates are summed, other numbers (times and averages) are averaged and
+    any other values taken from the first shard
+    """
+    stats = [entry for entry in stats if entry]
+    if not stats:
+        return None
+    combined = OrderedDict()
+    for key in stats[0]:
+        values = [entry.get(key) for entry in stats]
+        if not all(_is_number(value) for value in values):
+            combined[key] = values[0]
+        elif all(isinstance(value, int) for value in values) or (
+            "Rate(" in key
+        ):
+            combined[key] = sum(values)
+        else:
+            combined[key] = sum(values) / float(len(values))
+    return combined
+
+
+def _aggregate(name, shards):
+    """Return the `AgentResult` of logical agent `name` from its `shards`"""
+    durations = [ua.duration for ua in shards if ua.duration is not None]
+    rusage = None
+    if all(ua.rusage for ua in shards):
+        rusage = {
+            field: sum(ua.rusage[field] for ua in shards)
+            for field in RUSAGE_FIELDS
+        }
+        # peak memory of the largest shard
+        rusage["ru_maxrss"] = max(ua.rusage["ru_maxrss"] for ua in shards)
+    return AgentResult(
+        name,
+        None,
+        report.aggregate_exitcode(ua.returncode for ua in shards),
+        max(durations) if durations else None,
+        rusage,
+        aggregate_stats(ua.stats for ua in shards),
+        client=shards[0].client,
+    )
+
+
+class RunResult(object):
+    """The outcome of running a scenario: its name, whether it timed out,
+    its wall clock duration and an `AgentResult` per agent (in launch
+    order).
+    """
+
+    def __init__(
+        self, scenario, agents, timedout=False, duration=None, timestamp=None
+    ):
+        self.scenario = scenario
+        self.agents = agents
+        self.timedout = timedout
+        self.duration = duration
+        # wall clock time the run finished
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    @classmethod
+    def from_run(cls, scen, agents, cmds2procs, timedout=False):
+        """Build the result for the prepared `agents` of `scen` from the
+        runner's ``cmds2procs`` mapping.
+        """
+        uaresults = []
+        spawned, exited = [], []
+        for ua, (cmd, proc) in zip(agents, cmds2procs.items()):
+            start = getattr(proc, "spawned_at", None)
+            end = getattr(proc, "exited_at", None)
+            duration = None
+            if start is not None and end is not None:
+                duration = end - start
+                spawned.append(start)
+                exited.append(end)
+
+            stats = None
+            if ua.trace_stat and ua.stat_file:
+                try:
+                    stats = parse_stats(ua.stat_file)
+                except OSError as err:
+                    log.warning(
+                        "no statistics for '{}': {}".format(ua.name, err)
+                    )
+            uaresults.append(
+                AgentResult(
+                    ua.name,
+                    cmd,
+                    proc.returncode,
+                    duration,
+                    _rusage(getattr(proc, "rusage", None)),
+                    stats,
+                    ua.logical_name if ua.shard_info else None,
+                    ua.is_client(),
+                )
+            )
+        return cls(
+            scen.name,
+            uaresults,
+            timedout=timedout,
+            duration=max(exited) - min(spawned) if spawned else None,
+        )
+
+    @property
+    def ok(self):
+        """Bool determining whether all agents succeeded"""
+        return not self.timedout and not any(
+            ua.returncode for ua in self.agents
+        )
+
+    @property
+    def exitcodes(self):
+        return OrderedDict((ua.name, ua.returncode) for ua in self.agents)
+
+    @property
+    def logical_agents(self):
+        """An `AgentResult` per logical agent (in launch order) where the
+        shards of each sharded agent are aggregated
+        """
+        groups = OrderedDict()
+        for ua in self.agents:
+            groups.setdefault(ua.logical_name or ua.name, []).append(ua)
+        return [
+            _aggregate(name, shards) if shards[0].logical_name else shards[0]
+            for name, shards in groups.items()
+        ]
+
+    def todict(self):
+        return {
+            "scenario": self.scenario,
+            "timedout": self.timedout,
+            "duration": self.duration,
+            "timestamp": self.timestamp,
+            "agents": [ua._asdict() for ua in self.agents],
+            "logical_agents": [ua._asdict() for ua in self.logical_agents],
+        }
+
+    def __repr__(self):
+        return "<RunResult '{}' {} {}>".format(
+            self.scenario,
+            "ok" if self.ok else "timedout" if self.timedout else "failed",
+            dict(self.exitcodes),
+        )
+
+
+def default_db_path():
+    """Return the default results database location"""
+    return utils.data_path("results.db")
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    scenario TEXT NOT NULL,
+    build TEXT,
+    timestamp REAL NOT NULL,
+    duration REAL,
+    timedout INTEGER NOT NULL,
+    ok INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS agents (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    cmd TEXT NOT NULL,
+    returncode INTEGER,
+    stats TEXT,
+    logical_name TEXT,
+    client INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    agent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_scenario ON runs (scenario, build);
+CREATE INDEX IF NOT EXISTS metrics_run ON metrics (run_id, name);
+"""
+
+
+class SQLiteSink(object):
+    """A plugin appending every `RunResult` to the SQLite database at
+    `path` (see `default_db_path`) tagged with a `build` label (eg. the
+    version of the device under test).
+
+    Numeric values (agent ``duration``, resource usage and statistics
+    columns) are stored as metrics per logical agent (the shards of an
+    agent are aggregated) which can be queried with `trend` to track them
+    across builds::
+
+        >>> pysipp.plugin.mng.register(SQLiteSink(build="1.2.3"))
+    """
+
+    def __init__(self, path=None, build=None):
+        self.path = path or default_db_path()
+        self.build = build
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        # connections are per call so sinks can be shared between threads
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return _closing(conn)
+
+    @plugin.hookimpl
+    def pysipp_run_result(self, result):
+        self.append(result)
+
+    def append(self, result, build=None):
+        """Store `result` returning its run id"""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO runs "
+                "(scenario, build, timestamp, duration, timedout, ok) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    result.scenario,
+                    build or self.build,
+                    result.timestamp,
+                    result.duration,
+                    result.timedout,
+                    result.ok,
+                ),
+            )
+            run_id = cur.lastrowid
+            conn.executemany(
+                "INSERT INTO agents VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        run_id,
+                        ua.name,
+                        ua.cmd,
+                        ua.returncode,
+                        json.dumps(ua.stats) if ua.stats else None,
+                        ua.logical_name,
+                        ua.client,
+                    )
+                    for ua in result.agents
+                ],
+            )
+            metrics = []
+            for ua in result.logical_agents:
+                values = dict(ua.stats or {})
+                values.update(ua.rusage or {})
+                values["duration"] = ua.duration
+                metrics.extend(
+                    (run_id, ua.name, name, value)
+                    for name, value in values.items()
+                    if _is_number(value)
+                )
+            conn.executemany(
+                "INSERT INTO metrics VALUES (?, ?, ?, ?)", metrics
+            )
+        return run_id
+
+    def runs(self, scenario=None, build=None, limit=None):
+        """Return stored runs (newest first) as dicts, optionally filtered
+        by `scenario` name and `build`
+        """
+        query = "SELECT * FROM runs"
+        where, args = _filters(scenario=scenario, build=build)
+        query += where + " ORDER BY timestamp DESC, id DESC"
+        if limit:
+            query += " LIMIT ?"
+            args.append(limit)
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(query, args)]
+
+    def builds(self, scenario=None):
+        """Return the recorded builds in the order they were first run"""
+        where, args = _filters(scenario=scenario)
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT build FROM runs" + where + " GROUP BY build "
+                "ORDER BY MIN(timestamp)",
+                args,
+            )
+            return [row["build"] for row in rows]
+
+    def metrics(self, scenario, name, agent=None, build=None):
+        """Return the values of metric `name` for every run of `scenario`
+        as (run id, build, agent, value) tuples in run order
+        """
+        where, args = _filters(
+            **{"r.scenario": scenario, "m.name": name, "m.agent": agent}
+        )
+        if build is not None:
+            where += " AND r.build = ?"
+            args.append(build)
+        with self._connect() as conn:
+            return [
+                tuple(row)
+                for row in conn.execute(
+                    "SELECT r.id, r.build, m.agent, m.value FROM metrics m "
+                    "JOIN runs r ON r.id = m.run_id"
+                    + where
+                    + " ORDER BY r.timestamp, r.id",
+                    args,
+                )
+            ]
+
+    def run_results(self, build, scenario=None):
+        """Return a `RunResult` (with the exit codes and statistics of its
+        agents) for every run of `build` (optionally only of `scenario`) in
+        run order
+        """
+        where, args = _filters(**{"r.build": build, "r.scenario": scenario})
+        runs = OrderedDict()
+        with self._connect() as conn:
+            for row in conn.execute(
+                "SELECT r.*, a.name AS agent, a.cmd, a.returncode, a.stats, "
+                "a.logical_name, a.client FROM runs r "
+                "JOIN agents a ON a.run_id = r.id"
+                + where
+                + " ORDER BY r.timestamp, r.id",
+                args,
+            ):
+                result = runs.get(row["id"])
+                if result is None:
+                    result = runs[row["id"]] = RunResult(
+                        row["scenario"],
+                        [],
+                        timedout=bool(row["timedout"]),
+                        duration=row["duration"],
+                        timestamp=row["timestamp"],
+                    )
+                result.agents.append(
+                    AgentResult(
+                        row["agent"],
+                        row["cmd"],
+                        row["returncode"],
+                        None,
+                        None,
+                        json.loads(row["stats"]) if row["stats"] else None,
+                        row["logical_name"],
+                        bool(row["client"]),
+                    )
+                )
+        return list(runs.values())
+
+    def trend(self, scenario, name, agent=None):
+        """Summarize metric `name` of `scenario` per build (in the order
+        builds were first run) as dicts with the ``build``, sample
+        ``count`` and ``mean``, ``min`` and ``max`` values
+        """
+        where, args = _filters(
+            **{"r.scenario": scenario, "m.name": name, "m.agent": agent}
+        )
+        with self._connect() as conn:
+            return [
+                dict(row)
+                for row in conn.execute(
+                    "SELECT r.build AS build, COUNT(*) AS count, "
+                    "AVG(m.value) AS mean, MIN(m.value) AS min, "
+                    "MAX(m.value) AS max FROM metrics m "
+                    "JOIN runs r ON r.id = m.run_id"
+                    + where
+                    + " GROUP BY r.build ORDER BY MIN(r.timestamp)",
+                    args,
+                )
+            ]
+
+
+def _filters(**columns):
+    """Build a WHERE clause matching all `columns` which are not None"""
+    clauses, args = [], []
+    for column, value in columns.items():
+        if value is not None:
+            clauses.append("{} = ?".format(column))
+            args.append(value)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), args
+
+
+class _closing(object):
+    """Commit (or roll back) and close a connection on exit"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, *exc_info):
+        try:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.conn.close()
+
+
+# bump whenever what `ResultCache.key` covers changes
+CACHE_VERSION = 1
+
+# memoized sha1 content digests of scenario inputs
+_file_digest = utils.StampCache(utils.file_digest)
+
+
+def default_cache_path():
+    """Return the default on-disk result cache location"""
+    return utils.cache_path("results.json")
+
+
+class ResultCache(object):
+    """A persistent set of the keys (see `key`) of scenarios which passed,
+    used by `pysipp.walk` to skip rerunning scenarios whose inputs have not
+    changed.
+
+    Keys cover a user provided `token` (eg. the version of the device
+    under test) so bumping it invalidates all entries. Passes are recorded
+    while the cache is registered as a plugin, most easily by using it as
+    a context manager which also saves it on exit::
+
+        >>> with ResultCache(token="dut-1.2.3") as cache:
+        ...     for path, scen in pysipp.walk(rootdir, cache=cache):
+        ...         scen()
+
+    Only the `max_entries` most recently used keys are kept.
+    """
+
+    def __init__(self, path=None, token=None, max_entries=10000):
+        self.path = path or default_cache_path()
+        self.token = token
+        self._keys = utils.JSONKeySet(self.path, max_entries=max_entries)
+        self._registered = []
+
+    def key(self, scen):
+        """Return the hexdigest of the inputs of `scen`: its SIPp scripts,
+        injection files and ``pysipp_conf.py``, the rendered commands of
+        its agents (without ports, which are usually allocated per run),
+        the sipp binaries and the `token`.
+        """
+        hasher = hashlib.sha1(
+            "{}:{}".format(CACHE_VERSION, self.token).encode()
+        )
+        paths = []
+        if scen.mod:
+            paths.append(scen.mod.__file__)
+        for ua in scen.prepare():
+            ua = ua.copy()
+            for key in ua.keys():
+                if key.endswith("_port"):
+                    setattr(ua, key, None)
+            hasher.update(ua.render().encode() + b"\0")
+            paths.extend([ua.scen_file, ua.info_file, ua.bin_path])
+            paths.extend(ua.info_files or ())
+        for path in paths:
+            if path and os.path.isfile(path):
+                hasher.update(_file_digest(path).encode())
+        return hasher.hexdigest()
+
+    def load(self):
+        self._keys.load()
+
+    def passed(self, scen):
+        """Bool determining whether `scen` passed with the same inputs"""
+        return self.key(scen) in self._keys
+
+    def add(self, scen):
+        """Record a pass of `scen`"""
+        self._keys.add(self.key(scen))
+
+    def discard(self, scen):
+        """Forget any pass of `scen`"""
+        self._keys.discard(self.key(scen))
+
+    @plugin.hookimpl
+    def pysipp_scen_finished(self, scen, cmds2procs, timedout, timestamp):
+        if timedout or any(proc.returncode for proc in cmds2procs.values()):
+            self.discard(scen)
+        else:
+            self.add(scen)
+
+    def save(self):
+        """Atomically write the cache to disk if it has changed"""
+        self._keys.save()
+
+    def __enter__(self):
+        ctx = plugin.register([self])
+        ctx.__enter__()
+        self._registered.append(ctx)
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self._registered.pop().__exit__(*exc_info)
+        finally:
+            self.save()
@@ -1,10 +1,22 @@
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
 import importlib
+import importlib.machinery
+import importlib.util
 import inspect
+import itertools
+import json
 import logging
 import os
 import tempfile
+import threading
 import types
 
+from . import profiler
+
 LOG_FORMAT = (
     "%(asctime)s %(threadName)s [%(levelname)s] %(name)s "
     "%(filename)s:%(lineno)d : %(message)s"
@@ -16,16 +28,62 @@ DATE_FORMAT = "%b %d %H:%M:%S"
 def load_source(name: str, path: str) -> types.ModuleType:
     """
     Replacement for deprecated imp.load_source()
-    Thanks to:
-    https://github.com/epfl-scitas/spack for pointing out the
-    important missing "spec.loader.exec_module(module)" line.
+
+    The module is created from its spec and its (cached, see `get_code`)
+    code object executed in the module's namespace.
     """
     spec = importlib.util.spec_from_file_location(name, path)
     module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module)
+    exec(get_code(path), module.__dict__)
     return module
 
 
+class StampCache(object):
+    """Memoize ``func(path)`` in memory keyed on the file's path and
+    revalidated by a single ``stat()``: values are recomputed whenever the
+    file's mtime or size changes.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        # path -> ((mtime_ns, size), value)
+        self.entries = {}
+        functools.update_wrapper(self, func)
+
+    def __call__(self, path):
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = self.entries.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        value = self.func(path)
+        self.entries[path] = (stamp, value)
+        return value
+
+
+@StampCache
+def get_code(path):
+    """Return the compiled code object for the python source at `path`.
+
+    Code objects are cached in memory (see `StampCache`) on top of the
+    standard on-disk ``__pycache__`` bytecode cache.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    return importlib.machinery.SourceFileLoader(name, path).get_code(name)
+
+
+def file_digest(path, hasher=None, chunk_size=1 << 16):
+    """Return the hexdigest of the content of `path` as accumulated by
+    `hasher` (a new sha1 hash object by default)
+    """
+    hasher = hasher or hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(functools.partial(f.read, chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
 def get_logger():
     """Get the project logger instance"""
     return logging.getLogger("pysipp")
@@ -37,11 +95,117 @@ def log_to_stderr(level="INFO", **kwargs):
     logging.basicConfig(**defaults)
 
 
+def sipp_num(value, ndigits=3):
+    """Format a numeric SIPp option value: integral floats as ints, others
+    rounded to `ndigits` places
+    """
+    return int(value) if value == int(value) else round(value, ndigits)
+
+
 def get_tmpdir():
     """Return a random temp dir"""
     return tempfile.mkdtemp(prefix="pysipp_")
 
 
+def _xdg_path(env, default, parts):
+    basedir = os.environ.get(env) or os.path.join(
+        os.path.expanduser("~"), *default
+    )
+    return os.path.join(basedir, "pysipp", *parts)
+
+
+def cache_path(*parts):
+    """Return the path of `parts` in pysipp's (XDG) user cache directory"""
+    return _xdg_path("XDG_CACHE_HOME", (".cache",), parts)
+
+
+def data_path(*parts):
+    """Return the path of `parts` in pysipp's (XDG) user data directory"""
+    return _xdg_path("XDG_DATA_HOME", (".local", "share"), parts)
+
+
+def load_json(path, version):
+    """Return the dict saved by `save_json` at `path` or an empty dict if
+    the file is missing, corrupt or of a different `version`
+    """
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(data, dict) or data.get("version") != version:
+        return {}
+    return data
+
+
+def save_json(path, data, version):
+    """Atomically write the dict `data` tagged with `version` to `path`"""
+    dirpath = os.path.dirname(path)
+    if dirpath:
+        os.makedirs(dirpath, exist_ok=True)
+
+    fd, tmppath = tempfile.mkstemp(dir=dirpath or None, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(dict(data, version=version), f)
+        os.replace(tmppath, path)
+    except BaseException:
+        os.unlink(tmppath)
+        raise
+
+
+class JSONKeySet(object):
+    """A set of string keys persisted as JSON at `path` of which only the
+    `max_entries` most recently used are kept.
+
+    Bumping `version` invalidates previously saved keys.
+    """
+
+    version = 1
+
+    def __init__(self, path, max_entries=100000):
+        self.path = path
+        self.max_entries = max_entries
+        self._keys = collections.OrderedDict()
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        data = load_json(self.path, self.version)
+        self._keys = collections.OrderedDict.fromkeys(data.get("keys", ()))
+        self._dirty = False
+
+    def __contains__(self, key):
+        if key in self._keys:
+            # only persisted along with other changes
+            self._keys.move_to_end(key)
+            return True
+        return False
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key):
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.max_entries:
+            self._keys.popitem(last=False)
+        self._dirty = True
+
+    def discard(self, key):
+        if key in self._keys:
+            del self._keys[key]
+            self._dirty = True
+
+    def save(self):
+        """Atomically write the keys to disk if they have changed"""
+        if not self._dirty:
+            return
+        save_json(self.path, {"keys": list(self._keys)}, self.version)
+        self._dirty = False
+
+
 def load_mod(path, name=None):
     """Load a source file as a module"""
     name = name or os.path.splitext(os.path.basename(path))[0]
@@ -49,6 +213,102 @@ def load_mod(path, name=None):
     return load_source(name, path)
 
 
+class LazyMod(object):
+    """A proxy for a python source module which is only loaded (executed)
+    on first access to an attribute not defined on the proxy itself.
+
+    ``__file__`` and ``__name__`` are available without triggering a load.
+    """
+
+    def __init__(self, path, name=None):
+        self.__file__ = path
+        self.__name__ = name or os.path.splitext(os.path.basename(path))[0]
+        self._mod = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._mod is None:
+            with self._lock:
+                if self._mod is None:
+                    with profiler.span("confpy", path=self.__file__):
+                        self._mod = load_mod(self.__file__, name=self.__name__)
+        return self._mod
+
+    @property
+    def loaded(self):
+        """Bool determining whether the underlying module has been loaded"""
+        return self._mod is not None
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        return "<LazyMod '{}' from '{}'{}>".format(
+            self.__name__,
+            self.__file__,
+            "" if self.loaded else " (not loaded)",
+        )
+
+
+@contextlib.contextmanager
+def thread_pool(workers=None):
+    """Deliver a thread pool executor with `workers` threads or ``None`` if
+    `workers` is not set.
+    """
+    if not workers:
+        yield None
+        return
+
+    pool = concurrent.futures.ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="pysipp"
+    )
+    try:
+        yield pool
+    finally:
+        pool.shutdown(wait=True)
+
+
+def imap(func, items, pool=None, ordered=True, window=None):
+    """Map `func` over `items` using executor `pool` if provided.
+
+    Results are delivered as they complete unless `ordered` is set in which
+    case they are delivered in input order. At most `window` items (twice
+    the cpu count by default) are in flight at once so `items` is consumed
+    no faster than results are.
+    """
+    if pool is None:
+        for item in items:
+            yield func(item)
+        return
+
+    items = iter(items)
+    window = window or 2 * (os.cpu_count() or 1)
+    pending = collections.deque(
+        pool.submit(func, item) for item in itertools.islice(items, window)
+    )
+    try:
+        while pending:
+            if ordered:
+                fut = pending.popleft()
+            else:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                fut = done.pop()
+                pending.remove(fut)
+            # keep the pool busy while the consumer handles this result
+            for item in itertools.islice(items, 1):
+                pending.append(pool.submit(func, item))
+            yield fut.result()
+    finally:
+        # don't leave queued work behind if the consumer bails early
+        for fut in pending:
+            fut.cancel()
+
+
 def iter_data_descrs(cls):
     """Deliver all public data-descriptors (for properties only if `fset` is
     defined) as `name`, `attr`, pairs
@@ -61,53 +321,70 @@ def iter_data_descrs(cls):
             yield name, attr
 
 
-def DictProxy(d, keys, cls=None):
-    """A dictionary proxy object which provides attribute access to the
-    elements of the provided dictionary `d`
+class DictProxyAttr(object):
+    """An attribute which when modified proxies to an instance dictionary
+    named `dictname` (or the instance's ``__dict__`` if not provided).
+    """
+
+    def __init__(self, key, dictname=None):
+        self.key = key
+        self.dictname = dictname
+
+    def _dict(self, obj):
+        return getattr(obj, self.dictname) if self.dictname else obj.__dict__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        return self._dict(obj).get(self.key)
+
+    def __set__(self, obj, value):
+        self._dict(obj)[self.key] = value
+
+
+def add_dictproxy_attrs(cls, keys, dictname):
+    """Provide attribute access on type `cls` for all named `keys` in the
+    dictionary held by each instance's `dictname` attribute.
     """
+    for key in keys:
+        setattr(cls, key, DictProxyAttr(key, dictname))
+
 
-    class DictProxyAttr(object):
-        """An attribute which when modified proxies to an instance dictionary
-        named `dictname`.
-        """
+def _delegate(name):
+    def method(self, *args, **kwargs):
+        return getattr(self.__dict__, name)(*args, **kwargs)
 
-        def __init__(self, key):
-            self.key = key
+    method.__name__ = name
+    return method
 
-        def __get__(self, obj, cls):
-            if obj is None:
-                return self
-            return d.get(self.key)
 
-        def __set__(self, obj, value):
-            d[self.key] = value
+@functools.lru_cache(maxsize=None)
+def dictproxy_type(keys):
+    """Return a dictionary proxy type whose instances provide attribute
+    access to the elements of the dictionary they're constructed with.
 
+    Types are built once per (tuple of) `keys` and reused.
+    """
     # provide attribute access for all named keys
     attrs = {key: DictProxyAttr(key) for key in keys}
 
-    if cls is not None:
-        # apply all attributes on provided type
-        for name, attr in attrs.items():
-            setattr(cls, name, attr)
-    else:
-        # delegate some methods to the original dict
-        proxied_attrs = [
-            "__repr__",
-            "__getitem__",
-            "__setitem__",
-            "__contains__",
-            "__len__",
-            "get",
-            "update",
-            "setdefault",
-        ]
-        attrs.update({attr: getattr(d, attr) for attr in proxied_attrs})
-
-        # construct required default methods
-        def init(self):
-            self.__dict__ = d
-
-        attrs.update({"__init__": init})
-
-        # render a new type
-        return type("DictProxy", (), attrs)
+    # delegate some methods to the original dict
+    proxied_attrs = [
+        "__repr__",
+        "__getitem__",
+        "__setitem__",
+        "__contains__",
+        "__len__",
+        "get",
+        "update",
+        "setdefault",
+    ]
+    attrs.update({attr: _delegate(attr) for attr in proxied_attrs})
+
+    def init(self, d):
+        self.__dict__ = d
+
+    attrs.update({"__init__": init})
+
+    # render a new type
+    return type("DictProxy", (), attrs)
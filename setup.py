@@ -39,7 +39,10 @@ setup(
     install_requires=["pluggy>=1.0.0"],
     tests_require=["pytest"],
     entry_points={
-        "console_scripts": ["sippfmt=pysipp.cli.sippfmt:main"],
+        "console_scripts": [
+            "sippfmt=pysipp.cli.sippfmt:main",
+            "pysipp=pysipp.cli.main:main",
+        ],
     },
     classifiers=[
         "Development Status :: 3 - Alpha",
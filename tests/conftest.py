@@ -2,6 +2,7 @@
 unit testing
 """
 import os
+import sys
 
 import pytest
 
@@ -35,3 +36,26 @@ def default_agents():
 def basic_scen(request):
     """The most basic scenario instance"""
     return scenario(autolocalsocks=request.param)
+
+
+@pytest.fixture
+def bindsipp(tmp_path):
+    """A fake sipp binary which fails like SIPp if it can't bind its
+    local port
+    """
+    path = tmp_path / "sipp"
+    script = """\
+import socket, sys, time
+args = sys.argv[1:]
+addr = args[args.index('-i') + 1], int(args[args.index('-p') + 1])
+sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+try:
+    sock.bind(addr)
+except OSError:
+    sys.stderr.write('Unable to bind main socket')
+    sys.exit(254)
+time.sleep(0.5)
+"""
+    path.write_text("#!{}\n".format(sys.executable) + script)
+    path.chmod(0o755)
+    return str(path)
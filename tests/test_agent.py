@@ -201,3 +201,102 @@ def test_authentication_arguments():
 
     assert "-au 'username'" in cmd
     assert "-ap 'passw0rd'" in cmd
+
+
+def test_scenario_types_reused():
+    scen, scen2 = agent.Scenario([agent.ua()]), agent.Scenario([agent.ua()])
+    assert type(scen) is type(scen2) is agent.ScenarioType
+    assert type(scen.defaults) is type(scen2.clientdefaults)
+
+
+def test_bulk_scenarios():
+    uas, uac = agent.server(), agent.client()
+    scens = agent.Scenarios(
+        [uas, uac], 3, defaults={"local_host": "127.0.0.1"}
+    )
+    assert len(scens) == 3
+    assert all(scen.local_host == "127.0.0.1" for scen in scens)
+
+    # no shared state between copies or with the template agents
+    first, second = scens[:2]
+    first.clientdefaults.uri_username = "doggy"
+    first.agents["uac"].key_vals["kitty"] = 1
+    assert second.clientdefaults.uri_username is None
+    assert not second.agents["uac"].key_vals
+    assert not uac.key_vals
+    assert first.agents["uac"] is not uac
+
+
+def test_shard(tmp_path):
+    inf = tmp_path / "users.csv"
+    inf.write_text(
+        "SEQUENTIAL\n" + "".join("user{}\n".format(i) for i in range(5))
+    )
+    uac = agent.client(
+        rate=10, limit=7, call_count=101, local_port=5070, info_file=str(inf)
+    )
+    shards = uac.shard(3)
+    assert [ua.name for ua in shards] == ["uac.0", "uac.1", "uac.2"]
+    assert all(ua.logical_name == "uac" for ua in shards)
+    assert [ua.call_count for ua in shards] == [34, 34, 33]
+    assert [ua.limit for ua in shards] == [3, 2, 2]
+    assert [ua.rate for ua in shards] == [4, 3, 3]
+    assert [ua.local_port for ua in shards] == [5070, 5071, 5072]
+    assert len(set(ua.base_cseq for ua in shards)) == 3
+    assert len(set(ua.cid_str for ua in shards)) == 3
+
+    # injection records are partitioned round robin
+    with open(shards[1].info_file) as f:
+        assert f.read() == "SEQUENTIAL\nuser1\nuser4\n"
+
+    with pytest.raises(ValueError):
+        shards[0].shard(2)
+    with pytest.raises(ValueError):
+        agent.client(call_count=2).shard(3)
+
+
+def test_scen_shards():
+    scen = pysipp.scenario(
+        call_count=100, rate=50, limit=10, shards={"uac": 4}
+    )
+    assert list(scen.agents) == ["uas", "uac.0", "uac.1", "uac.2", "uac.3"]
+    assert len(scen.shardsof("uac")) == 4
+
+    uas, *uacs = scen.prepare()
+    assert uas.call_count == 100
+    assert sum(ua.call_count for ua in uacs) == 100
+    assert sum(ua.rate for ua in uacs) == 50
+    # distinct sockets all routed to the server
+    assert len(set(ua.srcaddr for ua in uacs)) == 4
+    assert all(ua.destaddr == uas.srcaddr for ua in uacs)
+    # separate log files per shard
+    assert len(set(ua.screen_file for ua in uacs)) == 4
+
+    # shards survive copying
+    assert list(scen.copy().agents) == list(scen.agents)
+
+
+def test_scen_shards_defaults():
+    scen = pysipp.scenario(
+        clientdefaults={"local_port": 5070, "local_host": "127.0.0.1"},
+        shards={"uac": 3},
+        call_count=9,
+        limit=3,
+    )
+    uacs = scen.prepare()[1:]
+    assert [ua.local_port for ua in uacs] == [5070, 5071, 5072]
+    assert [ua.call_count for ua in uacs] == [3, 3, 3]
+
+    # default limits aren't divided
+    scen = pysipp.scenario(shards={"uac": 4})
+    uacs = scen.prepare()[1:]
+    assert [(ua.limit, ua.call_count) for ua in uacs] == [(1, 1)] * 4
+    assert len(set(ua.srcaddr for ua in uacs)) == 4
+
+
+def test_sharded_err_summary():
+    scen = pysipp.scenario(call_count=4, limit=2, shards={"uac": 2})
+    procs = [launch.subprocess.CompletedProcess(None, rc) for rc in (0, 0, 1)]
+    msg = pysipp.report.err_summary(zip(scen.prepare(), procs))
+    assert "'uac' with exit code 1" in msg
+    assert "shard exit codes [0, 1]" in msg
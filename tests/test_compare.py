@@ -0,0 +1,138 @@
+"""
+Comparison of recorded runs between builds
+"""
+import pytest
+
+from pysipp import compare
+from pysipp import results
+from pysipp.cli import main
+
+
+def stats(cps, failed=0, fast=90, slow=10):
+    return {
+        "CallRate(C)": cps,
+        "SuccessfulCall(C)": 100 - failed,
+        "FailedCall(C)": failed,
+        "ResponseTimeRepartition1": None,
+        "ResponseTimeRepartition1_<10": fast,
+        "ResponseTimeRepartition1_<20": slow,
+        "ResponseTimeRepartition1_>=20": 0,
+    }
+
+
+def agent(name, stats, client=False, logical_name=None):
+    return results.AgentResult(
+        name, "sipp " + name, 0, 1.0, None, stats, logical_name, client
+    )
+
+
+def run(scenario, shards=1, **kwargs):
+    agents = [agent("uas", stats(0))]
+    if shards == 1:
+        agents.append(agent("uac", stats(**kwargs), client=True))
+    else:
+        kwargs["cps"] = kwargs["cps"] / float(shards)
+        agents.extend(
+            agent("uac.{}".format(i), stats(**kwargs), True, "uac")
+            for i in range(shards)
+        )
+    return results.RunResult(scenario, agents)
+
+
+def test_mann_whitney_u():
+    u, p = compare.mann_whitney_u([1, 2, 3, 4, 5], [6, 7, 8, 9, 10])
+    assert u == 0
+    assert p == pytest.approx(2 / 252.0)
+    u, p = compare.mann_whitney_u([1, 2, 3], [4, 5, 6])
+    assert p == pytest.approx(0.1)
+    u, p = compare.mann_whitney_u([3, 1, 5], [2, 4, 6])
+    assert u == 3
+    assert p == pytest.approx(0.7)
+    # ties use the normal approximation
+    u, p = compare.mann_whitney_u([1, 1, 2, 2, 3], [3, 4, 4, 5, 5])
+    assert u == 0.5
+    assert 0.005 < p < 0.02
+    assert compare.mann_whitney_u([1, 1], [1, 1])[1] == 1.0
+    with pytest.raises(ValueError):
+        compare.mann_whitney_u([], [1])
+
+
+def test_run_metrics():
+    buckets = compare.histogram(stats(10))
+    assert buckets == [(0, 10.0, 90), (10.0, 20.0, 10), (20.0, None, 0)]
+    assert compare.percentile(buckets, 50) == pytest.approx(50 / 9.0)
+    assert compare.percentile(buckets, 95) == 15.0
+    assert compare.percentile([(0, 10.0, 0), (10.0, None, 4)], 50) == 10.0
+    assert compare.percentile([], 50) is None
+
+    metrics = compare.run_metrics(
+        [agent("uas", stats(0)), agent("uac", stats(10, failed=5), True)]
+    )
+    assert metrics["cps"] == 10
+    assert metrics["failure_ratio"] == 0.05
+    assert metrics["rtt_p99_ms"] == 19.0
+    assert compare.run_metrics([agent("uac", None, True)]) == {}
+
+    # shards are compared as a single logical agent
+    sharded = run("scen", shards=4, cps=10, failed=5).logical_agents
+    assert compare.run_metrics(sharded) == {
+        "cps": 10,
+        "failure_ratio": 0.05,
+        "rtt_p50_ms": metrics["rtt_p50_ms"],
+        "rtt_p95_ms": metrics["rtt_p95_ms"],
+        "rtt_p99_ms": 19.0,
+    }
+
+
+def test_compare():
+    baseline = {"scen": [{"cps": cps} for cps in (100, 101, 99, 100, 102)]}
+    candidate = {"scen": [{"cps": cps} for cps in (90, 91, 89, 92, 90)]}
+    (cmp,) = compare.compare(baseline, candidate)
+    assert cmp.metric == "cps"
+    assert cmp.baseline == 100 and cmp.candidate == 90
+    assert cmp.change == pytest.approx(-0.1)
+    assert cmp.regression
+    # improvements and tolerated changes are not regressions
+    (cmp,) = compare.compare(candidate, baseline)
+    assert not cmp.regression
+    (cmp,) = compare.compare(baseline, candidate, threshold=0.2)
+    assert not cmp.regression
+    # not significant
+    (cmp,) = compare.compare(baseline, {"scen": candidate["scen"][:2]})
+    assert cmp.pvalue > 0.05
+    assert not cmp.regression
+
+
+def test_cli(tmp_path, capsys):
+    path = str(tmp_path / "results.db")
+    db = results.SQLiteSink(path)
+    for cps in (100, 101, 99, 100, 102):
+        db.append(run("basic", cps=cps), build="1.0")
+        db.append(run("other", cps=cps), build="1.0")
+    for cps in (90, 91, 89, 92, 90):
+        db.append(run("basic", shards=2, cps=cps, slow=50), build="1.1")
+
+    assert main.main(["compare", "1.0", "1.1", "--db", path]) == 1
+    out, err = capsys.readouterr()
+    assert "skipping 'other'" in err
+    lines = out.splitlines()
+    assert lines[0].split() == [
+        "scenario",
+        "metric",
+        "baseline",
+        "candidate",
+        "change",
+        "p",
+    ]
+    regressed = [line.split()[1] for line in lines if "REGRESSION" in line]
+    assert regressed == ["cps", "rtt_p50_ms", "rtt_p95_ms", "rtt_p99_ms"]
+    assert lines[-1] == "4 regression(s) in 5 comparison(s)"
+
+    assert main.main(["compare", "1.1", "1.0", "--db", path]) == 0
+    assert main.main(["compare", "1.0", "1.1", "--db", path, "-m", "cps"]) == 1
+    argv = ["compare", "1.0", "1.1", "--db", path, "-m", "failure_ratio"]
+    assert main.main(argv) == 0
+    assert main.main(["compare", "1.0", "2.0", "--db", path]) == 2
+    missing = str(tmp_path / "missing.db")
+    assert main.main(["compare", "1.0", "1.1", "--db", missing]) == 2
+    capsys.readouterr()
@@ -0,0 +1,117 @@
+"""
+Injection file generation
+"""
+import concurrent.futures
+import os
+import time
+
+import pytest
+
+from pysipp import inject
+
+
+def users(count):
+    for i in range(count):
+        yield ("user{}".format(i), "[authentication username=u{}]".format(i))
+
+
+def test_generate(tmp_path):
+    paths = inject.generate(users(3), outdir=str(tmp_path))
+    assert len(paths) == 1
+    with open(paths[0]) as f:
+        assert f.read().splitlines() == [
+            "SEQUENTIAL",
+            "user0;[authentication username=u0]",
+            "user1;[authentication username=u1]",
+            "user2;[authentication username=u2]",
+        ]
+
+    # identical content is stored once
+    assert inject.generate(users(3), outdir=str(tmp_path)) == paths
+    assert len(os.listdir(str(tmp_path))) == 1
+
+
+def test_generate_partitions(tmp_path):
+    paths = inject.generate(
+        ("user{}".format(i) for i in range(7)),
+        header="RANDOM",
+        partitions=3,
+        outdir=str(tmp_path),
+    )
+    assert [inject.read(path) for path in paths] == [
+        ("RANDOM", ["user0", "user3", "user6"]),
+        ("RANDOM", ["user1", "user4"]),
+        ("RANDOM", ["user2", "user5"]),
+    ]
+
+
+def test_generate_keyed(tmp_path):
+    paths = inject.generate(users(10), key="ten", outdir=str(tmp_path))
+
+    def unused():
+        raise AssertionError("records should not be regenerated")
+        yield
+
+    assert inject.generate(unused(), key="ten", outdir=str(tmp_path)) == paths
+
+
+def test_generate_errors(tmp_path):
+    with pytest.raises(ValueError):
+        inject.generate(users(1), header="BOGUS", outdir=str(tmp_path))
+    with pytest.raises(ValueError):
+        inject.generate(users(2), partitions=3, outdir=str(tmp_path))
+    # no partial files are left behind
+    assert not os.listdir(str(tmp_path))
+
+
+def test_partition_cached(tmp_path):
+    src = tmp_path / "users.csv"
+    src.write_text("USER\na\nb\n\nc\n")
+    outdir = str(tmp_path / "out")
+    paths = inject.partition(str(src), 2, outdir=outdir)
+    assert inject.read(paths[0]) == ("USER", ["a", "c"])
+    mtimes = [os.stat(path).st_mtime_ns for path in paths]
+    assert inject.partition(str(src), 2, outdir=outdir) == paths
+    assert [os.stat(path).st_mtime_ns for path in paths] == mtimes
+
+
+def test_fifo_feed(tmp_path):
+    with inject.Feed(users(5), partitions=2, dirpath=str(tmp_path)) as feed:
+        # agents read their pipes concurrently and in any order
+        with concurrent.futures.ThreadPoolExecutor(2) as pool:
+            second = pool.submit(inject.read, feed.paths[1])
+            time.sleep(0.05)
+            first = pool.submit(inject.read, feed.paths[0])
+            header, records = first.result(timeout=5)
+            assert second.result(timeout=5)[1] == [
+                "user1;[authentication username=u1]",
+                "user3;[authentication username=u3]",
+            ]
+        assert header == "SEQUENTIAL"
+        assert len(records) == 3
+        assert feed.wait(timeout=1)
+        assert not feed.error
+
+        # pipes can't be partitioned without consuming them
+        with pytest.raises(ValueError):
+            inject.partition(feed.paths[0], 2)
+
+    assert not os.listdir(str(tmp_path))
+
+
+def test_fifo_feed_unread(tmp_path):
+    """Closing a feed nobody reads doesn't hang"""
+    feed = inject.Feed(users(5), dirpath=str(tmp_path))
+    feed.close()
+    assert feed.wait(timeout=1)
+    assert not os.listdir(str(tmp_path))
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "memfd_create"), reason="memfd is unsupported"
+)
+def test_memfd_feed():
+    with inject.Feed(users(3), header="USER", kind="memfd") as feed:
+        assert inject.read(feed.path) == inject.read(feed.path)
+        assert inject.read(feed.path)[0] == "USER"
+        assert len(inject.read(feed.path)[1]) == 3
@@ -1,6 +1,14 @@
 """
 Basic agent/scenario launching
 """
+import signal
+import threading
+
+import pytest
+
+import pysipp
+from pysipp import launch
+from pysipp import plugin
 from pysipp.agent import client
 from pysipp.agent import server
 from pysipp.launch import PopenRunner
@@ -44,3 +52,107 @@ def test_default_scen(default_agents):
     # both agents should be successful
     for cmd, proc in runner.get(timeout=0).items():
         assert not proc.returncode
+
+
+class Recorder(object):
+    """Plugin recording lifecycle hook calls"""
+
+    def __init__(self):
+        self.calls = []
+
+    @plugin.hookimpl
+    def pysipp_agent_spawned(self, cmd, pid, timestamp):
+        self.calls.append(("spawned", cmd, pid, timestamp))
+
+    @plugin.hookimpl
+    def pysipp_agent_exited(self, cmd, pid, returncode, rusage, timestamp):
+        self.calls.append(("exited", cmd, returncode, rusage))
+
+    @plugin.hookimpl
+    def pysipp_agent_signalled(self, cmd, pid, signum, timestamp):
+        self.calls.append(("signalled", cmd, signum))
+
+    @plugin.hookimpl
+    def pysipp_scen_finished(self, scen, cmds2procs, timedout, timestamp):
+        self.calls.append(("finished", scen, timedout))
+
+
+def test_lifecycle_hooks():
+    rec = Recorder()
+    cmds = ["true", "sleep 10", "sh -c 'sleep 0.2; exit 3'"]
+    runner = PopenRunner()
+    with plugin.register([rec]):
+        procs = runner(cmds, block=True)
+
+    kinds = [call[0] for call in rec.calls]
+    assert kinds[:3] == ["spawned"] * 3
+    spawned = [call[3] for call in rec.calls[:3]]
+    assert spawned == sorted(spawned)
+    assert procs["true"].spawned_at == spawned[0]
+
+    exited = {call[1]: call for call in rec.calls if call[0] == "exited"}
+    assert exited["true"][2] == 0
+    assert exited["sh -c 'sleep 0.2; exit 3'"][2] == 3
+    # the failure stops remaining agents
+    assert ("signalled", "sleep 10", signal.SIGUSR1) in rec.calls
+    assert exited["sleep 10"][2] == -signal.SIGUSR1
+    for cmd, proc in procs.items():
+        assert proc.returncode == exited[cmd][2]
+        assert proc.rusage is exited[cmd][3]
+        assert proc.rusage.ru_maxrss
+        assert proc.exited_at > proc.spawned_at
+
+
+def test_no_lifecycle_hooks():
+    assert not any(launch.lifecycle_hooks().values())
+    runner = PopenRunner()
+    procs = runner(["true"], block=True)
+    assert procs["true"].rusage
+
+
+def test_concurrent_status_checks():
+    """Polling the runner while agents exit neither loses their resource
+    usage nor their exit codes
+    """
+    cmds = ["sh -c 'sleep 0.{}; exit {}'".format(i, i) for i in range(1, 6)]
+    runner = PopenRunner()
+    done = threading.Event()
+
+    def poll():
+        while not done.is_set():
+            runner.is_alive()
+
+    pollers = [threading.Thread(target=poll) for _ in range(4)]
+    for thread in pollers:
+        thread.start()
+    try:
+        procs = runner(cmds, block=False)
+        runner.get(timeout=5)
+    finally:
+        done.set()
+        for thread in pollers:
+            thread.join()
+
+    # the first failure stops the others
+    assert [proc.returncode for proc in procs.values()] == [1] + [
+        -signal.SIGUSR1
+    ] * 4
+    for proc in procs.values():
+        assert proc.rusage is not None
+    assert not runner.is_alive()
+
+
+def test_scen_finished(bindsipp):
+    rec = Recorder()
+    scen = pysipp.scenario()
+    scen.defaults.bin_path = bindsipp
+    with plugin.register([rec]):
+        scen(timeout=5)
+    assert rec.calls[-1] == ("finished", scen, False)
+    assert [call[0] for call in rec.calls].count("exited") == 2
+
+    rec.calls[:] = []
+    with plugin.register([rec]):
+        with pytest.raises(launch.TimeoutError):
+            scen(timeout=0.1)
+    assert rec.calls[-1] == ("finished", scen, True)
@@ -2,7 +2,9 @@
 Scen dir loading
 """
 import os
+import shutil
 
+from pysipp import load
 from pysipp.load import iter_scen_dirs
 
 
@@ -21,3 +23,55 @@ def test_iter_dirs(scendir):
         expect = paths.get(os.path.basename(path), None)
         if expect:
             assert [bool(xmls), bool(confpy)] == expect
+
+
+def settle(tree):
+    """Backdate all dir mtimes so the index trusts them"""
+    for path, dirnames, filenames in os.walk(str(tree)):
+        os.utime(path, (1, 1))
+
+
+def test_scen_index(scendir, tmp_path, monkeypatch):
+    tree = tmp_path / "scens"
+    shutil.copytree(scendir, str(tree))
+    settle(tree)
+    idxpath = str(tmp_path / "index.json")
+
+    expect = [
+        (path, xmls, bool(confpy))
+        for path, xmls, confpy in iter_scen_dirs(str(tree))
+    ]
+    first = [
+        (path, xmls, bool(confpy))
+        for path, xmls, confpy in iter_scen_dirs(str(tree), index=idxpath)
+    ]
+    assert first == expect
+    assert os.path.isfile(idxpath)
+
+    # a fresh index loaded from disk rescans nothing
+    scanned = []
+    scan_dir = load.scan_dir
+    monkeypatch.setattr(
+        load, "scan_dir", lambda path: scanned.append(path) or scan_dir(path)
+    )
+    assert len(list(iter_scen_dirs(str(tree), index=idxpath))) == 2
+    assert not scanned
+
+    # new dirs are discovered and only changed dirs are rescanned
+    newdir = tree / "new"
+    shutil.copytree(str(tree / "default"), str(newdir))
+    dirs = [path for path, _, _ in iter_scen_dirs(str(tree), index=idxpath)]
+    assert str(newdir) in dirs
+    assert len(dirs) == 3
+    assert sorted(scanned) == [str(tree), str(newdir)]
+
+
+def test_xml_meta(tmp_path):
+    xml = tmp_path / "uac.xml"
+    xml.write_text('<scenario name="doggy"><recv response="200"/></scenario>')
+    meta = load.xml_meta(str(xml))
+    assert meta == {"name": "doggy", "plays_media": False}
+
+    xml.write_text('<scenario name="doggy">play_pcap_audio</scenario>')
+    os.utime(str(xml), (1, 1))
+    assert load.xml_meta(str(xml))["plays_media"]
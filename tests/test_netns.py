@@ -0,0 +1,46 @@
+"""
+Network namespace isolated execution
+"""
+import pytest
+
+import pysipp
+from pysipp import netns
+
+pytestmark = pytest.mark.skipif(
+    not netns.available(), reason="network namespaces are unavailable"
+)
+
+
+def test_namespace_lifetime():
+    ns = netns.Namespace()
+    assert "--target {}".format(ns.pid) in ns.wrap("true")
+    ns.close()
+    assert ns.closed
+    # idempotent
+    ns.close()
+
+
+def test_fixed_addrs():
+    scen = pysipp.scenario(netns=True)
+    uas, uac = scen.prepare()
+    assert uas.srcaddr == ("127.0.0.1", netns.SIP_PORT)
+    assert uac.srcaddr == ("127.0.0.1", netns.SIP_PORT + 1)
+    assert uac.destaddr == uas.srcaddr
+    assert uas.media_port != uac.media_port
+    # nothing was leased from the host
+    assert not pysipp.ports.leases(scen)
+
+
+def test_parallel_scenarios(bindsipp):
+    """Scenarios using the same well-known ports run concurrently without
+    colliding
+    """
+    scens = [pysipp.scenario(netns=True) for _ in range(3)]
+    finalizers = []
+    for scen in scens:
+        scen.defaults.bin_path = bindsipp
+        finalizers.append(scen(block=False))
+
+    for finalize in finalizers:
+        for proc in finalize(timeout=5).values():
+            assert proc.returncode == 0
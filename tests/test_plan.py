@@ -0,0 +1,54 @@
+"""
+Load planning
+"""
+import pysipp
+from pysipp import plan
+
+
+def test_littles_law():
+    lp = plan.LoadPlan(200, 9, setup=1, cores=64)
+    assert lp.concurrent == 2000
+    assert lp.limit == 2400
+    assert lp.shards == 1
+    assert lp.pause_duration == 9000
+    assert lp.recv_timeout > lp.pause_duration
+    assert lp.deadcall_wait == plan.DEADCALL_WAIT
+    assert not lp.warnings
+
+
+def test_shards_and_sockets():
+    # throughput bound
+    assert plan.LoadPlan(2000, 1, cores=64).shards == 4
+
+    # fd bound: a socket per call over TCP
+    lp = plan.LoadPlan(100, 99, transport="tn", nofile=2064, cores=64)
+    assert lp.limit == 12000
+    assert lp.shards == 6
+    assert lp.fds == plan.BASE_FDS + 2000
+
+    # more processes than cores
+    lp = plan.LoadPlan(5000, 1, cores=2)
+    assert lp.shards == 10
+    assert lp.warnings
+
+
+def test_scenkwargs():
+    lp = plan.LoadPlan(1000, 2, duration=10, cores=64)
+    scen = pysipp.scenario(**lp.scenkwargs())
+    assert len(scen.shardsof("uac")) == 2
+    uas, uac0, uac1 = scen.prepare()
+    assert uas.call_count == 10000
+    assert uac0.call_count + uac1.call_count == 10000
+    assert uac0.rate + uac1.rate == 1000
+    assert not lp.check(scen)
+
+
+def test_check():
+    lp = plan.LoadPlan(1000, 2, cores=64)
+    scen = pysipp.scenario(rate=100, limit=10, recv_timeout=1000)
+    found = lp.check(scen)
+    assert len(found) == 5
+    assert lp.warnings == found
+
+    # defaults fix everything but the shard count
+    assert len(lp.apply(scen)) == 1
@@ -0,0 +1,192 @@
+"""
+Port leasing
+"""
+import os
+import resource
+import socket
+import subprocess
+import sys
+
+import pytest
+
+import pysipp
+from pysipp import ports
+
+
+@pytest.fixture
+def allocator(tmp_path):
+    return ports.PortAllocator(
+        portrange=(21000, 21009), lockdir=str(tmp_path / "locks")
+    )
+
+
+def test_lease_unique(allocator):
+    leases = [allocator.lease("127.0.0.1") for _ in range(10)]
+    assert len(set(lease.port for lease in leases)) == 10
+    assert all(21000 <= lease.port <= 21009 for lease in leases)
+
+    # range exhausted
+    with pytest.raises(ports.AllocationError):
+        allocator.lease("127.0.0.1")
+
+    leases[0].release()
+    assert allocator.lease("127.0.0.1").port == leases[0].port
+
+
+def test_lease_across_allocators(allocator):
+    """Allocators sharing a lock dir (eg. in other processes) never hand out
+    the same port
+    """
+    other = ports.PortAllocator(
+        portrange=allocator.portrange, lockdir=allocator.lockdir
+    )
+    held = [allocator.lease("127.0.0.1") for _ in range(5)]
+    others = [other.lease("127.0.0.1") for _ in range(5)]
+    assert not set(lease.port for lease in held) & set(
+        lease.port for lease in others
+    )
+
+
+def test_lease_across_processes(allocator):
+    held = [allocator.lease("127.0.0.1") for _ in range(5)]
+    script = (
+        "from pysipp import ports\n"
+        "alloc = ports.PortAllocator(portrange={!r}, lockdir={!r})\n"
+        "held = [alloc.lease('127.0.0.1') for _ in range(5)]\n"
+        "print([lease.port for lease in held])\n"
+        "alloc.lease('127.0.0.1')\n"
+    ).format(allocator.portrange, allocator.lockdir)
+    proc = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True
+    )
+    assert "AllocationError" in proc.stderr
+    others = eval(proc.stdout)
+    assert not set(lease.port for lease in held) & set(others)
+
+
+def test_lease_fd_usage(allocator):
+    """Held leases don't keep file descriptors open"""
+    before = len(os.listdir("/proc/self/fd"))
+    leases = [allocator.lease("127.0.0.1") for _ in range(10)]
+    assert len(os.listdir("/proc/self/fd")) <= before
+    for lease in leases:
+        lease.release()
+
+
+def test_collect_beyond_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    limit = len(os.listdir("/proc/self/fd")) + 64
+    resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+    try:
+        # 4 leases per scenario
+        scens = [pysipp.scenario() for _ in range(limit)]
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    assert len(scens) == limit
+    held = [lease.port for scen in scens for lease in ports.leases(scen)]
+    assert len(set(held)) == 4 * limit
+
+
+def test_lease_skips_bound_ports(allocator):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 21000))
+    try:
+        leased = [allocator.lease("127.0.0.1").port for _ in range(9)]
+        assert 21000 not in leased
+    finally:
+        sock.close()
+
+
+def test_placeholders(allocator):
+    allocator.placeholders = True
+    lease = allocator.lease("127.0.0.1")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    with pytest.raises(OSError):
+        sock.bind(lease.addr)
+
+    lease.unplug()
+    sock.bind(lease.addr)
+    sock.close()
+
+
+def test_scen_leases():
+    scen = pysipp.scenario()
+    leases = ports.leases(scen)
+    # a sip and media port per agent
+    assert len(leases) == 4
+    assert set(lease.port for lease in leases) == set(
+        port
+        for ua in scen.agents.values()
+        for port in (ua.local_port, ua.media_port)
+    )
+
+    ports.release(scen)
+    assert not ports.leases(scen)
+    assert all(lease.released for lease in leases)
+
+
+def test_scen_leases_per_run(bindsipp):
+    """Ports released after a run are leased again by the next one"""
+    scen = pysipp.scenario()
+    scen.defaults.bin_path = bindsipp
+    held = set(lease.port for lease in ports.leases(scen))
+    scen(timeout=5)
+    assert not ports.leases(scen)
+
+    finalize = scen(block=False)
+    try:
+        assert set(lease.port for lease in ports.leases(scen)) == held
+    finally:
+        finalize(timeout=5)
+    assert not ports.leases(scen)
+
+
+def test_lease_port(allocator):
+    lease = allocator.lease("127.0.0.1", port=21005)
+    assert lease.port == 21005
+    with pytest.raises(ports.AllocationError):
+        allocator.lease("127.0.0.1", port=21005)
+    lease.release()
+    assert allocator.lease("127.0.0.1", port=21005).port == 21005
+
+
+def test_address_pool_balancing(allocator, monkeypatch):
+    monkeypatch.setattr(ports, "_allocator", allocator)
+    pool = ports.AddressPool(["127.0.0.0/30", "127.0.1.1"])
+    owner = type("Owner", (), {})()
+    leases = [pool.lease(owner, socktypes=ports.MEDIA_SOCKTYPES)]
+    leases += [pool.lease(owner) for _ in range(2)]
+    assert [pl.addr[0] for pl in leases] == [
+        "127.0.0.1",
+        "127.0.0.2",
+        "127.0.1.1",
+    ]
+    assert pool.load("127.0.0.2") == 1
+
+    # released addrs are reused first
+    leases[1].release()
+    assert pool.acquire() == "127.0.0.2"
+    assert pool.lease(owner).addr[0] == "127.0.0.2"
+
+    # otherwise the least loaded
+    leases[0].release()
+    leases.append(pool.lease(owner))
+    assert leases[-1].addr[0] == "127.0.0.1"
+    assert pool.lease(owner).addr[0] == "127.0.0.1"
+    assert pool.load("127.0.0.1") == 2
+
+
+def test_scen_local_addrs():
+    """Agents (and their media) are spread over the pool shared by all
+    scenarios
+    """
+    addrs = "127.0.2.0/29"
+    scens = [pysipp.scenario(local_addrs=addrs) for _ in range(3)]
+    used = []
+    for scen in scens:
+        for ua in scen.prepare():
+            assert ua.media_addr == ua.local_host
+            used.append(ua.local_host)
+
+    assert len(set(used)) == 6
+    assert ports.address_pool(addrs).load(used[0]) == 1
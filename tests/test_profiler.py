@@ -0,0 +1,147 @@
+"""
+Opt-in phase and hook profiling
+"""
+import json
+
+import pytest
+
+import pysipp
+from pysipp import plugin
+from pysipp import profiler
+
+
+def names(prof):
+    return [ev.name for ev in prof.events]
+
+
+def test_disabled():
+    assert profiler.active() is None
+    with profiler.span("noop"):
+        pass
+    with pysipp.profile() as prof:
+        assert profiler.active() is prof
+        with profiler.span("op", key="value"):
+            pass
+    assert profiler.active() is None
+    assert names(prof) == ["op"]
+    assert prof.events[0].args == {"key": "value"}
+
+
+def test_walk(scendir):
+    with pysipp.profile() as prof:
+        scens = list(pysipp.walk(scendir))
+    assert scens
+    spans = set(names(prof))
+    for name in [
+        "scan_dir",
+        "xml_meta",
+        "confpy",
+        "configure",
+        "pysipp_conf_scen_protocol",
+        "pysipp_conf_scen",
+        "pysipp_conf_scen:pysipp.pysipp_conf_scen",
+    ]:
+        assert name in spans, name
+
+    # user hooks from pysipp_conf.py modules are timed too
+    user = [
+        ev
+        for ev in prof.events
+        if ev.cat == "hookimpl" and "default_with_confpy" in ev.name
+    ]
+    assert {ev.name.split(":")[0] for ev in user} == {
+        "pysipp_conf_scen",
+        "pysipp_order_agents",
+    }
+
+
+def test_run(bindsipp):
+    scen = pysipp.scenario()
+    scen.defaults.bin_path = bindsipp
+    with pysipp.profile() as prof:
+        scen(timeout=5)
+    summary = prof.summary()
+    assert summary["spawn"]["count"] == 2
+    assert summary["render"]["count"] == 2
+    assert summary["wait"]["wall"] > 0.1
+    for name in ["prepare", "pysipp_run_protocol", "pysipp_new_runner"]:
+        assert name in summary
+
+
+class Failing(object):
+    @plugin.hookimpl
+    def pysipp_new_runner(self, scen):
+        raise RuntimeError("no runner")
+
+
+def test_hook_errors():
+    with pysipp.profile() as prof:
+        with plugin.register([Failing()]):
+            with pytest.raises(RuntimeError):
+                plugin.mng.hook.pysipp_new_runner(scen=None)
+            assert profiler._hookcalls.stack == []
+    # both spans are recorded despite the error
+    spans = [(ev.cat, ev.name) for ev in prof.events]
+    name = "pysipp_new_runner:test_profiler.Failing.pysipp_new_runner"
+    assert spans == [("hookimpl", name), ("hook", "pysipp_new_runner")]
+
+
+def test_monitoring_opt_in():
+    mng = plugin.context([Failing()])
+    hookexec = mng._inner_hookexec
+    impls = mng.hook.pysipp_new_runner.get_hookimpls()
+    funcs = [impl.function for impl in impls]
+    with pysipp.profile() as prof:
+        assert mng._inner_hookexec != hookexec
+        with pytest.raises(RuntimeError):
+            mng.hook.pysipp_new_runner(scen=None)
+    assert "pysipp_new_runner" in names(prof)
+    # monitoring is removed and implementations never rewritten
+    assert mng._inner_hookexec == hookexec
+    impls = mng.hook.pysipp_new_runner.get_hookimpls()
+    assert [impl.function for impl in impls] == funcs
+
+
+def test_dump(tmp_path):
+    prof = profiler.Profiler()
+    with prof.span("outer"):
+        with prof.span("inner", "hook"):
+            pass
+        with prof.span("inner", "hook"):
+            pass
+    with prof.span("other"):
+        pass
+
+    path = str(tmp_path / "trace.json")
+    prof.dump(path)
+    with open(path) as f:
+        trace = json.load(f)
+    events = trace["traceEvents"]
+    assert [ev["name"] for ev in events] == [
+        "inner",
+        "inner",
+        "outer",
+        "other",
+    ]
+    assert all(ev["ph"] == "X" for ev in events)
+    assert events[0]["cat"] == "hook"
+    assert "cpu_ms" in events[0]["args"]
+
+    path = str(tmp_path / "trace.folded")
+    prof.dump(path)
+    with open(path) as f:
+        stacks = [line.rsplit(" ", 1)[0] for line in f.read().splitlines()]
+    assert stacks == ["outer;inner", "outer", "other"]
+
+
+def test_start_from_env(monkeypatch, tmp_path):
+    assert profiler.start_from_env({}) is None
+    monkeypatch.setattr(profiler, "_active", None)
+    registered = []
+    monkeypatch.setattr(
+        profiler.atexit, "register", lambda *args: registered.append(args)
+    )
+    path = str(tmp_path / "trace.json")
+    prof = profiler.start_from_env({profiler.ENV_VAR: path})
+    assert profiler.active() is prof
+    assert registered == [(prof.dump, path)]
@@ -0,0 +1,86 @@
+"""
+Call rate profiles
+"""
+import pytest
+
+import pysipp
+from pysipp import agent
+from pysipp import rate
+
+
+def test_native_step():
+    profile = rate.RateProfile().step(50)
+    assert profile.native_flags() == {"rate": 50}
+    assert profile.duration is None
+
+    profile = rate.RateProfile().step(50, 10)
+    assert profile.native_flags() == {"rate": 50, "call_count": 500}
+
+
+def test_native_ramp():
+    profile = rate.RateProfile(interval=5).ramp(10, 100, 45).plateau(60)
+    assert profile.native_flags() == {
+        "rate": 10,
+        "rate_increase": 10,
+        "rate_interval": 5,
+        "rate_max": 100,
+        "no_rate_quit": True,
+        "call_count": profile.calls(),
+    }
+    ua = agent.client()
+    assert profile.apply(ua)
+    cmd = ua.render()
+    for flag in (
+        "-r '10'",
+        "-rate_increase '10'",
+        "-rate_interval '5'",
+        "-rate_max '100'",
+        "-no_rate_quit ",
+    ):
+        assert flag in cmd
+
+    # quits at the max rate without a plateau
+    assert not rate.RateProfile().ramp(1, 4, 3).native_flags()["no_rate_quit"]
+
+
+@pytest.mark.parametrize(
+    "profile",
+    [
+        # decreasing
+        rate.RateProfile().ramp(100, 10, 9),
+        # non-integral increase
+        rate.RateProfile().ramp(1, 2, 3),
+        # multiple plateaus
+        rate.RateProfile().step(10, 5).step(20, 5),
+    ],
+)
+def test_phased(profile):
+    assert profile.native_flags() is None
+    assert not profile.apply(agent.client())
+    assert all(phase.duration for phase in profile.phases())
+
+
+def test_phases():
+    profile = rate.RateProfile().step(5, 2).ramp(5, 2, 3).plateau(4)
+    # ramps are discretized and the plateau holds the final rate
+    assert profile.phases() == [
+        rate.Phase(5, 3),
+        rate.Phase(4, 1),
+        rate.Phase(3, 1),
+        rate.Phase(2, 4),
+    ]
+    assert profile.calls() == 5 * 3 + 4 + 3 + 2 * 4
+    with pytest.raises(ValueError):
+        rate.RateProfile().step(1).plateau(2)
+
+
+def test_run_phases(bindsipp):
+    scen = pysipp.scenario(shards={"uac": 2}, call_count=2, limit=2)
+    scen.defaults.bin_path = bindsipp
+    profile = rate.RateProfile().step(4, 0.5).step(8, 0.5)
+    runners = rate.run_phases(scen, profile, slack=5)
+    assert len(runners) == 2
+    cmds = list(runners[1].get(timeout=0))
+    # the server takes all calls and the shards split them
+    assert "-m '4'" in cmds[0]
+    assert all("-r '4'" in cmd and "-m '2'" in cmd for cmd in cmds[1:])
@@ -0,0 +1,121 @@
+"""
+Impairment relay
+"""
+import random
+import socket
+import time
+
+import pytest
+
+import pysipp
+from pysipp import relay
+from pysipp import responder
+
+OPTIONS = (
+    "OPTIONS sip:service@127.0.0.1 SIP/2.0\r\n"
+    "Via: SIP/2.0/UDP 127.0.0.1:5061;branch=z9hG4bK-{cseq}\r\n"
+    "From: sipp <sip:sipp@127.0.0.1:5061>;tag=1\r\n"
+    "To: service <sip:service@127.0.0.1>\r\n"
+    "Call-ID: relay@test\r\n"
+    "CSeq: {cseq} OPTIONS\r\n"
+    "Content-Length: 0\r\n"
+    "\r\n"
+)
+
+
+def options(cseq=1):
+    return OPTIONS.format(cseq=cseq).encode()
+
+
+@pytest.fixture
+def udp():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(2)
+    yield sock
+    sock.close()
+
+
+@pytest.fixture
+def uas():
+    with responder.Responder() as uas:
+        yield uas
+
+
+def test_impairment():
+    with pytest.raises(ValueError):
+        relay.Impairment(loss=2)
+    with pytest.raises(ValueError):
+        relay.Impairment(distribution="pareto")
+
+    rng = random.Random(1)
+    assert relay.Impairment(delay=0.1).sample_delay(rng) == 0.1
+    for dist in relay.DISTRIBUTIONS:
+        imp = relay.Impairment(delay=0.1, jitter=0.05, distribution=dist)
+        delays = [imp.sample_delay(rng) for _ in range(1000)]
+        assert min(delays) >= 0
+        assert 0.08 < sum(delays) / len(delays) < 0.2
+    imp = relay.Impairment(distribution=lambda rng: 0.3)
+    assert imp.sample_delay(rng) == 0.3
+
+
+def test_udp_relay(udp, uas):
+    imp = relay.Impairment(delay=0.1)
+    with relay.Relay(uas.srcaddr, imp, reverse=relay.NONE) as rel:
+        start = time.time()
+        udp.sendto(options(), rel.srcaddr)
+        assert udp.recv(4096).startswith(b"SIP/2.0 200")
+        assert time.time() - start >= 0.1
+    assert uas.received["OPTIONS"] == 1
+    assert rel.stats["up.forwarded"] == rel.stats["down.forwarded"] == 1
+
+
+def test_loss_and_duplication(udp, uas):
+    with relay.Relay(uas.srcaddr, relay.Impairment(loss=1)) as rel:
+        udp.sendto(options(), rel.srcaddr)
+        with pytest.raises(socket.timeout):
+            udp.settimeout(0.2)
+            udp.recv(4096)
+    assert rel.stats["up.dropped"] == 1
+    assert not uas.received
+
+    udp.settimeout(2)
+    imp = relay.Impairment(duplicate=1)
+    with relay.Relay(uas.srcaddr, imp, reverse=relay.NONE) as rel:
+        udp.sendto(options(2), rel.srcaddr)
+        # the duplicate is answered as a retransmission
+        assert udp.recv(4096) == udp.recv(4096)
+    assert rel.stats["up.duplicated"] == 1
+    assert uas.received["OPTIONS"] == 2
+
+
+def test_tcp_relay():
+    imp = relay.Impairment(delay=0.05, jitter=0.05, bandwidth=10**6)
+    with responder.Responder(transport="tcp") as uas:
+        with relay.Relay(uas.srcaddr, imp, transport="tcp", seed=1) as rel:
+            conn = socket.create_connection(rel.srcaddr, timeout=2)
+            try:
+                for cseq in range(1, 4):
+                    conn.sendall(options(cseq))
+                buf = b""
+                while buf.count(b"SIP/2.0 200") < 3:
+                    buf += conn.recv(4096)
+            finally:
+                conn.close()
+    # in order
+    cseqs = [line for line in buf.split(b"\r\n") if line.startswith(b"CSeq")]
+    assert cseqs == [
+        "CSeq: {} OPTIONS".format(cseq).encode() for cseq in range(1, 4)
+    ]
+
+
+def test_impair_scenario():
+    scen = pysipp.scenario()
+    uac = scen.clients["uac"]
+    uas = scen.prepare_agent(scen.servers["uas"])
+    with relay.impair(scen, relay.Impairment(loss=0.1)) as relays:
+        (rel,) = relays
+        assert rel.upstream == uas.srcaddr
+        prepared = scen.prepare_agent(uac)
+        assert prepared.proxyaddr == rel.srcaddr
+        assert prepared.destaddr == uas.srcaddr
+    assert uac.proxyaddr is None
@@ -0,0 +1,99 @@
+"""
+Cached name resolution
+"""
+import socket
+
+import pytest
+
+import pysipp
+from pysipp import resolver
+
+
+class FakeSock(object):
+    """Socket module stand-in which counts lookups"""
+
+    AI_NUMERICHOST = socket.AI_NUMERICHOST
+
+    def __init__(self):
+        self.lookups = []
+
+    def getaddrinfo(self, host, *args):
+        self.lookups.append(host)
+        if host == "broken.invalid":
+            raise socket.gaierror(socket.EAI_NONAME, "unknown host")
+        if args[-1] & self.AI_NUMERICHOST:
+            return socket.getaddrinfo(host, *args)
+        return [(socket.AF_INET, 0, 0, "", ("127.0.0.1", args[0]))]
+
+    def getfqdn(self, name=""):
+        self.lookups.append(name)
+        return "host.example.com"
+
+
+class Clock(object):
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def sock():
+    return FakeSock()
+
+
+@pytest.fixture
+def res(clock, sock):
+    return resolver.Resolver(ttl=10, negative_ttl=1, clock=clock, sockmod=sock)
+
+
+def test_ip_family():
+    assert resolver.ip_family("127.0.0.1") == socket.AF_INET
+    assert resolver.ip_family("::1") == socket.AF_INET6
+    assert resolver.ip_family("localhost") is None
+    assert resolver.ip_family(None) is None
+
+
+def test_cached_lookups(res, sock, clock):
+    for _ in range(3):
+        assert res.getaddrinfo("sip.example.com", 0)[0][4][0] == "127.0.0.1"
+        assert res.getfqdn() == "host.example.com"
+    assert sock.lookups == ["sip.example.com", ""]
+
+    # expired
+    clock.now = 11
+    res.getaddrinfo("sip.example.com", 0)
+    assert sock.lookups.count("sip.example.com") == 2
+
+
+def test_negative_cache(res, sock, clock):
+    for _ in range(3):
+        with pytest.raises(socket.gaierror):
+            res.getaddrinfo("broken.invalid", 0)
+    assert sock.lookups == ["broken.invalid"]
+
+    clock.now = 2
+    with pytest.raises(socket.gaierror):
+        res.getaddrinfo("broken.invalid", 0)
+    assert len(sock.lookups) == 2
+
+
+def test_literal_fast_path(res, sock):
+    """Literal IPs are parsed but never looked up or cached"""
+    info = res.getaddrinfo("::1", 5060, socket.AF_INET6)
+    assert info[0][4][:2] == ("::1", 5060)
+    assert not res._cache
+
+
+def test_scenario_uses_cache(monkeypatch, res, sock):
+    monkeypatch.setattr(resolver, "_resolver", res)
+    pysipp.scenario()
+    pysipp.scenario()
+    # only the local fqdn (and its address) were looked up
+    assert sock.lookups.count("") == 1
+    assert sock.lookups.count("host.example.com") <= 1
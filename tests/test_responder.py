@@ -0,0 +1,143 @@
+"""
+In-process SIP responder
+"""
+import socket
+import time
+
+import pytest
+
+import pysipp
+from pysipp import responder
+
+INVITE = (
+    "{method} sip:service@127.0.0.1 SIP/2.0\r\n"
+    "Via: SIP/2.0/{transport} 127.0.0.1:5061;branch=z9hG4bK-{cseq}\r\n"
+    "f: sipp <sip:sipp@127.0.0.1:5061>;tag=1\r\n"
+    "To: service <sip:service@127.0.0.1>\r\n"
+    "Call-ID: {callid}\r\n"
+    "CSeq: {cseq} {method}\r\n"
+    "Content-Length: {length}\r\n"
+    "\r\n"
+    "{body}"
+)
+
+
+def request(method, callid="1@test", cseq=1, transport="UDP", body=""):
+    return INVITE.format(
+        method=method,
+        callid=callid,
+        cseq=cseq,
+        transport=transport,
+        length=len(body),
+        body=body,
+    ).encode()
+
+
+def status(msg):
+    return int(msg.split(b" ", 2)[1])
+
+
+@pytest.fixture
+def udp():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(2)
+    yield sock
+    sock.close()
+
+
+def test_parse_message():
+    start, headers, body = responder.parse_message(
+        request("OPTIONS", body="hi")
+    )
+    assert start == "OPTIONS sip:service@127.0.0.1 SIP/2.0"
+    # compact forms are expanded
+    assert ("from", "sipp <sip:sipp@127.0.0.1:5061>;tag=1") in headers
+    assert body == b"hi"
+    with pytest.raises(ValueError):
+        responder.parse_message(b"OPTIONS sip:x SIP/2.0\r\n")
+
+
+def test_udp_call_flow(udp):
+    with responder.Responder() as uas:
+        assert uas.port
+
+        udp.sendto(request("INVITE"), uas.srcaddr)
+        trying, ok = udp.recv(4096), udp.recv(4096)
+        assert status(trying) == 100
+        assert status(ok) == 200
+        contact = "Contact: <sip:127.0.0.1:{};".format(uas.port)
+        assert contact.encode() in ok
+        assert b"Call-ID: 1@test\r\n" in ok
+        assert b"CSeq: 1 INVITE\r\n" in ok
+        assert b";tag=" in ok.split(b"To: ")[1].split(b"\r\n")[0]
+
+        # retransmissions get the last response
+        udp.sendto(request("INVITE"), uas.srcaddr)
+        assert udp.recv(4096) == ok
+
+        udp.sendto(request("ACK"), uas.srcaddr)
+        udp.sendto(request("BYE", cseq=2), uas.srcaddr)
+        assert status(udp.recv(4096)) == 200
+        udp.sendto(request("SUBSCRIBE", cseq=3), uas.srcaddr)
+        assert status(udp.recv(4096)) == responder.UNKNOWN_CODE
+
+    assert uas.received == {
+        "INVITE": 2,
+        "ACK": 1,
+        "BYE": 1,
+        "SUBSCRIBE": 1,
+    }
+    assert uas.sent == {100: 1, 200: 2, 501: 1}
+
+
+def test_codes_and_delays(udp):
+    uas = responder.Responder(
+        codes={"INVITE": 486}, delays={"INVITE": 0.2}, provisional=(100, 180)
+    )
+    with uas:
+        start = time.time()
+        udp.sendto(request("INVITE"), uas.srcaddr)
+        codes = [status(udp.recv(4096)) for _ in range(3)]
+        assert codes == [100, 180, 486]
+        assert time.time() - start >= 0.2
+
+
+def test_tcp():
+    with responder.Responder(transport="tcp") as uas:
+        conn = socket.create_connection(uas.srcaddr, timeout=2)
+        try:
+            # two pipelined requests, one split across writes
+            data = request("OPTIONS", transport="TCP", body="x" * 10)
+            data += request("OPTIONS", cseq=2, transport="TCP")
+            conn.sendall(b"\r\n\r\n" + data[:20])
+            time.sleep(0.05)
+            conn.sendall(data[20:])
+            buf = b""
+            while buf.count(b"SIP/2.0 200") < 2:
+                buf += conn.recv(4096)
+        finally:
+            conn.close()
+    assert uas.received["OPTIONS"] == 2
+
+
+def test_scenario(udp, bindsipp):
+    """A responder stands in for the server agent of a scenario"""
+    uas = responder.Responder()
+    scen = pysipp.scenario(agents=[uas, pysipp.client()])
+    assert not scen.servers
+    assert scen.responders == [uas]
+    assert uas.port
+    assert scen.clientdefaults.destaddr == uas.srcaddr
+    assert [ua.destaddr for ua in scen.prepare()] == [uas.srcaddr]
+
+    # served only while the scenario runs
+    scen.defaults.bin_path = bindsipp
+    finalize = scen(block=False)
+    udp.sendto(request("OPTIONS"), uas.srcaddr)
+    assert status(udp.recv(4096)) == 200
+    finalize()
+    udp.settimeout(0.2)
+    with pytest.raises(socket.timeout):
+        udp.sendto(request("OPTIONS", cseq=2), uas.srcaddr)
+        udp.recv(4096)
+    assert uas.received["OPTIONS"] == 1
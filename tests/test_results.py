@@ -0,0 +1,207 @@
+"""
+Structured run results and the results database
+"""
+import os
+import shutil
+import sys
+
+import pytest
+
+import pysipp
+from pysipp import plugin
+from pysipp import results
+
+STATS = (
+    "StartTime;ElapsedTime(C);CallRate(C);TotalCallCreated;"
+    "SuccessfulCall(C);FailedCall(C);ResponseTime1(C);\n"
+    "2024-01-01\t10:00:00.000000\t1704103200.000000;00:00:05:000000;"
+    "8.5;40;38;2;00:00:00:012000;\n"
+    "2024-01-01\t10:00:00.000000\t1704103200.000000;00:00:10:500000;"
+    "9.75;100;97;3;00:00:00:015500;\n"
+)
+
+
+@pytest.fixture
+def statsipp(tmp_path):
+    """A fake sipp binary which writes a statistics file"""
+    path = tmp_path / "sipp"
+    path.write_text(
+        "#!{}\n".format(sys.executable) + "import sys\n"
+        "args = sys.argv[1:]\n"
+        "if '-stf' in args:\n"
+        "    with open(args[args.index('-stf') + 1], 'w') as f:\n"
+        "        f.write({!r})\n".format(STATS)
+    )
+    path.chmod(0o755)
+    return str(path)
+
+
+@pytest.fixture
+def sink(tmp_path):
+    return results.SQLiteSink(str(tmp_path / "results.db"), build="1.0")
+
+
+def test_parse_stats(tmp_path):
+    path = tmp_path / "stats.csv"
+    path.write_text(STATS)
+    stats = results.parse_stats(str(path))
+    assert stats["CallRate(C)"] == 9.75
+    assert stats["TotalCallCreated"] == 100
+    assert stats["ElapsedTime(C)"] == 10.5
+    assert stats["ResponseTime1(C)"] == pytest.approx(0.0155)
+    assert stats["StartTime"].startswith("2024-01-01")
+
+    path.write_text("")
+    assert results.parse_stats(str(path)) == {}
+
+
+def test_run_result(statsipp, tmp_path):
+    scen = pysipp.scenario(logdir=str(tmp_path))
+    scen.defaults.bin_path = statsipp
+    scen.clientdefaults.trace_stat = True
+    result = scen(timeout=5).result
+
+    assert result.ok
+    assert result.scenario == scen.name
+    assert list(result.exitcodes.values()) == [0, 0]
+    assert result.duration > 0
+    uas, uac = result.agents
+    assert statsipp in uac.cmd
+    assert "-trace_stat" in uac.cmd and "-stf" in uac.cmd
+    assert uac.stats["SuccessfulCall(C)"] == 97
+    # only enabled for clients
+    assert uas.stats is None
+    for ua in result.agents:
+        assert ua.duration > 0
+        assert set(ua.rusage) == set(results.RUSAGE_FIELDS)
+
+
+def test_logical_agents(sink, statsipp, tmp_path):
+    scen = pysipp.scenario(
+        logdir=str(tmp_path), shards={"uac": 2}, call_count=2, limit=2
+    )
+    scen.defaults.bin_path = statsipp
+    scen.clientdefaults.trace_stat = True
+    with plugin.register([sink]):
+        result = scen(timeout=5).result
+
+    assert [ua.name for ua in result.agents] == ["uas", "uac.0", "uac.1"]
+    assert [ua.logical_name for ua in result.agents] == [None, "uac", "uac"]
+    uas, uac = result.logical_agents
+    assert uas is result.agents[0] and not uas.client
+    assert uac.name == "uac" and uac.client
+    assert uac.returncode == 0 and uac.cmd is None
+    # counters and rates are summed, times averaged
+    assert uac.stats["SuccessfulCall(C)"] == 2 * 97
+    assert uac.stats["CallRate(C)"] == 2 * 9.75
+    assert uac.stats["ElapsedTime(C)"] == 10.5
+    assert uac.duration == max(ua.duration for ua in result.agents[1:])
+
+    # metrics are recorded per logical agent
+    values = sink.metrics(scen.name, "CallRate(C)")
+    assert [(agent, value) for _, _, agent, value in values] == [("uac", 19.5)]
+    (stored,) = sink.run_results("1.0")
+    assert stored.exitcodes == result.exitcodes
+    assert stored.logical_agents[1].stats == uac.stats
+
+    # the first failing shard's exit code is the agent's
+    agents = [
+        results.AgentResult("uac.{}".format(i), "", rc, 1.0, None, None, "uac")
+        for i, rc in enumerate([0, 3, 4])
+    ]
+    (uac,) = results.RunResult("scen", agents).logical_agents
+    assert uac.returncode == 3 and uac.rusage is None
+
+
+def test_failure_result(sink):
+    scen = pysipp.scenario()
+    scen.defaults.bin_path = "false"
+    with plugin.register([sink]):
+        with pytest.raises(pysipp.SIPpFailure) as err:
+            scen(timeout=5)
+    result = err.value.result
+    assert not result.ok
+    assert 1 in result.exitcodes.values()
+    run = sink.runs()[0]
+    assert run["scenario"] == scen.name
+    assert not run["ok"]
+
+
+def test_sink(sink, statsipp, tmp_path):
+    scen = pysipp.scenario(logdir=str(tmp_path))
+    scen.defaults.bin_path = statsipp
+    scen.defaults.trace_stat = True
+    with plugin.register([sink]):
+        scen(timeout=5)
+        scen(timeout=5)
+    sink.build = "1.1"
+    with plugin.register([sink]):
+        scen(timeout=5)
+    assert len(sink.runs()) == 3
+    assert len(sink.runs(scenario=scen.name, build="1.1")) == 1
+    assert sink.runs(scenario="nope") == []
+    assert sink.builds() == ["1.0", "1.1"]
+
+    values = sink.metrics(scen.name, "CallRate(C)", agent="uac")
+    assert [(build, value) for _, build, _, value in values] == [
+        ("1.0", 9.75),
+        ("1.0", 9.75),
+        ("1.1", 9.75),
+    ]
+    trend = sink.trend(scen.name, "TotalCallCreated")
+    assert [(row["build"], row["count"]) for row in trend] == [
+        ("1.0", 4),
+        ("1.1", 2),
+    ]
+    assert trend[0]["mean"] == 100
+    assert sink.trend(scen.name, "duration", agent="uas")[0]["count"] == 2
+    # non numeric stats aren't metrics
+    assert not sink.metrics(scen.name, "StartTime")
+
+
+@pytest.fixture
+def scentree(tmp_path, scendir):
+    root = tmp_path / "scens"
+    shutil.copytree(os.path.join(scendir, "default"), str(root / "default"))
+    return root
+
+
+def walk(root, cache, bin_path):
+    return [
+        scen
+        for _, scen in pysipp.walk(
+            str(root), cache=cache, defaults={"bin_path": bin_path}
+        )
+    ]
+
+
+def test_result_cache(scentree, bindsipp, tmp_path):
+    path = str(tmp_path / "cache.json")
+    with results.ResultCache(path, token="1.0") as cache:
+        (scen,) = walk(scentree, cache, bindsipp)
+        key = cache.key(scen)
+        assert not cache.passed(scen)
+        scen(timeout=5)
+        assert cache.passed(scen)
+        # ports allocated per scenario instance don't matter
+        (scen,) = walk(scentree, None, bindsipp)
+        assert cache.key(scen) == key
+        assert walk(scentree, cache, bindsipp) == []
+    assert os.path.isfile(path)
+
+    # passes are persisted
+    cache = results.ResultCache(path, token="1.0")
+    assert cache.passed(scen)
+    assert walk(scentree, cache, bindsipp) == []
+    # a new build (token) or changed inputs invalidate passes
+    assert len(walk(scentree, results.ResultCache(path), bindsipp)) == 1
+    xml = scentree / "default" / "uac.xml"
+    xml.write_text(xml.read_text() + "\n")
+    (scen,) = walk(scentree, cache, bindsipp)
+
+    # failures are not cached
+    with cache:
+        scen.defaults.bin_path = "false"
+        with pytest.raises(pysipp.SIPpFailure):
+            scen(timeout=5)
+    assert not cache.passed(scen)
@@ -0,0 +1,152 @@
+"""
+sippfmt formatting
+"""
+import glob
+import io
+import os
+from xml.parsers import expat
+
+import pytest
+
+from pysipp.cli import sippfmt
+
+SCENS = glob.glob(
+    os.path.join(os.path.dirname(__file__), "scens", "*", "*.xml")
+)
+
+SAMPLES = {
+    "adjacent_comments": (
+        '<scenario name="x"><!-- a --><!-- b --><!-- c -->'
+        '<send retrans="500" request="INVITE"><![CDATA[\n'
+        "   INVITE sip:x SIP/2.0\n     Via: y\n\n]]></send>"
+        '<!--d--><recv response="200"/><pause/></scenario>'
+    ),
+    "comment_then_element": (
+        '<scenario><!--c--><send/><recv response="100" optional="true">'
+        '<!--x--><action><exec int_cmd="stop"/></action></recv>\n'
+        "<?pi data?><nop/><nop><action><!--z--><!--w--><assign a='1'/>"
+        "</action></nop></scenario>"
+    ),
+    "cdata": (
+        "<scenario><send><![CDATA[a]]><![CDATA[ b ]]>text<![CDATA[]]>"
+        "<![CDATA[c]]></send><recv><!--q--><![CDATA[skipped]]>"
+        "<![CDATA[kept &amp; <x>]]></recv></scenario>"
+    ),
+    "nested": (
+        '<scenario><label id="1"/><recv request="ACK" crlf="true">'
+        '<action><ereg regexp="a&amp;b&quot;" search_in="msg" '
+        'assign_to="1,2"/></action></recv>text<![CDATA[top]]></scenario>'
+    ),
+    "empty": '<scenario a="1"/>',
+    "unicode": (
+        '<?xml version="1.0" encoding="UTF-8"?><scenario name="é">'
+        "<send><![CDATA[hé☃\r\n  x]]></send><!-- ☃ -->"
+        "</scenario>"
+    ),
+    "text": "<scenario>a&amp;b<!--c-->x&lt;y<send/></scenario>",
+}
+
+
+def dom_format(path):
+    doc = sippfmt.process_document(path)
+    return doc.toprettyxml(indent="  ", encoding=sippfmt.ENCODING)
+
+
+def stream_format(path):
+    out = io.BytesIO()
+    with open(path, "rb") as infile:
+        sippfmt.format_stream(infile, out)
+    return out.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def cachedir(tmpdir, monkeypatch):
+    path = tmpdir.mkdir("cache")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(path))
+    return path
+
+
+@pytest.fixture(params=sorted(SAMPLES))
+def sample(request, tmpdir):
+    path = tmpdir.join(request.param + ".xml")
+    path.write_text(SAMPLES[request.param], encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("path", SCENS)
+def test_stream_matches_dom(path):
+    assert stream_format(path) == dom_format(path)
+
+
+@pytest.mark.parametrize("chunk_size", [1, sippfmt.CHUNK_SIZE])
+def test_stream_matches_dom_samples(sample, chunk_size, monkeypatch):
+    monkeypatch.setattr(sippfmt, "CHUNK_SIZE", chunk_size)
+    assert stream_format(sample) == dom_format(sample)
+
+
+def test_invalid(tmpdir):
+    path = tmpdir.join("bad.xml")
+    path.write("<scenario><send></scenario>")
+    with pytest.raises(expat.ExpatError):
+        stream_format(str(path))
+    path.write("<notascenario/>")
+    with pytest.raises(ValueError):
+        stream_format(str(path))
+
+
+def write_samples(tmpdir):
+    for name, text in SAMPLES.items():
+        tmpdir.mkdir(name).join("scen.xml").write_text(text, encoding="utf-8")
+    return str(tmpdir)
+
+
+def test_check_and_in_place(tmpdir, capsys):
+    root = write_samples(tmpdir.mkdir("tree"))
+    expected = {
+        path: stream_format(path)
+        for path in sippfmt.iter_paths([root], recursive=True)
+    }
+    assert len(expected) == len(SAMPLES)
+
+    assert sippfmt.main(["-r", root, "--check", "--jobs", "2"]) == 1
+    assert sippfmt.main(["-r", root, "--in-place", "--jobs", "2"]) == 0
+    for path, output in expected.items():
+        with open(path, "rb") as f:
+            assert f.read() == output
+    capsys.readouterr()
+    # formatting is idempotent
+    assert sippfmt.main(["-r", root, "--check"]) == 0
+    assert "would reformat" not in capsys.readouterr().err
+
+
+def test_cache(tmpdir, cachedir, monkeypatch):
+    root = write_samples(tmpdir.mkdir("tree"))
+    paths = list(sippfmt.iter_paths([root], recursive=True))
+    cache = sippfmt.FormatCache(str(cachedir.join("fmt.json")))
+
+    # only formatted content is cached
+    results = list(sippfmt.check_paths(paths, cache=cache))
+    assert all(changed for _, changed, _ in results)
+    assert not len(cache)
+    list(sippfmt.check_paths(paths, in_place=True, cache=cache))
+    assert len(cache) == len(paths)
+    cache.save()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("formatter invoked")
+
+    # formatted files are now skipped
+    monkeypatch.setattr(sippfmt, "_check_path", fail)
+    cache = sippfmt.FormatCache(cache.path)
+    results = list(sippfmt.check_paths(paths, cache=cache))
+    assert [path for path, _, _ in results] == paths
+    assert not any(changed or error for _, changed, error in results)
+
+    # changed content or a new formatter version misses
+    with open(paths[0], "a") as f:
+        f.write("\n")
+    with pytest.raises(AssertionError):
+        list(sippfmt.check_paths(paths, cache=cache))
+    monkeypatch.setattr(sippfmt, "FORMAT_VERSION", sippfmt.FORMAT_VERSION + 1)
+    with pytest.raises(AssertionError):
+        list(sippfmt.check_paths(paths[1:], cache=cache))
@@ -3,10 +3,14 @@ End to end tests with plugin support
 """
 import functools
 import os
+import shutil
+import socket
+import threading
 
 import pytest
 
 import pysipp
+from pysipp import netplug
 
 
 @pytest.fixture
@@ -37,6 +41,110 @@ def test_collect(scenwalk):
     assert len(list(scenwalk())) == 1
 
 
+@pytest.mark.parametrize("ordered", [True, False], ids="ordered={}".format)
+def test_concurrent_collect(scendir, ordered):
+    """Verify collecting with a worker pool delivers the same scenarios"""
+    expect = [(path, scen.name) for path, scen in pysipp.walk(scendir)]
+    collected = [
+        (path, scen.name)
+        for path, scen in pysipp.walk(scendir, workers=4, ordered=ordered)
+    ]
+    if ordered:
+        assert collected == expect
+    else:
+        assert sorted(collected) == sorted(expect)
+
+
+def test_lazy_confpy(scendir, tmp_path):
+    """Verify pysipp_conf.py modules are only imported for collected
+    scenarios
+    """
+    path = tmp_path / "lazy"
+    shutil.copytree(scendir + "/default_with_confpy", str(path))
+    marker = path / "imported"
+    with open(str(path / "pysipp_conf.py"), "a") as f:
+        f.write("\nopen('{}', 'w').close()\n".format(marker))
+
+    class blockall(object):
+        @pysipp.plugin.hookimpl
+        def pysipp_load_scendir(self, path, xmls, confpy):
+            return False
+
+    with pysipp.plugin.register([blockall()]):
+        assert not list(pysipp.walk(str(tmp_path)))
+    assert not marker.exists()
+
+    path, scen = next(pysipp.walk(str(tmp_path)))
+    assert marker.exists()
+    assert scen.mod.loaded
+
+
+def test_concurrent_hook_contexts():
+    """Plugins registered in one thread must not be visible to scenarios
+    configured concurrently in another.
+    """
+
+    class Tagger(object):
+        def __init__(self, tag):
+            self.tag = tag
+            self.calls = 0
+
+        @pysipp.plugin.hookimpl
+        def pysipp_conf_scen(self, agents, scen):
+            self.calls += 1
+            scen.uri_username = self.tag
+
+    barrier = threading.Barrier(2)
+    results = {}
+
+    def configure(tag):
+        tagger = Tagger(tag)
+        with pysipp.plugin.register([tagger]):
+            # both taggers are registered at the same time
+            barrier.wait(timeout=5)
+            scen = pysipp.scenario()
+        results[tag] = tagger.calls, scen.uri_username
+
+    threads = [
+        threading.Thread(target=configure, args=(tag,))
+        for tag in ("doggy", "kitty")
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == {"doggy": (1, "doggy"), "kitty": (1, "kitty")}
+
+
+def test_hook_context_delta():
+    """A context only registers its own plugins and calls them after those
+    of its parent, leaving the parent untouched.
+    """
+    calls = []
+
+    class Tagger(object):
+        def __init__(self, tag):
+            self.tag = tag
+
+        @pysipp.plugin.hookimpl
+        def pysipp_conf_scen(self, agents, scen):
+            calls.append(self.tag)
+
+    first, second = Tagger("first"), Tagger("second")
+    base = pysipp.plugin.PluginManager()
+    parent = pysipp.plugin.context([first], parent=base)
+    child = pysipp.plugin.context([second], parent=parent)
+    assert child.get_plugins() == {second}
+    assert parent.get_plugins() == {first}
+
+    child.hook.pysipp_conf_scen(agents={}, scen=None)
+    assert calls == ["second", "first"]
+    del calls[:]
+    parent.hook.pysipp_conf_scen(agents={}, scen=None)
+    assert calls == ["first"]
+
+
 def test_confpy_hooks(scendir):
     """Test that hooks included in a confpy file work
 
@@ -183,3 +291,80 @@ def test_autonet_overrides(dictname, data):
     for key, val in data.items():
         for ua in agents.values():
             assert getattr(ua, key) == val
+
+
+def test_bind_failure_relaunch(bindsipp):
+    """Agents which fail to bind their auto-allocated ports are relaunched
+    on new ports with dependent agents re-routed.
+    """
+    scen = pysipp.scenario(bind_retries=1)
+    scen.defaults.bin_path = bindsipp
+    uas = scen.agents["uas"]
+    oldaddr = uas.srcaddr
+
+    # steal the server's port
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(oldaddr)
+    try:
+        runner = scen(timeout=5)
+    finally:
+        sock.close()
+
+    assert all(not proc.returncode for proc in runner.get(timeout=0).values())
+    assert uas.srcaddr != oldaddr
+    uas, uac = scen.prepare()
+    assert uac.destaddr == uas.srcaddr
+
+
+def test_bind_failure_rerun(bindsipp, monkeypatch):
+    """Auto-allocated ports taken between runs are reallocated"""
+    scen = pysipp.scenario(bind_retries=1)
+    scen.defaults.bin_path = bindsipp
+    scen(timeout=5)
+    uas = scen.agents["uas"]
+
+    for relock in (True, False):
+        if not relock:
+            # the port is stolen after it was leased again
+            monkeypatch.setattr(netplug, "relock", lambda scen, agents: None)
+        oldaddr = uas.srcaddr
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(oldaddr)
+        try:
+            runner = scen(timeout=5)
+        finally:
+            sock.close()
+
+        procs = runner.get(timeout=0).values()
+        assert all(not proc.returncode for proc in procs)
+        assert uas.srcaddr != oldaddr
+        prepared = scen.prepare()
+        assert prepared[1].destaddr == uas.srcaddr
+
+    # only auto-allocated ports are moved
+    assert netplug.reallocate(scen, prepared, prepared[0])
+    scen = pysipp.scenario(defaults={"local_port": 5070, "media_port": 5090})
+    prepared = scen.prepare()
+    assert not netplug.reallocate(scen, prepared, prepared[0])
+
+
+def test_bind_failure_no_retries(bindsipp):
+    scen = pysipp.scenario()
+    scen.defaults.bin_path = bindsipp
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(scen.agents["uas"].srcaddr)
+    try:
+        with pytest.raises(pysipp.SIPpFailure):
+            scen(timeout=5)
+    finally:
+        sock.close()
+
+
+def test_sharded_run(bindsipp):
+    """Shards of an agent run in parallel on distinct sockets"""
+    scen = pysipp.scenario(call_count=8, limit=4, shards={"uac": 4})
+    scen.defaults.bin_path = bindsipp
+    runner = scen(timeout=5)
+    procs = list(runner.get(timeout=0).values())
+    assert len(procs) == 5
+    assert all(proc.returncode == 0 for proc in procs)
@@ -1,4 +1,4 @@
-import os.path
+import os
 
 import pytest
 
@@ -13,3 +13,87 @@ def test_load_mod(scendir):
 def test_load_mod_ko():
     with pytest.raises(FileNotFoundError):
         utils.load_mod("not_here.py")
+
+
+def test_lazy_mod(tmp_path):
+    src = tmp_path / "lazy_conf.py"
+    src.write_text("import os\ndoggy = os.getpid()\n")
+    mod = utils.LazyMod(str(src), name="lazy_doggy")
+    assert mod.__file__ == str(src)
+    assert mod.__name__ == "lazy_doggy"
+    assert not mod.loaded
+
+    assert mod.doggy == os.getpid()
+    assert mod.loaded
+    assert "doggy" in dir(mod)
+
+
+def test_code_cache(tmp_path):
+    src = tmp_path / "cached.py"
+    src.write_text("val = 1\n")
+    code = utils.get_code(str(src))
+    assert utils.get_code(str(src)) is code
+    assert utils.load_mod(str(src)).val == 1
+
+    # modifications invalidate the cache
+    src.write_text("val = 10\n")
+    assert utils.get_code(str(src)) is not code
+    assert utils.load_mod(str(src)).val == 10
+
+
+def test_json_key_set(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    path = utils.cache_path("keys.json")
+    assert path == str(tmp_path / "pysipp" / "keys.json")
+
+    keys = utils.JSONKeySet(path, max_entries=2)
+    keys.add("a")
+    keys.add("b")
+    assert "a" in keys
+    # the least recently used key is evicted
+    keys.add("c")
+    assert list(keys._keys) == ["a", "c"]
+    keys.save()
+    assert os.listdir(os.path.dirname(path)) == ["keys.json"]
+
+    keys = utils.JSONKeySet(path)
+    assert len(keys) == 2 and "c" in keys
+    keys.discard("c")
+    keys.save()
+    assert "c" not in utils.JSONKeySet(path)
+
+    # other versions and corrupt files are ignored
+    assert utils.load_json(path, version=2) == {}
+    with open(path, "w") as f:
+        f.write("{")
+    assert not len(utils.JSONKeySet(path))
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_imap_window(ordered):
+    consumed = []
+
+    def items():
+        for i in range(50):
+            consumed.append(i)
+            yield i
+
+    with utils.thread_pool(2) as pool:
+        results = utils.imap(
+            lambda i: i * 2, items(), pool=pool, ordered=ordered, window=4
+        )
+        first = next(results)
+        # input is only consumed as results are delivered
+        assert len(consumed) == 5
+        rest = list(results)
+    assert len(consumed) == 50
+    if ordered:
+        assert [first] + rest == [i * 2 for i in range(50)]
+    assert sorted([first] + rest) == [i * 2 for i in range(50)]
+
+
+def test_sipp_num():
+    assert utils.sipp_num(10.0) == 10
+    assert isinstance(utils.sipp_num(10.0), int)
+    assert utils.sipp_num(1 / 3) == 0.333
+    assert utils.sipp_num(2.5) == 2.5